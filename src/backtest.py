@@ -0,0 +1,324 @@
+import math
+import numpy as np
+import pandas as pd
+
+from src.constants import *
+from src.rolling import rolling_mean, jit_enabled, HAVE_NUMBA
+from src.stocks import StockChart, StockPanel
+
+# The default memory budget, in bytes, for the working arrays of a parameter sweep
+SWEEP_MEMORY = 2 ** 28
+# The statistics from a parameter sweep, in the order the compiled sweep returns them
+SWEEP_STATISTICS = ['total_return', 'annual_return', 'annual_volatility', 'sharpe', 'max_drawdown', 'turnover']
+
+
+def total_returns(close, dividends=None, splits=None):
+    """
+    The daily total return of holding the stock: the change in the close adjusted for splits (so a 2:1 split
+    isn't a 50% loss) plus the dividends paid on the ex-date
+    :param close: array (dates x tickers) of the unadjusted closes, in ascending date order
+    :param dividends: array of the DIVIDEND_AMT on each date, or None
+    :param splits: array of the SPLIT_COEFFICIENT on each date, or None
+    :return: an array the shape of close, the first day and days without a close have a return of 0
+    """
+    close = np.asarray(close, dtype=float)
+    previous = np.full_like(close, np.nan)
+    previous[1:] = close[:-1]
+    split = 1. if splits is None else np.nan_to_num(np.asarray(splits, dtype=float), nan=1.)
+    dividend = 0. if dividends is None else np.nan_to_num(np.asarray(dividends, dtype=float))
+    with np.errstate(all='ignore'):
+        returns = (close * split + dividend) / previous - 1
+    return np.where(np.isfinite(returns), returns, 0.)
+
+
+def _market_data(data):
+    """
+    :param data: a StockChart, StockPanel or dataframe of bars (indexed on date, ascending)
+    :return: a tuple of (dates, tickers, close, total returns) where the arrays are dates x tickers
+    """
+    if isinstance(data, StockPanel):
+        fields = data.fields
+        close = fields[DAY_CLOSE]
+        # the panel's bars are compacted so that the return after a missing bar is from the bar before it
+        column = lambda name: data._compact(fields[name]) if name in fields else None
+        returns = data._expand(total_returns(data._compact(close), column(DIVIDEND_AMT), column(SPLIT_COEFFICIENT)))
+        return data.dates, data.tickers, close, np.nan_to_num(returns)
+    ticker = data.ticker if isinstance(data, StockChart) else None
+    df = data.data if isinstance(data, StockChart) else data
+    df = df.sort_index()
+    close = df[[DAY_CLOSE]].to_numpy(dtype=float)
+    column = lambda name: df[[name]].to_numpy(dtype=float) if name in df.columns else None
+    return df.index, [ticker], close, total_returns(close, column(DIVIDEND_AMT), column(SPLIT_COEFFICIENT))
+
+
+def _holdings(signals, lag):
+    """
+    The position held over each day: the signal from <lag> days before, flat before the first signal
+    """
+    held = np.zeros_like(signals)
+    if lag == 0:
+        held[...] = signals
+    else:
+        held[..., lag:, :] = signals[..., :-lag, :]
+    return held
+
+
+def _turnover(held):
+    return np.abs(np.diff(held, axis=-2, prepend=0.))
+
+
+def performance(returns, periods=ANN_TRADE_DAYS):
+    """
+    Performance statistics along the time axis (the second to last axis) of an array of daily returns
+    :param returns: an array (..., dates, tickers) of daily returns
+    :param periods: the number of periods in a year
+    :return: a dictionary of arrays (..., tickers) with the total_return, annual_return, annual_volatility,
+        sharpe (without a risk-free rate) and max_drawdown
+    """
+    returns = np.asarray(returns, dtype=float)
+    n = returns.shape[-2]
+    equity = np.cumprod(1 + returns, axis=-2)
+    peak = np.maximum.accumulate(equity, axis=-2)
+    np.maximum(peak, 1., out=peak)
+    drawdown = np.max(1 - equity / peak, axis=-2)
+    total = equity[..., -1, :] - 1
+    mean = returns.sum(axis=-2) / n
+    variance = (np.einsum('...ij,...ij->...j', returns, returns) - n * mean ** 2) / (n - 1)
+    volatility = np.sqrt(np.maximum(variance, 0.) * periods)
+    with np.errstate(all='ignore'):
+        sharpe = mean * periods / volatility
+    return {'total_return': total,
+            'annual_return': (1 + total) ** (periods / n) - 1,
+            'annual_volatility': volatility,
+            'sharpe': np.where(volatility > 0, sharpe, np.nan),
+            'max_drawdown': drawdown}
+
+
+class BacktestResult:
+    """
+    The daily results of a backtest.  The arrays are (..., dates, tickers) where the leading axes are the
+    parameter grid of the signals.
+    """
+
+    def __init__(self, dates, tickers, positions, turnover, returns, costs):
+        self.dates = dates
+        self.tickers = tickers
+        # the position held over each day and the change in the position traded at the close before it
+        self.positions = positions
+        self.turnover = turnover
+        # the daily returns after costs and the costs
+        self.returns = returns
+        self.costs = costs
+
+    def equity(self):
+        """
+        :return: the growth of $1 in each ticker, or a dataframe (dates x tickers) when there is no grid
+        """
+        equity = np.cumprod(1 + self.returns, axis=-2)
+        if equity.ndim == 2:
+            return pd.DataFrame(equity, index=self.dates, columns=self.tickers)
+        return equity
+
+    def portfolio_returns(self):
+        """
+        :return: the daily returns of putting an equal amount of capital into each ticker's strategy
+        """
+        return self.returns.mean(axis=-1)
+
+    def statistics(self, periods=ANN_TRADE_DAYS):
+        """
+        :return: see performance, a dataframe (tickers x statistics) when there is no grid
+        """
+        stats = performance(self.returns, periods)
+        stats['turnover'] = self.turnover.sum(axis=-2) / len(self.dates) * periods
+        if self.returns.ndim == 2:
+            return pd.DataFrame(stats, index=self.tickers)
+        return stats
+
+
+def run_backtest(data, signals, cost=0., slippage=0., lag=1):
+    """
+    Simulate holding the target positions given by the signals.  The whole history (and every set of signals in
+    the grid) is simulated at once with array operations.
+    The signal on day t sets the position held over day t + lag, so with the default lag of 1 a signal calculated
+    from today's close is traded at today's close and earns tomorrow's return (a lag of 0 looks ahead).  The
+    returns are total returns, adjusted for the splits and dividends in the SPLIT_COEFFICIENT and DIVIDEND_AMT
+    columns, and the costs are charged on the change in the position.
+    :param data: a StockChart, StockPanel or dataframe of bars (indexed on date)
+    :param signals: the target position in each ticker as a fraction of its capital (1 long, 0 flat, -1 short),
+        an array (..., dates, tickers) whose leading axes are a parameter grid, or a series/dataframe for a
+        single ticker/panel
+    :param cost: the commission as a fraction of the amount traded, e.g. 0.0005 for 5bps, can be an array that
+        broadcasts against the tickers
+    :param slippage: the difference between the close and the price traded at, as a fraction of the amount
+        traded
+    :param lag: the number of days between the signal and holding the position
+    :return: a BacktestResult
+    """
+    dates, tickers, close, returns = _market_data(data)
+    return _simulate(dates, tickers, returns, signals, cost, slippage, lag)
+
+
+def _simulate(dates, tickers, returns, signals, cost, slippage, lag):
+    signals = np.asarray(signals, dtype=float)
+    if signals.ndim == 1:
+        signals = signals[:, None]
+    held = _holdings(np.nan_to_num(signals), lag)
+    turnover = _turnover(held)
+    costs = turnover * (np.asarray(cost) + np.asarray(slippage))
+    return BacktestResult(dates, tickers, held, turnover, held * returns - costs, costs)
+
+
+def _crossover(averages, index, fast, slow, short):
+    """
+    The crossover signals from the stacked moving averages (windows x dates x tickers)
+    """
+    above = averages[[index[w] for w in fast]] > averages[[index[w] for w in slow]]
+    # no position until both moving averages are known
+    known = np.isfinite(averages[[index[w] for w in np.maximum(fast, slow)]])
+    if not short:
+        return (above & known).astype(float)
+    return np.where(known, np.where(above, 1., -1.), 0.)
+
+
+def crossover_signals(prices, fast, slow, short=False):
+    """
+    Moving average crossover signals: long when the fast moving average is above the slow one
+    :param prices: array (dates x tickers) of prices, e.g. from total_return_index
+    :param fast: the fast window, or a list of them
+    :param slow: the slow window, or a list of them (the same length as fast)
+    :param short: if True then short when the fast moving average is below the slow one, otherwise flat
+    :return: an array (pairs x dates x tickers), or (dates x tickers) for a single pair
+    """
+    single = np.ndim(fast) == 0
+    fast, slow = np.atleast_1d(fast), np.atleast_1d(slow)
+    prices = np.asarray(prices, dtype=float)
+    prices = prices.reshape(len(prices), -1)
+    windows = sorted(set(fast) | set(slow))
+    averages = rolling_mean(prices, windows)
+    signals = _crossover(averages, {w: i for i, w in enumerate(windows)}, fast, slow, short)
+    return signals[0] if single else signals
+
+
+if HAVE_NUMBA:
+    import numba
+
+    @numba.njit(cache=True)
+    def _jit_sweep(averages, fast, slow, returns, cost, lag, short, periods):
+        """
+        Simulate every crossover pair on every ticker in one pass over the dates, keeping only the statistics
+        :param averages: the moving averages (windows x tickers x dates)
+        :param fast: the index into averages of the fast window of each pair
+        :param slow: the index of the slow window
+        :param returns: the total returns (tickers x dates)
+        :param cost: the cost per unit traded for each ticker
+        :return: an array (statistics x pairs x tickers) in the order of SWEEP_STATISTICS
+        """
+        n_pairs = len(fast)
+        n_tickers, n = returns.shape
+        out = np.full((6, n_pairs, n_tickers), np.nan)
+        for p in range(n_pairs):
+            for j in range(n_tickers):
+                fa = averages[fast[p], j]
+                sa = averages[slow[p], j]
+                held = 0.
+                equity = 1.
+                peak = 1.
+                drawdown = 0.
+                total = 0.
+                squares = 0.
+                turnover = 0.
+                for t in range(n):
+                    signal = 0.
+                    if t >= lag and math.isfinite(fa[t - lag]) and math.isfinite(sa[t - lag]):
+                        signal = 1. if fa[t - lag] > sa[t - lag] else (-1. if short else 0.)
+                    traded = abs(signal - held)
+                    held = signal
+                    r = held * returns[j, t] - traded * cost[j]
+                    total += r
+                    squares += r * r
+                    turnover += traded
+                    equity *= 1 + r
+                    peak = max(peak, equity)
+                    drawdown = max(drawdown, 1 - equity / peak)
+                mean = total / n
+                volatility = math.sqrt(max((squares - n * mean * mean) / (n - 1), 0.) * periods)
+                out[0, p, j] = equity - 1
+                out[1, p, j] = equity ** (periods / n) - 1
+                out[2, p, j] = volatility
+                out[3, p, j] = mean * periods / volatility if volatility > 0 else np.nan
+                out[4, p, j] = drawdown
+                out[5, p, j] = turnover / n * periods
+        return out
+
+
+def total_return_index(data):
+    """
+    :return: the growth of $1 held in each ticker (dates x tickers), for calculating signals that aren't thrown off
+        by splits and dividends
+    """
+    dates, tickers, close, returns = _market_data(data)
+    return np.cumprod(1 + returns, axis=0)
+
+
+def _ticker_block(value, n_tickers, columns):
+    """
+    :return: the cost (or slippage) for a block of tickers, the ticker axis is the last one
+    """
+    value = np.asarray(value, dtype=float)
+    return np.broadcast_to(value, value.shape[:-1] + (n_tickers,))[..., columns]
+
+
+def sweep_crossovers(data, fast, slow, cost=0., slippage=0., lag=1, short=False, memory=SWEEP_MEMORY):
+    """
+    Backtest every (fast, slow) moving average crossover on every ticker.  The moving averages are calculated
+    from the total return index, each distinct window once, and the pairs are simulated in blocks of pairs and
+    tickers that fit in <memory> bytes so that only the statistics are kept.  When numba is installed (see
+    src.rolling.use_jit) each pair is simulated in a single compiled pass over the dates instead.
+
+    Example:
+    stats = sweep_crossovers(panel, *zip(*[(f, s) for f in range(5, 105) for s in range(20, 220, 2) if f < s]))
+    stats['sharpe'].idxmax()
+    :param data: a StockChart, StockPanel or dataframe of bars (indexed on date)
+    :param fast: list of the fast windows
+    :param slow: list of the slow windows, one for each fast window
+    :param memory: the approximate number of bytes to use for the working arrays
+    :return: a dictionary of dataframes (pairs x tickers) for each statistic (see BacktestResult.statistics),
+        indexed on (fast, slow)
+    """
+    dates, tickers, close, returns = _market_data(data)
+    # the same gap free index as total_return_index, so each pair gives the same result as run_backtest
+    prices = np.cumprod(1 + returns, axis=0)
+    fast, slow = np.atleast_1d(fast), np.atleast_1d(slow)
+    n_dates = len(dates)
+    windows = sorted(set(fast) | set(slow))
+    index = {w: i for i, w in enumerate(windows)}
+    # split the budget between the moving averages of a block of tickers and ~8 working arrays for the pairs
+    block = max(1, min(len(tickers), memory // 2 // (8 * n_dates * len(windows))))
+    pairs_block = max(1, memory // 2 // (8 * 8 * n_dates * block))
+    trading_cost = np.asarray(cost) + np.asarray(slippage)
+    compiled = jit_enabled() and trading_cost.ndim <= 1
+    stats = {name: np.full((len(fast), len(tickers)), np.nan) for name in SWEEP_STATISTICS}
+    for start in range(0, len(tickers), block):
+        columns = slice(start, start + block)
+        averages = rolling_mean(prices[:, columns], windows)
+        if compiled:
+            # one pass over the dates for every pair, without the working arrays
+            results = _jit_sweep(np.ascontiguousarray(averages.transpose(0, 2, 1)),
+                                 np.array([index[w] for w in fast]), np.array([index[w] for w in slow]),
+                                 np.ascontiguousarray(returns[:, columns].T),
+                                 _ticker_block(trading_cost, len(tickers), columns),
+                                 lag, short, ANN_TRADE_DAYS)
+            for name, values in zip(SWEEP_STATISTICS, results):
+                stats[name][:, columns] = values
+            continue
+        for first in range(0, len(fast), pairs_block):
+            pairs = slice(first, first + pairs_block)
+            signals = _crossover(averages, index, fast[pairs], slow[pairs], short)
+            result = _simulate(dates, tickers[columns], returns[:, columns], signals,
+                               _ticker_block(cost, len(tickers), columns),
+                               _ticker_block(slippage, len(tickers), columns), lag)
+            for name, values in result.statistics().items():
+                stats[name][pairs, columns] = values
+    pairs = pd.MultiIndex.from_arrays([fast, slow], names=['fast', 'slow'])
+    return {name: pd.DataFrame(values, index=pairs, columns=tickers) for name, values in stats.items()}
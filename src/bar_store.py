@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from src.constants import *
+
+# The columns kept in the store and the dtype of each
+# The volume is a float (rather than an int) so that a missing bar can be stored as NaN
+BAR_COLUMNS = {OPEN_PRICE: np.float64, DAY_HIGH: np.float64, DAY_LOW: np.float64, DAY_CLOSE: np.float64,
+               ADJ_CLOSE: np.float64, DAY_VOLUME: np.float64, DIVIDEND_AMT: np.float64,
+               SPLIT_COEFFICIENT: np.float64}
+DATE_FILE = 'date.npy'
+META_FILE = 'meta.json'
+
+
+def _column_file(column):
+    return f"{column.replace(' ', '_')}.npy"
+
+
+class BarStore:
+    """
+    Keep each ticker's bars as one contiguous, fixed dtype .npy file per column (plus one for the dates) in
+    <folder>/<ticker>/.  Opening a ticker memory maps the files, so it takes the same time no matter how long
+    the history is, nothing is copied until it is touched, and every process that opens the same ticker shares
+    one copy in the page cache.
+    """
+
+    def __init__(self, folder=DS_PROCESSED / 'bars'):
+        self.folder = folder
+
+    def _ticker_path(self, ticker):
+        return self.folder / ticker
+
+    def tickers(self):
+        """
+        :return: a list of the tickers in the store
+        """
+        if not self.folder.exists():
+            return []
+        return sorted(p.name for p in self.folder.iterdir() if (p / META_FILE).exists())
+
+    def write(self, ticker, df):
+        """
+        Write (or replace) the bars for a ticker.  The files are written to a temporary folder that is swapped in
+        at the end so that readers never see a partially written ticker
+        :param ticker: the ticker symbol
+        :param df: a dataframe indexed on date with any of the BAR_COLUMNS
+        :return: the path to the ticker's folder
+        """
+        df = df.sort_index()
+        path = self._ticker_path(ticker)
+        tmp_path = path.with_name(f'.{ticker}.tmp')
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+        tmp_path.mkdir(parents=True)
+        np.save(tmp_path / DATE_FILE, pd.DatetimeIndex(pd.to_datetime(df.index)).values.astype('datetime64[ns]'))
+        columns = [c for c in BAR_COLUMNS if c in df.columns]
+        for column in columns:
+            np.save(tmp_path / _column_file(column), df[column].to_numpy(dtype=BAR_COLUMNS[column]))
+        with open(tmp_path / META_FILE, 'w') as f:
+            json.dump({'columns': columns, 'rows': len(df)}, f)
+        if path.exists():
+            old_path = path.with_name(f'.{ticker}.old')
+            os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path)
+        else:
+            os.replace(tmp_path, path)
+        return path
+
+    def open(self, ticker, columns=None):
+        """
+        Memory map the bars for a ticker
+        :param ticker: the ticker symbol
+        :param columns: the columns to open, None for all of them
+        :return: a tuple of (dates, {column: array}) where the arrays are read-only memory mapped views
+        """
+        path = self._ticker_path(ticker)
+        assert (path / META_FILE).exists(), f'Unable to find {ticker} in the bar store {self.folder}'
+        with open(path / META_FILE) as f:
+            stored = json.load(f)['columns']
+        columns = stored if columns is None else [c for c in stored if c in columns]
+        dates = np.load(path / DATE_FILE, mmap_mode='r')
+        return dates, {c: np.load(path / _column_file(c), mmap_mode='r') for c in columns}
+
+    def read(self, ticker, columns=None):
+        """
+        :return: a dataframe whose columns are zero-copy views of the memory mapped files
+        """
+        dates, arrays = self.open(ticker, columns)
+        return pd.DataFrame(arrays, index=pd.DatetimeIndex(dates, name='date'), copy=False)
@@ -150,6 +150,21 @@ def count_empty_rows(df, column):
     return (df[column].isna().sum()) + (df[column] == 0).sum()
 
 
+def apply_to_chunks(chunks, *funcs):
+    """
+    Apply cleaning functions to each chunk of a stream (e.g. from read_latest(..., chunksize=n)) as it is read,
+    so only one chunk is in memory at a time.  Functions that need other arguments can be wrapped in a lambda or
+    functools.partial.  This only makes sense for functions that work row by row (so not remove_duplicates)
+    :param chunks: an iterable of dataframes
+    :param funcs: functions that take a dataframe and return a dataframe, applied in order
+    :return: a generator of the cleaned chunks
+    """
+    for chunk in chunks:
+        for func in funcs:
+            chunk = func(chunk)
+        yield chunk
+
+
 if __name__ == '__main__':
     start_logging(debug_to_console=True)
 
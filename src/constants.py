@@ -35,3 +35,5 @@ ADJ_CLOSE = 'adjusted close'
 DAY_VOLUME = 'volume'
 DIVIDEND_AMT = 'dividend amt'
 SPLIT_COEFFICIENT = 'split coef'
+# The number of trading days in a year
+ANN_TRADE_DAYS = 252
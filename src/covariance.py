@@ -0,0 +1,265 @@
+import numpy as np
+import pandas as pd
+
+from src.constants import *
+from src.utils import read_latest
+from src.bar_store import BarStore
+from src.stocks import StockPanel, ColumnNames
+
+
+def _shrinkage(covariance, quartic, n_obs):
+    """
+    The Ledoit-Wolf shrinkage intensity towards the scaled identity (the sklearn estimator)
+    :param covariance: the sample covariance matrix
+    :param quartic: the (weighted) mean over the observations of ||x - mean||^4
+    :param n_obs: the (effective) number of observations
+    :return: a tuple of the intensity in [0, 1] and the target scale (the mean variance)
+    """
+    n_features = len(covariance)
+    mu = np.trace(covariance) / n_features
+    delta = (np.sum(covariance ** 2) - 2 * mu * np.trace(covariance) + n_features * mu ** 2) / n_features
+    beta = (quartic - np.sum(covariance ** 2)) / (n_features * n_obs)
+    beta = min(max(beta, 0.), delta)
+    return (0. if delta == 0 else beta / delta), mu
+
+
+def _shrink(covariance, intensity, mu):
+    shrunk = (1 - intensity) * covariance
+    shrunk[np.diag_indices_from(shrunk)] += intensity * mu
+    return shrunk
+
+
+def ledoit_wolf(returns):
+    """
+    The Ledoit-Wolf shrunk covariance of a block of returns
+    Ledoit & Wolf, "A well-conditioned estimator for large-dimensional covariance matrices" (2004)
+    :param returns: an array (or dataframe) of observations x assets without missing values
+    :return: a tuple of the shrunk covariance matrix and the shrinkage intensity
+    """
+    x = np.asarray(returns, dtype=float)
+    x = x - x.mean(axis=0)
+    covariance = x.T @ x / len(x)
+    intensity, mu = _shrinkage(covariance, np.mean(np.sum(x * x, axis=1) ** 2), len(x))
+    return _shrink(covariance, intensity, mu), intensity
+
+
+class RollingCovariance:
+    """
+    Maintain the covariance (and correlation) matrix of many assets over a rolling window, or with exponential
+    weights, as new returns arrive.  The state is a handful of assets x assets matrices of weighted sums:
+    each new day is a rank-one update (and, for a window, a rank-one downdate of the day that drops out) and a
+    block of days is a single matrix product, so the cost of an update doesn't depend on the length of the history
+    and the memory is bounded by the number of assets (and the window).
+    Missing returns (NaN) are handled pairwise, each pair of assets uses the days where both have a return.
+
+    Example:
+    engine = RollingCovariance(returns.columns, window=252)
+    for date, row in returns.iterrows():
+        engine.update(row)
+    corr = engine.correlation()
+    """
+
+    def __init__(self, tickers, window=None, halflife=None, min_periods=2):
+        """
+        :param tickers: the assets, in the order of the columns of the returns
+        :param window: the number of days in the rolling window
+        :param halflife: the half life, in days, of the exponential weights (instead of a window)
+        :param min_periods: the number of days each pair needs before it has a covariance
+        """
+        assert (window is None) != (halflife is None), 'Give one of window or halflife'
+        self.tickers = list(tickers)
+        self.window = window
+        self.decay = None if halflife is None else 0.5 ** (1 / halflife)
+        self.min_periods = min_periods
+        n = len(self.tickers)
+        # The pairwise sums over the days where both assets have a return: weights, weights^2, x_i, x_i^2, x_i*x_j
+        self._weights = np.zeros((n, n))
+        self._weights_sq = np.zeros((n, n))
+        self._sums = np.zeros((n, n))
+        self._squares = np.zeros((n, n))
+        self._products = np.zeros((n, n))
+        # The window's days (a ring buffer), or the weighted mean of ||x - mean||^4 for the exponential weights
+        self._buffer = np.full((window, n), np.nan) if window is not None else None
+        self._position = 0
+        self._quartic = 0.
+        self._since_refresh = 0
+        self.n_obs = 0
+
+    def _accumulate(self, x, weights, sign=1.):
+        present = np.isfinite(x)
+        mask = present.astype(float)
+        values = np.where(present, x, 0.)
+        weighted_mask = mask * weights[:, None]
+        weighted_values = values * weights[:, None]
+        self._weights += sign * weighted_mask.T @ mask
+        self._weights_sq += sign * (mask * weights[:, None] ** 2).T @ mask
+        self._sums += sign * weighted_values.T @ mask
+        self._squares += sign * (weighted_values * values).T @ mask
+        self._products += sign * weighted_values.T @ values
+
+    def _refresh(self):
+        """
+        Recalculate the window sums from the buffer so that rounding errors from the downdates don't build up
+        """
+        for matrix in (self._weights, self._weights_sq, self._sums, self._squares, self._products):
+            matrix[:] = 0.
+        rows = self._buffer[:min(self.n_obs, self.window)]
+        self._accumulate(rows, np.ones(len(rows)))
+        self._since_refresh = 0
+
+    def update(self, returns):
+        """
+        Add one day (a vector with a return for each asset) or a block of days (days x assets, oldest first)
+        :param returns: an array, Series or dataframe in the order of the tickers
+        :return: self
+        """
+        x = np.asarray(returns, dtype=float)
+        x = x.reshape(-1, len(self.tickers))
+        if self.decay is not None:
+            self._update_weighted(x)
+            return self
+        for start in range(0, len(x), self.window):
+            block = x[start:start + self.window]
+            slots = (self._position + np.arange(len(block))) % self.window
+            if self.n_obs >= self.window:
+                leaving = self._buffer[slots]
+            else:
+                leaving = self._buffer[slots[self.n_obs + np.arange(len(block)) >= self.window]]
+            self._accumulate(block, np.ones(len(block)))
+            if len(leaving):
+                self._accumulate(leaving, np.ones(len(leaving)), sign=-1.)
+            self._buffer[slots] = block
+            self._position = (self._position + len(block)) % self.window
+            self.n_obs += len(block)
+            self._since_refresh += len(block)
+            if self._since_refresh >= self.window:
+                self._refresh()
+        return self
+
+    def _update_weighted(self, x):
+        k = len(x)
+        decay = self.decay ** k
+        for matrix in (self._weights, self._sums, self._squares, self._products):
+            matrix *= decay
+        self._weights_sq *= decay ** 2
+        # the newest day has a weight of 1
+        weights = self.decay ** np.arange(k - 1, -1, -1)
+        self._accumulate(x, weights)
+        # the fourth moment used by the shrinkage is taken about the mean as of each update
+        total = np.diag(self._weights)
+        with np.errstate(all='ignore'):
+            mean = np.where(total > 0, np.diag(self._sums) / total, 0.)
+        quartic = np.sum(np.nan_to_num(x - mean) ** 2, axis=1) ** 2
+        self._quartic = self._quartic * decay + np.sum(weights * quartic)
+        self.n_obs += k
+
+    def _pairwise(self):
+        """
+        :return: the pairwise weights, covariance and the variance of each asset over the days shared with the
+            other asset
+        """
+        weights = self._weights
+        with np.errstate(all='ignore'):
+            means_i = self._sums / weights
+            # unbiased for the weights, for a window this is the usual n - 1
+            scale = weights / (weights ** 2 - self._weights_sq)
+            covariance = (self._products - self._sums * means_i.T) * scale
+            variance = (self._squares - self._sums * means_i) * scale
+        too_few = (weights <= 0) | (self._pairwise_count() < self.min_periods)
+        covariance[too_few] = np.nan
+        return weights, covariance, variance
+
+    def _pairwise_count(self):
+        if self.decay is None:
+            return self._weights
+        # the number of days each pair has in common, ignoring the weights, isn't kept for the exponential weights
+        return np.where(self._weights > 0, self.n_obs, 0)
+
+    def _output(self, matrix, upper):
+        if upper:
+            return matrix[np.triu_indices(len(matrix))]
+        return pd.DataFrame(matrix, index=self.tickers, columns=self.tickers)
+
+    def upper_index(self):
+        """
+        :return: a MultiIndex of the (ticker, ticker) pairs in the order returned with upper=True
+        """
+        i, j = np.triu_indices(len(self.tickers))
+        tickers = np.asarray(self.tickers, dtype=object)
+        return pd.MultiIndex.from_arrays([tickers[i], tickers[j]])
+
+    def covariance(self, shrink=False, upper=False):
+        """
+        :param shrink: if True then shrink the covariance towards the scaled identity with Ledoit-Wolf
+        :param upper: if True then return only the upper triangle (including the diagonal) as a vector, see
+            upper_index
+        :return: a dataframe (assets x assets) of the covariances, NaN where a pair has too few days
+        """
+        weights, covariance, variance = self._pairwise()
+        if shrink:
+            covariance = self._shrunk(covariance)
+        return self._output(covariance, upper)
+
+    def _shrunk(self, covariance):
+        covariance = np.nan_to_num(covariance)
+        if self.decay is None:
+            rows = self._buffer[:min(self.n_obs, self.window)]
+            centred = np.nan_to_num(rows - np.nanmean(rows, axis=0))
+            quartic, n_obs = np.mean(np.sum(centred * centred, axis=1) ** 2), len(rows)
+        else:
+            total = np.max(np.diag(self._weights))
+            quartic, n_obs = self._quartic / total, total ** 2 / np.max(np.diag(self._weights_sq))
+        # the sample estimate in the Ledoit-Wolf formula is the biased one
+        biased = covariance * (n_obs - 1) / n_obs if self.decay is None else covariance
+        intensity, mu = _shrinkage(biased, quartic, n_obs)
+        return _shrink(covariance, intensity, np.trace(covariance) / len(covariance))
+
+    def correlation(self, upper=False):
+        """
+        :param upper: if True then return only the upper triangle (including the diagonal) as a vector
+        :return: a dataframe (assets x assets) of the correlations over the days each pair has in common
+        """
+        weights, covariance, variance = self._pairwise()
+        with np.errstate(all='ignore'):
+            correlation = covariance / np.sqrt(variance * variance.T)
+        return self._output(np.clip(correlation, -1., 1.), upper)
+
+
+def iter_covariances(returns, window=None, halflife=None, every=1, correlation=False, shrink=False, upper=False,
+                     min_periods=2):
+    """
+    Run a RollingCovariance over a history of returns and emit the matrix every <every> days.  The days between
+    emissions are added as one block, so a weekly or monthly risk model is mostly matrix products.
+    :param returns: a dataframe of daily returns indexed on date (ascending) with a column for each asset
+    :param every: the number of days between emitted matrices
+    :param correlation: if True emit correlations rather than covariances
+    :param upper: if True emit only the upper triangle, see RollingCovariance.upper_index
+    :return: a generator of (date, matrix) tuples, starting once a full window (or min_periods days) is in
+    """
+    engine = RollingCovariance(returns.columns, window=window, halflife=halflife, min_periods=min_periods)
+    values = returns.to_numpy(dtype=float)
+    first = max((window or min_periods) - 1, 0)
+    # the first emission is on the first full window, then every <every> days after that
+    stops = list(range(first, len(values), every))
+    start = 0
+    for stop in stops:
+        engine.update(values[start:stop + 1])
+        start = stop + 1
+        matrix = engine.correlation(upper) if correlation else engine.covariance(shrink=shrink, upper=upper)
+        yield returns.index[stop], matrix
+
+
+def universe_returns(tickers=None, store=None, start=None, end=None):
+    """
+    The daily total returns (ColumnNames.PCT_DAY_CHANGE) of the S&P 500 constituents, from the BarStore
+    :param tickers: the tickers, defaults to the Symbol column of the latest SPInfo file in DS_EXTERNAL
+    :param store: the BarStore to read from, if None the default store in DS_PROCESSED is used
+    :return: a dataframe indexed on date with a column for each ticker in the store
+    """
+    store = store if store is not None else BarStore()
+    if tickers is None:
+        tickers = read_latest('SPInfo', folder=DS_EXTERNAL)['Symbol']
+    available = set(store.tickers())
+    panel = StockPanel.LoadFromBarStore([t for t in tickers if t in available], store=store)
+    panel.CalculatePercentDailyChange()
+    return panel[ColumnNames.PCT_DAY_CHANGE].loc[start:end]
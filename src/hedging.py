@@ -0,0 +1,143 @@
+import math
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.special import ndtr
+
+from src.constants import *
+from src.pricing_model import BlackSholesArray, _d1d2
+from src.simulation import simulate_price_paths, _as_returns
+from src.utils import read_latest
+
+# The columns in the raw price files (e.g. data/raw/msft_012920.csv)
+RAW_CLOSE = 'Close'
+PATH_SOURCES = ['historical', 'bootstrap']
+DEFAULT_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+def load_closes(ticker, folder=DS_RAW):
+    """
+    :param ticker: the ticker of a raw price file, e.g. 'MSFT' for msft_012920.csv
+    :param folder: the folder with the raw price files
+    :return: a Series of the closing prices indexed on date (ascending)
+    """
+    bars = read_latest(ticker.lower(), folder=folder, columns=[RAW_CLOSE], exact=True)
+    bars.index = pd.to_datetime(bars.index)
+    return bars[RAW_CLOSE].sort_index().dropna()
+
+
+def historical_paths(prices, period, step=1, starting_price=None):
+    """
+    Cut the realized prices into overlapping paths, one starting every <step> days
+    :param prices: a Series or array of daily prices in date order
+    :param period: the number of days in each path, each path has period + 1 prices
+    :param step: the number of days between the start of one path and the next
+    :param starting_price: if given each path is rescaled to start at this price, so that the paths can be hedged
+        with the same strike
+    :return: an array of shape (n_paths, period + 1)
+    """
+    prices = np.asarray(prices, dtype=float)
+    assert len(prices) > period, f'Need more than {period} prices to make a path'
+    paths = sliding_window_view(prices, period + 1)[::step]
+    if starting_price is not None:
+        return paths * (starting_price / paths[:, :1])
+    return paths.copy()
+
+
+def delta_hedge_pnl(paths, strike, volatility, rate=0., option_type='call', quantity=-1, rebalance=1, cost=0.,
+                    multiplier=1):
+    """
+    The profit or loss at expiration of holding an option and delta hedging it with the underlying.  The option
+    expires at the end of the paths and is priced (and hedged) with Black-Scholes at <volatility>.  The hedge is
+    reset every <rebalance> days and unwound at expiration, the premium and every trade are financed (or earn
+    interest) at the risk-free rate until expiration.
+    The deltas for every path and rebalance date are one BlackSholes evaluation, the rest is array arithmetic.
+    :param paths: an array (n_paths, days + 1) of daily prices, see historical_paths and simulate_price_paths
+    :param strike: the strike price of the option
+    :param volatility: the annualized volatility used to price and hedge the option (0.2 == 20%)
+    :param rate: the risk-free rate (0.017 == 1.7%)
+    :param option_type: 'call' or 'put'
+    :param quantity: the number of options held, negative (the default) for a short position
+    :param rebalance: the number of days between hedge trades
+    :param cost: the cost of trading the underlying as a fraction of the amount traded, e.g. 0.0005 for 5bps
+    :param multiplier: the number of shares per option
+    :return: an array (n_paths,) of the profit or loss of each path at expiration
+    """
+    if option_type not in ('call', 'put'):
+        raise ValueError(f"Unknown option type '{option_type}' expected 'call' or 'put'")
+    paths = np.asarray(paths, dtype=float)
+    days = paths.shape[1] - 1
+    assert days > 0 and rebalance >= 1, 'Need at least one day in each path and a rebalance of at least one day'
+    term = days / ANN_TRADE_DAYS
+    dt = 1 / ANN_TRADE_DAYS
+
+    # the days the hedge is traded, the last trade unwinds it at expiration
+    trade_days = np.arange(0, days, rebalance)
+    remaining = (days - trade_days) * dt
+    spot = paths[:, trade_days]
+    d1 = _d1d2(spot, strike, volatility, rate, remaining, termUnits='years')[7]
+    delta = ndtr(d1) if option_type == 'call' else ndtr(d1) - 1
+    shares = -quantity * multiplier * delta
+    trades = np.diff(shares, axis=1, prepend=0., append=0.)
+    prices = np.concatenate([spot, paths[:, -1:]], axis=1)
+    cash = -trades * prices - cost * np.abs(trades) * prices
+    growth = np.exp(rate * (days - np.append(trade_days, days)) * dt)
+    hedge = cash @ growth
+
+    call, put = BlackSholesArray(paths[:, 0], strike, volatility, rate, term, termUnits='years')
+    premium = call if option_type == 'call' else put
+    final = paths[:, -1]
+    payoff = np.maximum(final - strike, 0.) if option_type == 'call' else np.maximum(strike - final, 0.)
+    return hedge + quantity * multiplier * (payoff - premium * math.exp(rate * term))
+
+
+def pnl_distribution(pnl, quantiles=DEFAULT_QUANTILES):
+    """
+    Summarize the profit or loss over the paths
+    :param pnl: an array of the profit or loss of each path, see delta_hedge_pnl
+    :param quantiles: the quantiles to report
+    :return: a Series with the mean, std, quantiles (labelled e.g. 'q05'), and the 95% expected shortfall (the mean
+        of the worst 5% of the paths, as a loss)
+    """
+    pnl = np.asarray(pnl, dtype=float)
+    cutoff = np.quantile(pnl, 0.05)
+    summary = {'paths': len(pnl), 'mean': pnl.mean(), 'std': pnl.std(ddof=1), 'min': pnl.min()}
+    summary.update({f'q{round(q * 100):02d}': v for q, v in zip(quantiles, np.quantile(pnl, quantiles))})
+    summary.update({'max': pnl.max(), 'es_95': -pnl[pnl <= cutoff].mean()})
+    return pd.Series(summary)
+
+
+def simulate_hedge(prices, strike, volatility=None, rate=0., days=ANN_TRADE_DAYS, source='bootstrap',
+                   n_paths=1000, rebalance=1, step=1, option_type='call', quantity=-1, cost=0., seed=None):
+    """
+    Delta hedge an option, struck against today's price, over the realized history of a ticker or over paths
+    bootstrapped from its daily returns.
+
+    Example:
+    pnl = simulate_hedge('MSFT', strike=175., volatility=0.25, rate=0.017, days=63, rebalance=5)
+    pnl_distribution(pnl)
+    :param prices: a ticker (see load_closes) or a Series of daily prices in date order
+    :param strike: the strike price of the option
+    :param volatility: the volatility used to price and hedge the option, defaults to the annualized volatility
+        of the daily returns
+    :param days: the number of trading days until expiration
+    :param source: 'historical' for every <step> day window of the realized prices (rescaled to start at today's
+        price) or 'bootstrap' for <n_paths> paths sampled from the daily returns with simulate_price_paths
+    :param seed: anything accepted by numpy.random.default_rng
+    :return: an array of the profit or loss of each path, see delta_hedge_pnl
+    """
+    if isinstance(prices, str):
+        prices = load_closes(prices)
+    prices = pd.Series(np.asarray(prices, dtype=float)).dropna()
+    returns = prices.pct_change()
+    if volatility is None:
+        volatility = returns.std() * math.sqrt(ANN_TRADE_DAYS)
+    spot = prices.iloc[-1]
+    if source == 'historical':
+        paths = historical_paths(prices, days, step=step, starting_price=spot)
+    elif source == 'bootstrap':
+        paths = simulate_price_paths(spot, _as_returns(returns), days + 1, n_paths=n_paths, seed=seed)
+    else:
+        raise ValueError(f"Unknown source '{source}' expected one of {PATH_SOURCES}")
+    return delta_hedge_pnl(paths, strike, volatility, rate, option_type=option_type, quantity=quantity,
+                           rebalance=rebalance, cost=cost)
@@ -0,0 +1,133 @@
+import math
+import pandas as pd
+
+from src.constants import *
+from src.rolling import rolling_mean, rolling_std
+
+# The indicators a StockChart can calculate {name: Indicator}, see StockChart.Indicator
+INDICATORS = {}
+
+
+class Indicator:
+    """
+    An entry in the indicator registry.
+    The inputs are the names of data columns or of other indicators.  An input that is another indicator can be
+    given as (name, params) to override its default parameters, and the inputs can also be a function that takes
+    this indicator's parameters and returns the list, so that a parameter can be passed down the chain.
+    The function is called with the input series in order, the number of rows to shift to get to the previous
+    day (prev_day) and the parameters as keywords.
+    """
+
+    def __init__(self, name, func, inputs=(), params=None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.params = params or {}
+
+    def resolve_params(self, params):
+        """
+        :return: the default parameters updated with <params>
+        """
+        unknown = set(params) - set(self.params)
+        if unknown:
+            raise ValueError(f"Unknown parameters {sorted(unknown)} for indicator '{self.name}', "
+                             f"expected any of {sorted(self.params)}")
+        resolved = dict(self.params)
+        resolved.update(params)
+        return resolved
+
+    def resolve_inputs(self, params):
+        """
+        :return: a list of (name, params) tuples where params is None when the input is a data column
+        """
+        inputs = self.inputs(**params) if callable(self.inputs) else self.inputs
+        resolved = []
+        for i in inputs:
+            if isinstance(i, tuple):
+                resolved.append((i[0], i[1]))
+            else:
+                resolved.append((i, {} if i in INDICATORS else None))
+        return resolved
+
+
+def _like(template, values):
+    """
+    Wrap an array from the rolling kernels in the same type (Series or DataFrame) as the input
+    """
+    if isinstance(template, pd.DataFrame):
+        return pd.DataFrame(values, index=template.index, columns=template.columns)
+    return pd.Series(values, index=template.index, name=template.name)
+
+
+def register_indicator(name, inputs=(), **params):
+    """
+    Decorator that adds a function to the registry
+
+    Example:
+    @register_indicator('range', inputs=[DAY_HIGH, DAY_LOW])
+    def day_range(high, low, prev_day=1):
+        return high - low
+    :param name: the name of the indicator
+    :param inputs: the data columns and indicators the function takes
+    :param params: the parameters of the indicator and their default values
+    """
+    def decorator(func):
+        INDICATORS[name] = Indicator(name, func, inputs, params)
+        return func
+    return decorator
+
+
+@register_indicator('total_price_return', inputs=[DAY_CLOSE, SPLIT_COEFFICIENT, DIVIDEND_AMT],
+                    forward_adjusted=False)
+def total_price_return(close, split, dividend, prev_day=1, forward_adjusted=False):
+    """
+    The close adjusted for splits and dividends, see StockChart.CalculateTotalReturnPrice
+    """
+    sign = 1 if forward_adjusted else -1
+    return close * split * (1 + sign * dividend / close.shift(prev_day))
+
+
+@register_indicator('pct_daily_change', forward_adjusted=False,
+                    inputs=lambda forward_adjusted: [('total_price_return',
+                                                      {'forward_adjusted': forward_adjusted})])
+def pct_daily_change(total_return, prev_day=1, forward_adjusted=False):
+    return total_return.pct_change(prev_day)
+
+
+@register_indicator('annualized_volatility', window=30, forward_adjusted=False,
+                    inputs=lambda window, forward_adjusted: [('pct_daily_change',
+                                                              {'forward_adjusted': forward_adjusted})])
+def annualized_volatility(pct_change, prev_day=1, window=30, forward_adjusted=False):
+    """
+    The standard deviation of the rolling <window> day percent change * sqrt(252)
+    """
+    return _like(pct_change, rolling_std(pct_change, window) * math.sqrt(ANN_TRADE_DAYS))
+
+
+@register_indicator('moving_avg', inputs=[DAY_CLOSE], days=30)
+def moving_avg(close, prev_day=1, days=30):
+    return _like(close, rolling_mean(close, days))
+
+
+def calculate_indicator(name, params, column, cache, version=0, prev_day=1):
+    """
+    Calculate an indicator, and each indicator it depends on, reusing anything that is already in <cache>
+    :param name: the name the indicator was registered with
+    :param params: the parameters of the indicator, any that aren't given take their default values
+    :param column: a function that returns the data for an input column
+    :param cache: a dictionary of the indicators already calculated, keyed by (name, params, version)
+    :param version: the version of the data the indicators are calculated from
+    :param prev_day: the number of rows to shift to get to the previous day
+    :return: the value returned by the indicator's function
+    """
+    if name not in INDICATORS:
+        raise ValueError(f"Unknown indicator '{name}', expected one of {sorted(INDICATORS)}")
+    indicator = INDICATORS[name]
+    params = indicator.resolve_params(params)
+    key = (name, tuple(sorted(params.items())), version)
+    if key not in cache:
+        inputs = [column(input_name) if input_params is None else
+                  calculate_indicator(input_name, input_params, column, cache, version, prev_day)
+                  for input_name, input_params in indicator.resolve_inputs(params)]
+        cache[key] = indicator.func(*inputs, prev_day=prev_day, **params)
+    return cache[key]
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+
+from src.constants import DIVIDEND_AMT
+from src.pricing_model import _term_in_years
+
+
+def project_dividends(historical, as_of, term, termUnits='days'):
+    """
+    Project the discrete dividends that will be paid before expiration assuming that the dividends paid over the
+    last year are paid again on the same schedule.
+    :param historical: a StockChart.data dataframe (with a DIVIDEND_AMT column) or a series of dividend amounts
+        indexed on the ex-date
+    :param as_of: the pricing date
+    :param term: the time to expiration
+    :param termUnits: 'days' if the term is in calendar days, otherwise the term is assumed to be in years
+    :return: a list of (time to ex-date, amount) tuples, where the time is in the same units as the term
+    """
+    dividends = historical[DIVIDEND_AMT] if isinstance(historical, pd.DataFrame) else historical
+    dividends = dividends[dividends > 0]
+    dividends.index = pd.to_datetime(dividends.index)
+    as_of = pd.Timestamp(as_of)
+    last_year = dividends[(dividends.index > as_of - pd.DateOffset(years=1)) & (dividends.index <= as_of)]
+    horizon = term if termUnits == 'days' else term * 365
+    projected = []
+    for ex_date, amount in last_year.sort_index().items():
+        days = ((ex_date + pd.DateOffset(years=1)) - as_of).days
+        if 0 < days <= horizon:
+            projected.append((days if termUnits == 'days' else days / 365, float(amount)))
+    return projected
+
+
+def _remaining_dividends_pv(dividends, t, T, r):
+    """
+    The present value, at time t, of the dividends with an ex-date after t and on or before expiration
+    :param dividends: list of (time in years, amount)
+    :param t: array of the current time (in years) for each contract
+    :param T: array of the expiration (in years) for each contract
+    :param r: array of the risk-free rates for each contract
+    :return: an array with the present value for each contract
+    """
+    pv = np.zeros_like(t)
+    for ex_time, amount in dividends:
+        pending = (ex_time > t) & (ex_time <= T)
+        pv += np.where(pending, amount * np.exp(-r * (ex_time - t)), 0)
+    return pv
+
+
+def lattice_price(currentPrice, strikePrice, volatility, rate, term, termUnits='days', optionType='call',
+                  american=True, steps=200, method='binomial', dividends=None):
+    """
+    Price options on a recombining lattice (CRR binomial or Boyle trinomial tree) with backward induction.
+    Each step of the induction is a single array operation over every contract and every node, so a batch of
+    contracts that share the step count is priced in one pass.
+
+    Discrete dividends use the escrowed dividend model: the tree is built on the price less the present value of
+    the dividends paid before expiration and the present value of the dividends still to come is added back
+    when checking for early exercise.
+    :param currentPrice: the price of the underlying
+    :param strikePrice: the strike price of the option
+    :param volatility: the annualized volatility (0.2 == 20%)
+    :param rate: the risk-free rate (0.017 == 1.7%)
+    :param term: the time to expiration
+    :param termUnits: 'days' if the term is in calendar days, otherwise the term is assumed to be in years
+    :param optionType: 'call' or 'put' or an array of these values, one per contract
+    :param american: if True then allow early exercise
+    :param steps: the number of time steps in the lattice
+    :param method: 'binomial' or 'trinomial'
+    :param dividends: list of (time to ex-date, amount) tuples in termUnits, e.g. from project_dividends
+    :return: an array of option prices with the broadcast shape of the inputs
+    """
+    S, K, sigma, r, T, isCall = np.broadcast_arrays(np.asarray(currentPrice, dtype=float),
+                                                    np.asarray(strikePrice, dtype=float),
+                                                    np.asarray(volatility, dtype=float),
+                                                    np.asarray(rate, dtype=float),
+                                                    _term_in_years(term, termUnits),
+                                                    np.asarray(optionType) == 'call')
+    shape = S.shape
+    S, K, sigma, r, T, isCall = (a.ravel()[:, None] for a in (S, K, sigma, r, T, isCall))
+    dividends = [(float(_term_in_years(t, termUnits)), amount) for t, amount in (dividends or [])]
+    sign = np.where(isCall, 1., -1.)
+    dt = T / steps
+    disc = np.exp(-r * dt)
+
+    if method == 'binomial':
+        u = np.exp(sigma * np.sqrt(dt))
+        p = (np.exp(r * dt) - 1 / u) / (u - 1 / u)
+        probabilities = (p, 1 - p)
+
+        # the exponent of u at each node, j = 0 is the top of the tree
+        def exponent(i):
+            return i - 2 * np.arange(i + 1)
+    elif method == 'trinomial':
+        u = np.exp(sigma * np.sqrt(2 * dt))
+        up = np.exp(sigma * np.sqrt(dt / 2))
+        grow = np.exp(r * dt / 2)
+        p_up = ((grow - 1 / up) / (up - 1 / up)) ** 2
+        p_down = ((up - grow) / (up - 1 / up)) ** 2
+        probabilities = (p_up, 1 - p_up - p_down, p_down)
+
+        def exponent(i):
+            return i - np.arange(2 * i + 1)
+    else:
+        raise ValueError(f"Unknown method '{method}' expected one of 'binomial' or 'trinomial'")
+
+    escrowed = S
+    if dividends:
+        escrowed = S - _remaining_dividends_pv(dividends, np.zeros(len(T)), T[:, 0], r[:, 0])[:, None]
+
+    def with_dividends(prices, i):
+        if not dividends:
+            return prices
+        return prices + _remaining_dividends_pv(dividends, i * dt[:, 0], T[:, 0], r[:, 0])[:, None]
+
+    # Each step back through the tree drops the lowest node(s) and divides the remaining prices by u
+    prices = escrowed * u ** exponent(steps)
+    values = np.maximum(sign * (with_dividends(prices, steps) - K), 0)
+    for i in range(steps - 1, -1, -1):
+        width = values.shape[1] - len(probabilities) + 1
+        values = disc * sum(prob * values[:, k:k + width] for k, prob in enumerate(probabilities))
+        if american:
+            prices = prices[:, :width] / u
+            values = np.maximum(values, sign * (with_dividends(prices, i) - K))
+    return values[:, 0].reshape(shape)
@@ -0,0 +1,210 @@
+import io
+import json
+import logging
+import os
+import threading
+import time
+import datetime as dt
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.constants import *
+from src.utils import make_ts_filename, update_manifest
+
+# AlphaVantage only returns the last 100 days with outputsize='compact'
+COMPACT_DAYS = 100
+ALPHA_VANTAGE_URL = 'https://www.alphavantage.co/query'
+# The free tier allows 5 calls a minute
+ALPHA_VANTAGE_CALLS_PER_MINUTE = 5
+
+ALPHA_VANTAGE_COLUMNS = {'open': OPEN_PRICE, 'high': DAY_HIGH,
+                         'low': DAY_LOW, 'close': DAY_CLOSE,
+                         'adjusted_close': ADJ_CLOSE, 'volume': DAY_VOLUME,
+                         'dividend_amount': DIVIDEND_AMT, 'split_coefficient': SPLIT_COEFFICIENT}
+
+
+# The keys of the json AlphaVantage returns in place of the bars when the call quota is used up
+RATE_LIMIT_KEYS = ('Note', 'Information')
+
+
+class FetchError(Exception):
+    """
+    The source returned an error (or a rate limit note) rather than bars.  rate_limited is True when the request
+    was turned away because of the quota, so it is worth retrying once the quota has refilled
+    """
+
+    def __init__(self, message, rate_limited=False):
+        super().__init__(message)
+        self.rate_limited = rate_limited
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket rate limiter.  Tokens are added at <rate> per second up to <capacity>
+    and each call to acquire takes a token, waiting for one if the bucket is empty
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AlphaVantageFetcher:
+    """
+    Fetch daily adjusted bars from AlphaVantage https://www.alphavantage.co/documentation/
+    The requests share one pooled HTTP session and go through a TokenBucket so that concurrent loads stay
+    within the vendor quota.
+    Any callable with the signature fetcher(ticker, start, end) -> DataFrame can be used in its place
+    """
+
+    def __init__(self, api_key=None, base_url=ALPHA_VANTAGE_URL, rate_limiter=None, pool_size=16, timeout=30):
+        self.api_key = api_key or os.getenv('ALPHA_VANTAGE_TOKEN')
+        self.base_url = base_url
+        self.rate_limiter = rate_limiter if rate_limiter is not None else \
+            TokenBucket(ALPHA_VANTAGE_CALLS_PER_MINUTE / 60, capacity=ALPHA_VANTAGE_CALLS_PER_MINUTE)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __call__(self, ticker, start=None, end=None, last=None):
+        """
+        :param ticker: the ticker symbol
+        :param start: the first date required or None for the whole history
+        :param end: the last date required or None for today
+        :param last: if given, only the last <last> bars (up to end) are returned and start is ignored
+        :return: a dataframe indexed on date (ascending) with the columns named per src.constants
+        """
+        # the compact output is the last COMPACT_DAYS bars, which always covers the last COMPACT_DAYS calendar days
+        if last is not None:
+            recent = last <= COMPACT_DAYS
+        else:
+            recent = start is not None and (pd.Timestamp(dt.date.today()) - pd.Timestamp(start)).days <= COMPACT_DAYS
+        self.rate_limiter.acquire()
+        response = self.session.get(self.base_url, timeout=self.timeout,
+                                    params={'function': 'TIME_SERIES_DAILY_ADJUSTED', 'symbol': ticker,
+                                            'outputsize': 'compact' if recent else 'full',
+                                            'datatype': 'csv', 'apikey': self.api_key})
+        response.raise_for_status()
+        # Errors (bad symbol, too many calls) come back as json rather than csv
+        if response.text.lstrip().startswith('{'):
+            try:
+                keys = response.json().keys()
+            except ValueError:
+                keys = ()
+            raise FetchError(f'{ticker}: {response.text.strip()}',
+                             rate_limited=any(key in keys for key in RATE_LIMIT_KEYS))
+        bars = pd.read_csv(io.StringIO(response.text), index_col=0, parse_dates=True)
+        bars = bars.rename(columns=ALPHA_VANTAGE_COLUMNS).sort_index()
+        bars.index.name = 'date'
+        if last is not None:
+            return bars.loc[:end].iloc[-last:]
+        return bars.loc[start:end]
+
+
+class BarCache:
+    """
+    A local cache of daily bars, one file per ticker in <folder>.  The bars are kept in <ticker>_latest.csv
+    (so read_latest still finds them) and a small <ticker>_latest.json records the span of dates that are in the
+    file and when the source was last checked.  Loading a ticker only goes to the fetcher for the trailing days
+    that are missing, the new rows are appended to the end of the file, and a repeat load on the same day makes
+    no calls at all.
+    """
+
+    def __init__(self, folder=DS_EXTERNAL, fetcher=None):
+        self.folder = folder
+        self.fetcher = fetcher if fetcher is not None else AlphaVantageFetcher()
+
+    def _bars_file(self, ticker):
+        return make_ts_filename(self.folder, ticker, suffix='.csv', with_ts=False)
+
+    def _meta_file(self, ticker):
+        return make_ts_filename(self.folder, ticker, suffix='.json', with_ts=False)
+
+    def span(self, ticker):
+        """
+        :return: a dictionary with the first and last dates in the cache and the date the source was last
+            checked, or None if the ticker isn't cached
+        """
+        meta_file = self._meta_file(ticker)
+        if not meta_file.exists() or not self._bars_file(ticker).exists():
+            return None
+        with open(meta_file) as f:
+            meta = json.load(f)
+        return {k: pd.Timestamp(v) for k, v in meta.items()}
+
+    def _write_span(self, ticker, first, last, checked):
+        tmp_file = self._meta_file(ticker).with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump({'first': str(first.date()), 'last': str(last.date()), 'checked': str(checked.date())}, f)
+        os.replace(tmp_file, self._meta_file(ticker))
+
+    def _append(self, ticker, bars, new_file):
+        bars = bars.copy()
+        bars.index.name = 'date'
+        bars.to_csv(self._bars_file(ticker), mode='w' if new_file else 'a', header=new_file)
+        update_manifest(self._bars_file(ticker), ticker)
+
+    def refresh(self, ticker, today=None):
+        """
+        Bring the cache for the ticker up to date, fetching only what is missing
+        :param ticker: the ticker symbol
+        :param today: the current date, defaults to today
+        :return: the number of new rows added to the cache
+        """
+        logger = logging.getLogger(__name__)
+        today = pd.Timestamp(today if today is not None else dt.date.today()).normalize()
+        span = self.span(ticker)
+        if span is None:
+            logger.info(f"fetching full history for {ticker}")
+            bars = self.fetcher(ticker, None, today).sort_index()
+            bars = bars[~bars.index.duplicated(keep='last')]
+            if len(bars) == 0:
+                return 0
+            self._append(ticker, bars, new_file=True)
+            self._write_span(ticker, bars.index[0], bars.index[-1], today)
+            return len(bars)
+        if span['checked'] >= today:
+            return 0
+        logger.info(f"fetching {ticker} bars after {span['last'].date()}")
+        bars = self.fetcher(ticker, span['last'] + pd.Timedelta(days=1), today).sort_index()
+        bars = bars[bars.index > span['last']]
+        bars = bars[~bars.index.duplicated(keep='last')]
+        if len(bars) > 0:
+            self._append(ticker, bars, new_file=False)
+        self._write_span(ticker, span['first'], bars.index[-1] if len(bars) > 0 else span['last'], today)
+        return len(bars)
+
+    def get_bars(self, ticker, start=None, end=None, refresh=True, today=None):
+        """
+        Get the daily bars for a ticker from the cache, refreshing the cache first if needed
+        :param ticker: the ticker symbol
+        :param start: the first date to return or None for the start of the history
+        :param end: the last date to return or None for the most recent
+        :param refresh: if False then only return what is already cached
+        :param today: the current date, defaults to today
+        :return: a dataframe indexed on date (ascending) or None if nothing is cached
+        """
+        if refresh and (end is None or self.span(ticker) is None or self.span(ticker)['last'] < pd.Timestamp(end)):
+            self.refresh(ticker, today=today)
+        if self.span(ticker) is None:
+            return None
+        bars = pd.read_csv(self._bars_file(ticker), index_col=0, parse_dates=True)
+        return bars.loc[start:end]
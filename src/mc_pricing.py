@@ -0,0 +1,162 @@
+import math
+import numpy as np
+from scipy.special import ndtri
+from scipy.stats import qmc
+
+from src.constants import ANN_TRADE_DAYS
+from src.pricing_model import _BlackSholes
+from src.simulation import DEFAULT_CHUNK_SIZE, _as_returns, _chunk_bounds
+
+
+# Payoffs take an array of price paths of shape (n_paths, period + 1), where the first column is the
+# starting price, and return the (undiscounted) payoff of each path
+
+def european_call(strike):
+    return lambda paths: np.maximum(paths[:, -1] - strike, 0)
+
+
+def european_put(strike):
+    return lambda paths: np.maximum(strike - paths[:, -1], 0)
+
+
+def asian_call(strike):
+    """
+    Arithmetic average price call, the average excludes the starting price
+    """
+    return lambda paths: np.maximum(paths[:, 1:].mean(axis=1) - strike, 0)
+
+
+def asian_put(strike):
+    return lambda paths: np.maximum(strike - paths[:, 1:].mean(axis=1), 0)
+
+
+def barrier_option(strike, barrier, option_type='call', direction='up', knock='out'):
+    """
+    Barrier option that is monitored at the close of each day
+    :param strike: the strike price
+    :param barrier: the barrier price
+    :param option_type: 'call' or 'put'
+    :param direction: 'up' if the barrier is above the starting price or 'down' if below
+    :param knock: 'out' if touching the barrier cancels the option, 'in' if touching activates it
+    :return: a payoff function
+    """
+    vanilla = european_call(strike) if option_type == 'call' else european_put(strike)
+
+    def payoff(paths):
+        touched = (paths.max(axis=1) >= barrier) if direction == 'up' else (paths.min(axis=1) <= barrier)
+        alive = touched if knock == 'in' else ~touched
+        return np.where(alive, vanilla(paths), 0)
+    return payoff
+
+
+def lookback_call():
+    """
+    Floating strike lookback call, pays the final price less the lowest price seen
+    """
+    return lambda paths: paths[:, -1] - paths.min(axis=1)
+
+
+def lookback_put():
+    """
+    Floating strike lookback put, pays the highest price seen less the final price
+    """
+    return lambda paths: paths.max(axis=1) - paths[:, -1]
+
+
+def _log_return_sampler(historical_returns, rate, model='bootstrap'):
+    """
+    Create a function that turns uniform draws into daily log returns under the risk-neutral measure.
+        - 'bootstrap' samples the historical log returns re-centered on the risk-neutral drift.  The returns are
+          sorted so that u and 1 - u (antithetic draws) map to opposite ends of the distribution
+        - 'gbm' uses lognormal returns with the annualized volatility of the historical returns
+    :return: a tuple of (sampler, annualized volatility)
+    """
+    log_returns = np.log1p(_as_returns(historical_returns))
+    sigma = log_returns.std(ddof=1) * math.sqrt(ANN_TRADE_DAYS)
+    dt = 1 / ANN_TRADE_DAYS
+    drift = (rate - sigma ** 2 / 2) * dt
+    if model == 'gbm':
+        return (lambda u: drift + sigma * math.sqrt(dt) * ndtri(u)), sigma
+    elif model == 'bootstrap':
+        centered = np.sort(log_returns - log_returns.mean() + drift)
+        return (lambda u: centered[np.minimum((u * len(centered)).astype(int), len(centered) - 1)]), sigma
+    raise ValueError(f"Unknown model '{model}' expected one of 'bootstrap' or 'gbm'")
+
+
+def price_by_simulation(payoff, starting_price, historical_returns, period, rate, n_paths=10000,
+                        model='bootstrap', antithetic=True, control_strike=None, sobol=False,
+                        chunk_size=DEFAULT_CHUNK_SIZE, seed=None):
+    """
+    Price an option with an arbitrary (path dependent) payoff by simulating risk-neutral paths from the
+    historical returns.  Three variance reduction techniques are available, and can be combined:
+        - antithetic variates: every draw u is paired with 1 - u
+        - control variates: a european call with <control_strike> is priced on the same paths and the
+          difference between its simulated price and _BlackSholes is used to correct the estimate.
+          The correction is exact for model='gbm' and a (very) close approximation for 'bootstrap'
+        - sobol: scrambled Sobol points are used instead of pseudo random draws, n_paths is rounded up to a
+          power of two and the reported standard error is only indicative since the draws aren't independent
+    :param payoff: a function of the price paths, e.g. asian_call(175)
+    :param starting_price: the price of the underlying today
+    :param historical_returns: Series of daily returns
+    :param period: the number of trading days until expiration
+    :param rate: the risk-free rate (0.017 == 1.7%)
+    :param n_paths: the number of paths to simulate (including the antithetic paths)
+    :param model: 'bootstrap' to sample the historical returns or 'gbm' for lognormal returns
+    :param antithetic: if True use antithetic variates
+    :param control_strike: if not None, the strike of the european call used as a control variate
+    :param sobol: if True use quasi-random Sobol points
+    :param chunk_size: the number of paths to hold in memory at one time
+    :param seed: anything accepted by numpy.random.default_rng
+    :return: a dictionary with the price, standard_error, n_paths and (if a control is used) beta
+    """
+    sampler, sigma = _log_return_sampler(historical_returns, rate, model)
+    term = period / ANN_TRADE_DAYS
+    discount = math.exp(-rate * term)
+    rng = np.random.default_rng(seed)
+    if sobol:
+        n_paths = 2 ** math.ceil(math.log2(max(n_paths, 2)))
+        # Keep each chunk a power of two so the Sobol points keep their balance properties
+        chunk_size = 2 ** int(math.log2(chunk_size))
+        engine = qmc.Sobol(d=period, scramble=True, seed=rng)
+        uniforms = lambda n: np.clip(engine.random(n), 1e-12, 1 - 1e-12)
+    else:
+        uniforms = lambda n: rng.random((n, period))
+    control = european_call(control_strike) if control_strike is not None else None
+
+    def evaluate(u):
+        log_paths = np.cumsum(sampler(u), axis=1)
+        paths = np.empty((len(u), period + 1))
+        paths[:, 0] = starting_price
+        paths[:, 1:] = starting_price * np.exp(log_paths)
+        y = discount * payoff(paths)
+        x = discount * control(paths) if control is not None else np.zeros(len(u))
+        return y, x
+
+    # Accumulate sums of y, x, y^2, x^2 and x*y so that only one chunk of paths is in memory
+    sums = np.zeros(5)
+    count = 0
+    draws = n_paths // 2 if antithetic else n_paths
+    for start, stop in _chunk_bounds(draws, chunk_size):
+        u = uniforms(stop - start)
+        y, x = evaluate(u)
+        if antithetic:
+            y_anti, x_anti = evaluate(1 - u)
+            y, x = (y + y_anti) / 2, (x + x_anti) / 2
+        sums += [y.sum(), x.sum(), (y * y).sum(), (x * x).sum(), (x * y).sum()]
+        count += len(y)
+
+    mean_y, mean_x = sums[0] / count, sums[1] / count
+    var_y = (sums[2] - count * mean_y ** 2) / (count - 1)
+    result = {'n_paths': count * 2 if antithetic else count}
+    if control is not None:
+        var_x = (sums[3] - count * mean_x ** 2) / (count - 1)
+        cov_xy = (sums[4] - count * mean_x * mean_y) / (count - 1)
+        beta = cov_xy / var_x if var_x > 0 else 0.
+        control_price = _BlackSholes(starting_price, control_strike, sigma, rate, term, termUnits='years')[0]
+        result['price'] = mean_y - beta * (mean_x - control_price)
+        result['beta'] = beta
+        var_y = max(var_y - beta * cov_xy, 0.)
+    else:
+        result['price'] = mean_y
+    result['standard_error'] = math.sqrt(var_y / count)
+    return result
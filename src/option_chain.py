@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from datetime import date
+import numpy as np
+import pandas as pd
+
+from src.pricing_model import BlackSholesArray, _expiration_date
+from src.utils import fingerprint
+
+# The number of grids kept by option_chain_grid, the least recently used grid is dropped first
+GRID_CACHE_SIZE = 64
+_grid_cache = OrderedDict()
+_grid_stats = {'hits': 0, 'misses': 0}
+
+
+def clear_grid_cache():
+    """
+    Drop the grids memoized by option_chain_grid
+    :return: None
+    """
+    _grid_cache.clear()
+    _grid_stats.update(hits=0, misses=0)
+
+
+def grid_cache_info():
+    """
+    :return: a dictionary with the hits, misses, size and maxsize of the grid cache
+    """
+    return dict(_grid_stats, size=len(_grid_cache), maxsize=GRID_CACHE_SIZE)
+
+
+def expiration_terms(expirations, as_of=None):
+    """
+    :param expirations: the expiration dates as strings (e.g. '1/15/2021'), dates, datetimes or numpy datetime64s
+    :param as_of: the pricing date, defaults to today
+    :return: a tuple of the list of expiration dates and an array of the calendar days to each one
+    """
+    as_of = date.today() if as_of is None else _expiration_date(as_of)
+    if isinstance(expirations, (str, date, np.datetime64)):
+        expirations = [expirations]
+    dates = [_expiration_date(e) for e in expirations]
+    return dates, np.array([(d - as_of).days for d in dates], dtype=float)
+
+
+def option_chain_grid(currentPrice, strikes, expirations, volatilities, rate, as_of=None, cache=True):
+    """
+    Price calls and puts for every combination of expiration, strike and volatility in one BlackSholesArray call.
+    The expirations are parsed and turned into terms once for the whole grid, and the grid is memoized on a hash of
+    its inputs so asking for the same grid again (e.g. a dashboard re-rendering) doesn't price anything.
+    Contracts expiring on the pricing date are worth their intrinsic value, expired contracts are NaN.
+
+    Example:
+    grid = option_chain_grid(166.36, [170, 175, 180], ['1/15/2021', '6/18/2021'], np.arange(.15, .25, .01), 0.017)
+    grid['call'].unstack('volatility')
+    :param currentPrice: the price of the underlying
+    :param strikes: the strike prices
+    :param expirations: the expiration dates, see expiration_terms
+    :param volatilities: the annualized volatilities (0.2 == 20%)
+    :param rate: the risk-free rate (0.017 == 1.7%)
+    :param as_of: the pricing date, defaults to today
+    :param cache: False to price the grid without looking in (or adding to) the cache
+    :return: a dataframe indexed on (expiration, strike, volatility) with term (in days), call and put columns
+    """
+    dates, terms = expiration_terms(expirations, as_of)
+    strikes = np.atleast_1d(np.asarray(strikes, dtype=float))
+    volatilities = np.atleast_1d(np.asarray(volatilities, dtype=float))
+    key = fingerprint(float(currentPrice), float(rate), terms, strikes, volatilities, dates) if cache else None
+    if key in _grid_cache:
+        _grid_cache.move_to_end(key)
+        _grid_stats['hits'] += 1
+        # a copy so that changes to the returned grid don't reach the cache
+        return _grid_cache[key].copy()
+
+    T = terms[:, None, None]
+    K = strikes[None, :, None]
+    with np.errstate(all='ignore'):
+        call, put = BlackSholesArray(currentPrice, K, volatilities[None, None, :], rate, np.maximum(T, 1e-9))
+    shape = (len(terms), len(strikes), len(volatilities))
+    call = np.where(T > 0, call, np.where(T == 0, np.maximum(currentPrice - K, 0.), np.nan))
+    put = np.where(T > 0, put, np.where(T == 0, np.maximum(K - currentPrice, 0.), np.nan))
+    index = pd.MultiIndex.from_product([pd.DatetimeIndex(dates), strikes, volatilities],
+                                       names=['expiration', 'strike', 'volatility'])
+    grid = pd.DataFrame({'term': np.broadcast_to(T, shape).ravel(),
+                         'call': np.broadcast_to(call, shape).ravel(),
+                         'put': np.broadcast_to(put, shape).ravel()}, index=index)
+    if cache:
+        _grid_stats['misses'] += 1
+        _grid_cache[key] = grid
+        while len(_grid_cache) > GRID_CACHE_SIZE:
+            _grid_cache.popitem(last=False)
+        return grid.copy()
+    return grid
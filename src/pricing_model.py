@@ -1,40 +1,303 @@
 import math
-from scipy.stats import norm
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
 from dateutil.parser import *
 from datetime import *
 
+_SQRT2 = math.sqrt(2)
+_SQRT2PI = math.sqrt(2*math.pi)
+
+
+class NormCdfTable:
+    """
+    Normal CDF from a precomputed table with linear interpolation, for pricing scalars in a hot loop.
+    Linear interpolation is off by at most step^2/8 * max|N''(x)| = step^2/8 * phi(1) and beyond the
+    ends of the table the CDF is within ndtr(lower) of 0 (or 1).  The defaults give an error below 3.1e-8.
+    NOTE: in CPython math.erfc is usually as fast as the lookup, run this module to benchmark both
+    """
+
+    def __init__(self, lower=-8., upper=8., step=1e-3):
+        self.lower = lower
+        self.step = step
+        self.grid = np.arange(lower, upper + step/2, step)
+        self.values = ndtr(self.grid)
+        self._values = self.values.tolist()
+        self._last = len(self._values) - 1
+
+    @property
+    def max_error(self):
+        return max(self.step**2/8*math.exp(-0.5)/_SQRT2PI, float(ndtr(self.lower)))
+
+    def __call__(self, x):
+        if not isinstance(x, (int, float)):
+            return np.interp(x, self.grid, self.values)
+        position = (x - self.lower)/self.step
+        i = int(position)
+        if position < 0:
+            return 0.
+        if i >= self._last:
+            return 1.
+        frac = position - i
+        return self._values[i] + frac*(self._values[i + 1] - self._values[i])
+
+
+def _erf_norm_cdf(x):
+    return 0.5*math.erfc(-x/_SQRT2)
+
+
+# The normal CDF used when pricing scalars, see use_cdf_table
+_scalar_norm_cdf = _erf_norm_cdf
+
+
+def use_cdf_table(table=True):
+    """
+    Switch the scalar pricing path between math.erfc (exact, the default) and a NormCdfTable lookup
+    :param table: True for a default table, a NormCdfTable to use that table or False to go back to erfc
+    :return: None
+    """
+    global _scalar_norm_cdf
+    if table is True:
+        table = NormCdfTable()
+    _scalar_norm_cdf = table if table else _erf_norm_cdf
+
+
+def _norm_pdf(x):
+    return np.exp(-0.5*x**2)/_SQRT2PI
+
+@lru_cache(maxsize=1024)
+def _parse_expiration(expiration):
+    """
+    Parse an expiration date string once, dateutil's parser is much slower than the pricing itself
+    :return: a date
+    """
+    return parse(expiration).date()
+
+def _expiration_date(expiration):
+    """
+    :param expiration: a date string (e.g. '1/15/2021'), a date, a datetime or a numpy datetime64
+    :return: a date
+    """
+    if isinstance(expiration, str):
+        return _parse_expiration(expiration)
+    if isinstance(expiration, np.datetime64):
+        expiration = pd.Timestamp(expiration)
+    return expiration.date() if isinstance(expiration, datetime) else expiration
+
 def BlackSholes(currentPrice, strikePrice, volatility, rate, expiration = '12/31/2020'):
-    if type(expiration) is str:
-        expiration = parse(expiration)
-    term = (expiration.date() - date.today()).days
+    term = (_expiration_date(expiration) - date.today()).days
     return _BlackSholes(currentPrice,strikePrice,volatility,rate, term, termUnits='days')
 
 def _BlackSholes(currentPrice, strikePrice, volatility, rate, term, termUnits='days'):
-    # this is the log of the current price / strike price term
-    logStockStrike = math.log(currentPrice/strikePrice)
-    # represents the sigma-squared divided by 2 term
-    sigmaDiv2 = (volatility**2)/2
-    # Convert days to part of years
+    """
+    Scalar Black-Scholes price.  Plain numbers are priced with the math module so that there is no
+    numpy dispatch overhead, anything else goes through BlackSholesArray
+    :return: a tuple of (callPrice, putPrice) as floats
+    """
+    if not all(isinstance(x, (int, float)) for x in (currentPrice, strikePrice, volatility, rate, term)):
+        callPrice, putPrice = BlackSholesArray(currentPrice, strikePrice, volatility, rate, term, termUnits=termUnits)
+        return (float(callPrice), float(putPrice))
     T = term/365 if termUnits == 'days' else term
-    ert = math.exp(-rate*T)
+    sigmaSqrtT = volatility*math.sqrt(T)
+    Kert = strikePrice*math.exp(-rate*T)
+    d1 = (math.log(currentPrice/strikePrice) + (rate + (volatility**2)/2)*T) / sigmaSqrtT
+    d2 = d1 - sigmaSqrtT
+    callPrice = currentPrice*_scalar_norm_cdf(d1) - Kert*_scalar_norm_cdf(d2)
+    putPrice = Kert*_scalar_norm_cdf(-d2) - currentPrice*_scalar_norm_cdf(-d1)
+    return (callPrice, putPrice)
 
-    d1 = (logStockStrike + (rate+sigmaDiv2)*T) / (volatility*math.sqrt(T))
-    d2 = d1 - volatility*math.sqrt(T)
-    Nd1 = norm.cdf(d1)
-    Nd2 = norm.cdf(d2)
-    callPrice = currentPrice*Nd1 - strikePrice*ert*Nd2
+def _term_in_years(term, termUnits='days'):
+    """
+    Convert a term (or array of terms) into fractions of a year
+    :param term: the time to expiration
+    :param termUnits: 'days' if the term is in calendar days, otherwise the term is assumed to be in years
+    :return: a float array of terms in years
+    """
+    term = np.asarray(term, dtype=float)
+    return term/365 if termUnits == 'days' else term
 
-    Nnegd1 = norm.cdf(-d1)
-    Nnegd2 = norm.cdf(-d2)
-    putPrice = strikePrice*ert*Nnegd2 - currentPrice*Nnegd1
+def _d1d2(currentPrice, strikePrice, volatility, rate, term, termUnits='days'):
+    """
+    Calculate the intermediate terms that are shared by the prices and the greeks
+    :return: a tuple of (S, K, sigma, r, T, sqrtT, Kert, d1, d2) as broadcastable arrays
+    """
+    S = np.asarray(currentPrice, dtype=float)
+    K = np.asarray(strikePrice, dtype=float)
+    sigma = np.asarray(volatility, dtype=float)
+    r = np.asarray(rate, dtype=float)
+    T = _term_in_years(term, termUnits)
+
+    sqrtT = np.sqrt(T)
+    sigmaSqrtT = sigma*sqrtT
+    # discounted strike price
+    Kert = K*np.exp(-r*T)
+
+    d1 = (np.log(S/K) + (r + (sigma**2)/2)*T) / sigmaSqrtT
+    d2 = d1 - sigmaSqrtT
+    return S, K, sigma, r, T, sqrtT, Kert, d1, d2
+
+def BlackSholesArray(currentPrice, strikePrice, volatility, rate, term, termUnits='days'):
+    """
+    Price european calls and puts over arrays of inputs in a single pass.  All of the inputs are
+    broadcast against one another (numpy rules) so a grid of strikes x volatilities can be priced by
+    passing arrays of shape (n, 1) and (1, m)
+    :param currentPrice: the price of the underlying
+    :param strikePrice: the strike price of the option
+    :param volatility: the annualized volatility (0.2 == 20%)
+    :param rate: the risk-free rate (0.017 == 1.7%)
+    :param term: the time to expiration
+    :param termUnits: 'days' if the term is in calendar days, otherwise the term is assumed to be in years
+    :return: a tuple of (callPrice, putPrice) arrays with the broadcast shape of the inputs
+    """
+    S, K, sigma, r, T, sqrtT, Kert, d1, d2 = _d1d2(currentPrice, strikePrice, volatility, rate, term, termUnits)
+    callPrice = S*ndtr(d1) - Kert*ndtr(d2)
+    putPrice = Kert*ndtr(-d2) - S*ndtr(-d1)
 
     return (callPrice, putPrice)
 
-if __name__ == "__main__":
-    import numpy as np
-    import pandas as pd
+def BlackSholesGreeks(currentPrice, strikePrice, volatility, rate, term, termUnits='days'):
+    """
+    Calculate the prices along with the first and second order greeks for european calls and puts.
+    The inputs broadcast the same way as BlackSholesArray so a whole option chain is one evaluation.
+
+    Units follow the textbook (per 1.0 change in the input) conventions:
+        - vega, vanna and volga are per 1.0 (100 points) of volatility
+        - theta and charm are per year of calendar time (divide by 365 for a daily value)
+        - rho is per 1.0 (100 points) of the risk-free rate
+    :param currentPrice: the price of the underlying
+    :param strikePrice: the strike price of the option
+    :param volatility: the annualized volatility (0.2 == 20%)
+    :param rate: the risk-free rate (0.017 == 1.7%)
+    :param term: the time to expiration
+    :param termUnits: 'days' if the term is in calendar days, otherwise the term is assumed to be in years
+    :return: a dictionary of arrays keyed on the name of the greek
+    """
+    S, K, sigma, r, T, sqrtT, Kert, d1, d2 = _d1d2(currentPrice, strikePrice, volatility, rate, term, termUnits)
+    Nd1 = ndtr(d1)
+    Nd2 = ndtr(d2)
+    Nnegd1 = ndtr(-d1)
+    Nnegd2 = ndtr(-d2)
+    nd1 = _norm_pdf(d1)
+
+    vega = S*nd1*sqrtT
+    # Time decay that is common to both the call and the put
+    decay = -S*nd1*sigma/(2*sqrtT)
+    charm = -nd1*(2*r*T - d2*sigma*sqrtT)/(2*T*sigma*sqrtT)
+
+    return {
+        'call': S*Nd1 - Kert*Nd2,
+        'put': Kert*Nnegd2 - S*Nnegd1,
+        'call_delta': Nd1,
+        'put_delta': Nd1 - 1,
+        'gamma': nd1/(S*sigma*sqrtT),
+        'vega': vega,
+        'call_theta': decay - r*Kert*Nd2,
+        'put_theta': decay + r*Kert*Nnegd2,
+        'call_rho': T*Kert*Nd2,
+        'put_rho': -T*Kert*Nnegd2,
+        'vanna': -nd1*d2/sigma,
+        'volga': vega*d1*d2/sigma,
+        'call_charm': charm,
+        'put_charm': charm,
+    }
+
+def ImpliedVolatility(optionPrice, currentPrice, strikePrice, rate, term, termUnits='days', optionType='call',
+                      tol=1e-8, maxIter=50):
+    """
+    Back the implied volatility out of market prices for whole arrays of contracts at once.
+    The starting point is the Corrado-Miller approximation which is then refined with Halley steps
+    (Newton with a vega/volga curvature correction).  Each contract keeps a bracket around the root and any
+    step that would leave the bracket is replaced with a bisection step, so the solver can't diverge.
+    Contracts drop out of the iteration as soon as they converge.
+    :param optionPrice: the market price of the option
+    :param currentPrice: the price of the underlying
+    :param strikePrice: the strike price of the option
+    :param rate: the risk-free rate (0.017 == 1.7%)
+    :param term: the time to expiration
+    :param termUnits: 'days' if the term is in calendar days, otherwise the term is assumed to be in years
+    :param optionType: 'call' or 'put' or an array of these values, one per contract
+    :param tol: the absolute price tolerance to consider the contract converged
+    :param maxIter: the maximum number of iterations before giving up
+    :return: a tuple of (impliedVolatility, converged) arrays with the broadcast shape of the inputs.
+        Contracts whose price is outside of the no-arbitrage bounds get an implied volatility of nan,
+        contracts that did not converge in time keep their last estimate and have converged == False
+    """
+    price, S, K, r, T, isCall = np.broadcast_arrays(np.asarray(optionPrice, dtype=float),
+                                                    np.asarray(currentPrice, dtype=float),
+                                                    np.asarray(strikePrice, dtype=float),
+                                                    np.asarray(rate, dtype=float),
+                                                    _term_in_years(term, termUnits),
+                                                    np.asarray(optionType) == 'call')
+    shape = price.shape
+    price, S, K, r, T, isCall = (a.ravel() for a in (price, S, K, r, T, isCall))
+    Kert = K*np.exp(-r*T)
+    # Work entirely in call prices, puts are converted using put-call parity
+    target = np.where(isCall, price, price + S - Kert)
+
+    valid = (target > np.maximum(S - Kert, 0)) & (target < S) & (T > 0)
+    sigma = np.full(price.shape, np.nan)
+    converged = np.zeros(price.shape, dtype=bool)
 
-    df = pd.DataFrame({'vol':np.arange(15,25,0.1)})
-    df['call'] = df['vol'].apply(lambda x: BlackSholes(166.36, 175, x, 0.017,'12/31/2020')[0])
-    df
+    # Corrado-Miller initial guess, falling back to the at-the-money approximation when it isn't defined
+    x = S - Kert
+    a = target - x/2
+    disc = np.maximum(a**2 - x**2/np.pi, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        guess = np.sqrt(2*np.pi/T)/(S + Kert)*(a + np.sqrt(disc))
+        fallback = np.sqrt(2*np.abs(np.log(S/K) + r*T)/T)
+    guess = np.where(np.isfinite(guess) & (guess > 0), guess, fallback)
+    guess = np.where(np.isfinite(guess) & (guess > 0), guess, 0.2)
+
+    lo = np.full(price.shape, 1e-6)
+    hi = np.full(price.shape, 10.)
+    sigma[valid] = np.clip(guess[valid], 1e-4, 5.)
+    active = np.flatnonzero(valid)
+
+    for _ in range(maxIter):
+        if active.size == 0:
+            break
+        s = sigma[active]
+        S_, K_, sig, r_, T_, sqrtT, Kert_, d1, d2 = _d1d2(S[active], K[active], s, r[active], T[active], 'years')
+        diff = S_*ndtr(d1) - Kert_*ndtr(d2) - target[active]
+        vega = S_*_norm_pdf(d1)*sqrtT
+        volga = vega*d1*d2/sig
+
+        done = np.abs(diff) < tol
+        converged[active[done]] = True
+
+        # Keep the bracket around the root, the call price is increasing in volatility
+        lo[active] = np.where(diff < 0, s, lo[active])
+        hi[active] = np.where(diff > 0, s, hi[active])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = diff/vega
+            step = newton/(1 - 0.5*newton*volga/vega)
+        proposed = s - step
+        l, h = lo[active], hi[active]
+        bad = ~np.isfinite(proposed) | (proposed <= l) | (proposed >= h)
+        proposed = np.where(bad, (l + h)/2, proposed)
+        sigma[active] = np.where(done, s, proposed)
+        active = active[~done]
+
+    return sigma.reshape(shape), converged.reshape(shape)
+
+if __name__ == "__main__":
+    # Micro-benchmark of the normal CDF implementations and the scalar pricing path
+    import timeit
+    from scipy.stats import norm
 
+    table = NormCdfTable()
+    grid = np.linspace(-10, 10, 200001)
+    print(f'table max error: measured {np.abs(table(grid) - ndtr(grid)).max():.2e}, bound {table.max_error:.2e}')
+    print(f'table scalar max error: {max(abs(table(x) - _erf_norm_cdf(x)) for x in grid[7::50]):.2e}')
+    n = 100000
+    for name, cdf in [('scipy.stats.norm.cdf', norm.cdf), ('scipy.special.ndtr', ndtr),
+                      ('math.erfc', _erf_norm_cdf), ('NormCdfTable', table)]:
+        per_call = min(timeit.repeat(lambda: cdf(0.3), number=n, repeat=5))/n
+        print(f'{name:>22}: {per_call*1e9:8.0f} ns per scalar call')
+    per_call = min(timeit.repeat(lambda: _BlackSholes(166.36, 175., 0.2, 0.017, 350), number=n, repeat=5))/n
+    print(f'_BlackSholes scalar: {per_call*1e6:.2f} us per call')
+    vols = np.random.default_rng(0).uniform(.15, .25, 1000000)
+    elapsed = timeit.timeit(lambda: BlackSholesArray(166.36, 175, vols, 0.017, 350), number=5)/5
+    print(f'BlackSholesArray: {elapsed*1e3:.1f} ms for 1M contracts')
@@ -0,0 +1,236 @@
+import math
+import numpy as np
+import pandas as pd
+from scipy.special import ndtri
+
+from src.constants import *
+from src.pricing_model import BlackSholesArray, BlackSholesGreeks
+
+# Each row of a positions dataframe is a holding: the ticker, the quantity (shares, or contracts for options) and
+# the instrument, one of INSTRUMENTS.  Options also need the strike, the term (in calendar days) and the volatility.
+STOCK = 'stock'
+INSTRUMENTS = [STOCK, 'call', 'put']
+OPTION_MULTIPLIER = 100
+METHODS = ['historical', 'parametric', 'monte_carlo']
+
+
+def _horizon_returns(daily, horizon):
+    """
+    Compound the daily returns over each overlapping <horizon> day window
+    """
+    if horizon == 1:
+        return daily
+    growth = np.cumsum(np.log1p(daily), axis=0)
+    growth = np.vstack([np.zeros((1, daily.shape[1])), growth])
+    return np.expm1(growth[horizon:] - growth[:-horizon])
+
+
+def _var_es(losses, confidence):
+    """
+    :param losses: array (scenarios,) of losses
+    :return: a tuple of the value at risk (the <confidence> quantile of the losses) and the expected shortfall
+        (the mean loss at or beyond it) and a boolean array of the scenarios in the tail
+    """
+    var = np.quantile(losses, confidence)
+    tail = losses >= var
+    return var, losses[tail].mean(), tail
+
+
+class RiskEngine:
+    """
+    Value at Risk and Expected Shortfall for a book of stock and option positions.  The book is revalued in full
+    over a matrix of return scenarios (scenarios x tickers): stocks with one array operation and options by
+    repricing every contract in every scenario with BlackSholesArray.
+
+    The scenarios are either the historical <horizon> day returns, or Monte Carlo paths bootstrapped from the
+    historical daily returns the same way as getLikelyPrice, except that whole days are drawn so the tickers keep
+    their correlation.  Parametric VaR is delta-normal (option deltas from BlackSholesGreeks and the covariance of
+    the historical returns).
+
+    Example:
+    positions = pd.DataFrame([{'ticker': 'MSFT', 'quantity': 100, 'instrument': 'stock'},
+                              {'ticker': 'MSFT', 'quantity': -2, 'instrument': 'call', 'strike': 180, 'term': 30,
+                               'volatility': 0.25}])
+    engine = RiskEngine(positions, spot={'MSFT': 170.}, returns=panel[ColumnNames.PCT_DAY_CHANGE], rate=0.017)
+    engine.var(0.99, method='monte_carlo')
+    """
+
+    def __init__(self, positions, spot, returns, rate=0., horizon=1, multiplier=OPTION_MULTIPLIER):
+        """
+        :param positions: a dataframe of positions, see INSTRUMENTS
+        :param spot: the current price of each ticker, a dictionary or series
+        :param returns: a dataframe of daily returns (dates x tickers), e.g. StockPanel[ColumnNames.PCT_DAY_CHANGE]
+        :param rate: the risk-free rate (0.017 == 1.7%)
+        :param horizon: the number of trading days the risk is measured over
+        :param multiplier: the number of shares per option contract
+        """
+        self.positions = self._validate(positions)
+        self.tickers = sorted(set(self.positions['ticker']))
+        self.spot = pd.Series(spot, dtype=float)[self.tickers]
+        self.returns = pd.DataFrame(returns)[self.tickers].to_numpy(dtype=float)
+        self.rate = rate
+        self.horizon = horizon
+        self.multiplier = multiplier
+        self._scenarios = {}
+
+    @staticmethod
+    def _validate(positions):
+        positions = pd.DataFrame(positions).reset_index(drop=True)
+        for column in ('strike', 'term', 'volatility'):
+            if column not in positions.columns:
+                positions[column] = np.nan
+        unknown = set(positions['instrument']) - set(INSTRUMENTS)
+        if unknown:
+            raise ValueError(f'Unknown instruments {sorted(unknown)}, expected one of {INSTRUMENTS}')
+        options = positions['instrument'] != STOCK
+        if positions.loc[options, ['strike', 'term', 'volatility']].isna().any(axis=None):
+            raise ValueError('Options need a strike, term and volatility')
+        return positions
+
+    def _option_values(self, spot, positions, elapsed_days=0.):
+        """
+        :param spot: array (..., options) of the price of each option's underlying
+        :return: the value of one share's worth of each option, the intrinsic value once it has expired
+        """
+        remaining = positions['term'].to_numpy(dtype=float) - elapsed_days
+        is_call = (positions['instrument'] == 'call').to_numpy()
+        strike = positions['strike'].to_numpy(dtype=float)
+        with np.errstate(all='ignore'):
+            call, put = BlackSholesArray(spot, strike, positions['volatility'].to_numpy(dtype=float), self.rate,
+                                         np.maximum(remaining, 1e-9))
+        value = np.where(is_call, call, put)
+        intrinsic = np.maximum(np.where(is_call, spot - strike, strike - spot), 0.)
+        return np.where(remaining > 0, value, intrinsic)
+
+    def scenarios(self, method='historical', n_scenarios=10000, seed=None):
+        """
+        :param method: 'historical' for the overlapping <horizon> day returns in the history or 'monte_carlo'
+            for <n_scenarios> bootstrapped paths
+        :param seed: anything accepted by numpy.random.default_rng so that the scenarios can be reproduced
+        :return: an array (scenarios x tickers) of the return of each ticker over the horizon
+        """
+        key = (method, n_scenarios, seed) if seed is not None or method == 'historical' else None
+        if key in self._scenarios:
+            return self._scenarios[key]
+        daily = np.nan_to_num(self.returns[np.isfinite(self.returns).any(axis=1)])
+        if method == 'historical':
+            scenarios = _horizon_returns(daily, self.horizon)
+        elif method == 'monte_carlo':
+            rng = np.random.default_rng(seed)
+            growth = np.ones((n_scenarios, daily.shape[1]))
+            for _ in range(self.horizon):
+                growth *= 1 + daily[rng.integers(0, len(daily), n_scenarios)]
+            scenarios = growth - 1
+        else:
+            raise ValueError(f"Unknown method '{method}' expected 'historical' or 'monte_carlo'")
+        if key is not None:
+            self._scenarios[key] = scenarios
+        return scenarios
+
+    def revalue(self, scenarios, positions=None):
+        """
+        Revalue the positions in every scenario
+        :param scenarios: an array (scenarios x tickers) of returns over the horizon, see scenarios
+        :param positions: the positions to revalue, defaults to the book
+        :return: an array (scenarios x positions) of the profit or loss of each position
+        """
+        positions = self.positions if positions is None else self._validate(positions)
+        column = [self.tickers.index(t) for t in positions['ticker']]
+        spot = self.spot.to_numpy()[column]
+        moves = scenarios[:, column]
+        quantity = positions['quantity'].to_numpy(dtype=float)
+        options = (positions['instrument'] != STOCK).to_numpy()
+        pnl = moves * spot * quantity
+        if options.any():
+            held = positions[options]
+            base = self._option_values(spot[options], held)
+            elapsed = self.horizon * 365 / ANN_TRADE_DAYS
+            value = self._option_values(spot[options] * (1 + moves[:, options]), held, elapsed)
+            pnl[:, options] = (value - base) * quantity[options] * self.multiplier
+        return pnl
+
+    def _dollar_deltas(self, positions=None):
+        """
+        :return: the change in the value of each position for a 100% move in its underlying
+        """
+        positions = self.positions if positions is None else positions
+        spot = self.spot[positions['ticker']].to_numpy()
+        delta = np.ones(len(positions))
+        options = (positions['instrument'] != STOCK).to_numpy()
+        if options.any():
+            held = positions[options]
+            greeks = BlackSholesGreeks(spot[options], held['strike'].to_numpy(dtype=float),
+                                       held['volatility'].to_numpy(dtype=float), self.rate,
+                                       held['term'].to_numpy(dtype=float))
+            is_call = (held['instrument'] == 'call').to_numpy()
+            delta[options] = np.where(is_call, greeks['call_delta'], greeks['put_delta']) * self.multiplier
+        return delta * spot * positions['quantity'].to_numpy(dtype=float)
+
+    def _parametric(self, confidence, positions=None):
+        positions = self.positions if positions is None else positions
+        exposure = self._dollar_deltas(positions)
+        column = [self.tickers.index(t) for t in positions['ticker']]
+        covariance = pd.DataFrame(self.returns).cov().to_numpy()[np.ix_(column, column)] * self.horizon
+        sigma_exposure = covariance @ exposure
+        sigma = math.sqrt(max(exposure @ sigma_exposure, 0.))
+        z = ndtri(confidence)
+        var, es = z * sigma, sigma * math.exp(-z * z / 2) / math.sqrt(2 * math.pi) / (1 - confidence)
+        # Euler allocation, the components add up to the total
+        share = exposure * sigma_exposure / sigma ** 2 if sigma > 0 else np.zeros(len(exposure))
+        return var, es, share * var, share * es
+
+    def var(self, confidence=0.99, method='historical', n_scenarios=10000, seed=None):
+        """
+        :param confidence: the confidence level, e.g. 0.99
+        :param method: one of METHODS
+        :return: a dictionary with the var and es (expected shortfall) as positive losses over the horizon
+        """
+        if method == 'parametric':
+            var, es, _, _ = self._parametric(confidence)
+        else:
+            losses = -self.revalue(self.scenarios(method, n_scenarios, seed)).sum(axis=1)
+            var, es, _ = _var_es(losses, confidence)
+        return {'var': float(var), 'es': float(es)}
+
+    def component_var(self, confidence=0.99, method='historical', n_scenarios=10000, seed=None, band=0.005):
+        """
+        The contribution of each position to the VaR and ES (the Euler allocation).  For the simulated methods
+        the VaR contribution is the average loss of the position in the scenarios whose portfolio loss is
+        within <band> of the VaR quantile, so the contributions add up to the VaR only approximately, the ES
+        contributions add up to the ES exactly.
+        :param band: the width, in quantiles, of the scenarios around the VaR that are averaged
+        :return: a dataframe of the positions with var and es columns
+        """
+        if method == 'parametric':
+            _, _, var, es = self._parametric(confidence)
+        else:
+            pnl = self.revalue(self.scenarios(method, n_scenarios, seed))
+            losses = -pnl.sum(axis=1)
+            _, _, tail = _var_es(losses, confidence)
+            low, high = np.quantile(losses, [max(confidence - band, 0.), min(confidence + band, 1.)])
+            near = (losses >= low) & (losses <= high)
+            var = -pnl[near].mean(axis=0)
+            es = -pnl[tail].mean(axis=0)
+        return self.positions.assign(var=var, es=es)
+
+    def incremental_var(self, positions, confidence=0.99, method='historical', n_scenarios=10000, seed=None):
+        """
+        The change in the VaR and ES from adding positions to the book.  The book isn't revalued again, the new
+        positions are revalued over the same scenarios and added to the book's profit or loss.
+        :param positions: a dataframe of the positions to add
+        :return: a dictionary with the change in the var and es
+        """
+        positions = self._validate(positions)
+        missing = set(positions['ticker']) - set(self.tickers)
+        if missing:
+            raise ValueError(f'No returns or spot prices for {sorted(missing)}')
+        if method == 'parametric':
+            var, es, _, _ = self._parametric(confidence)
+            new_var, new_es, _, _ = self._parametric(confidence, pd.concat([self.positions, positions],
+                                                                           ignore_index=True))
+        else:
+            scenarios = self.scenarios(method, n_scenarios, seed)
+            book = self.revalue(scenarios).sum(axis=1)
+            var, es, _ = _var_es(-book, confidence)
+            new_var, new_es, _ = _var_es(-(book + self.revalue(scenarios, positions).sum(axis=1)), confidence)
+        return {'var': float(new_var - var), 'es': float(new_es - es)}
@@ -0,0 +1,269 @@
+import math
+import numpy as np
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+from scipy.signal import lfilter
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Rolling window statistics over the rows of 2-D arrays (dates x series) so that thousands of series are handled
+# in one pass.  Each function takes a 1-D or 2-D array (or a Series/DataFrame) and a window, or a list of windows
+# in which case the results are stacked along a new first axis.  As with pandas rolling(window), a value is NaN
+# until there are <min_periods> (by default <window>) values in the window.  NaN and +/-inf are treated as missing.
+#
+# When numba is installed the kernels are compiled, otherwise they fall back to NumPy/SciPy.
+
+HAVE_NUMBA = numba is not None
+_use_jit = HAVE_NUMBA
+
+
+def use_jit(jit=True):
+    """
+    Switch between the numba kernels (the default when numba is installed) and the NumPy/SciPy ones
+    :param jit: False to use NumPy/SciPy
+    :return: None
+    """
+    global _use_jit
+    assert not jit or HAVE_NUMBA, 'numba is not installed'
+    _use_jit = jit
+
+
+def jit_enabled():
+    """
+    :return: True if the numba kernels are being used
+    """
+    return _use_jit
+
+
+def _as_2d(values):
+    values = np.asarray(values, dtype=float)
+    return values.reshape(len(values), -1), values.shape
+
+
+def _windows(window):
+    """
+    :return: a tuple of the list of windows and True if a single window was given
+    """
+    single = np.ndim(window) == 0
+    windows = [int(window)] if single else [int(w) for w in window]
+    assert all(w >= 1 for w in windows), 'The windows need to be at least 1'
+    return windows, single
+
+
+def _stack(results, shape, single):
+    results = [r.reshape(shape) for r in results]
+    return results[0] if single else np.stack(results)
+
+
+def _trailing_sums(cumulative, window):
+    """
+    The sum over the trailing <window> rows from a cumulative sum that starts with a row of zeros
+    """
+    n = len(cumulative) - 1
+    return cumulative[1:] - cumulative[np.maximum(np.arange(1, n + 1) - window, 0)]
+
+
+def _cumulative(values):
+    return np.concatenate([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+
+
+def _numpy_moments(values, windows, min_periods, ddof, std):
+    finite = np.isfinite(values)
+    # The sums are taken around each column's mean so they don't lose precision when the values are large
+    # compared to their spread
+    with np.errstate(all='ignore'):
+        centre = np.nanmean(np.where(finite, values, np.nan), axis=0)
+    centred = np.where(finite, values - np.nan_to_num(centre), 0.)
+    counts = _cumulative(finite.astype(float))
+    sums = _cumulative(centred)
+    squares = _cumulative(centred * centred) if std else None
+    results = []
+    for window in windows:
+        count = _trailing_sums(counts, window)
+        total = _trailing_sums(sums, window)
+        required = window if min_periods is None else max(min_periods, 1)
+        with np.errstate(all='ignore'):
+            if std:
+                variance = (_trailing_sums(squares, window) - total * total / count) / (count - ddof)
+                result = np.sqrt(np.maximum(variance, 0.))
+                result[count <= ddof] = np.nan
+            else:
+                result = centre + total / count
+        result[count < required] = np.nan
+        results.append(result)
+    return results
+
+
+def _numpy_extreme(values, windows, min_periods, maximum):
+    finite = np.isfinite(values)
+    fill = -np.inf if maximum else np.inf
+    filled = np.where(finite, values, fill)
+    counts = _cumulative(finite.astype(float))
+    extreme = maximum_filter1d if maximum else minimum_filter1d
+    results = []
+    for window in windows:
+        result = extreme(filled, window, axis=0, origin=(window - 1) // 2, mode='constant', cval=fill)
+        result[_trailing_sums(counts, window) < (window if min_periods is None else max(min_periods, 1))] = np.nan
+        results.append(result)
+    return results
+
+
+if HAVE_NUMBA:
+
+    # The kernels take the values transposed (series x dates) so that each series is contiguous in memory
+    @numba.njit(cache=True)
+    def _jit_moments(values, window, min_periods, ddof, std):
+        m, n = values.shape
+        out = np.full((m, n), np.nan)
+        for j in range(m):
+            shift = 0.
+            for t in range(n):
+                if math.isfinite(values[j, t]):
+                    shift = values[j, t]
+                    break
+            total = 0.
+            squares = 0.
+            count = 0
+            for t in range(n):
+                x = values[j, t]
+                if math.isfinite(x):
+                    d = x - shift
+                    total += d
+                    squares += d * d
+                    count += 1
+                if t >= window:
+                    x = values[j, t - window]
+                    if math.isfinite(x):
+                        d = x - shift
+                        total -= d
+                        squares -= d * d
+                        count -= 1
+                if count >= min_periods and count > 0:
+                    if not std:
+                        out[j, t] = shift + total / count
+                    elif count > ddof:
+                        out[j, t] = math.sqrt(max((squares - total * total / count) / (count - ddof), 0.))
+        return out
+
+    @numba.njit(cache=True)
+    def _jit_extreme(values, window, min_periods, maximum):
+        # A monotonic deque of the rows that could still be the extreme of a window
+        m, n = values.shape
+        out = np.full((m, n), np.nan)
+        rows = np.empty(n, dtype=np.int64)
+        for j in range(m):
+            head = 0
+            tail = 0
+            count = 0
+            for t in range(n):
+                x = values[j, t]
+                if math.isfinite(x):
+                    count += 1
+                    while tail > head and ((values[j, rows[tail - 1]] <= x) if maximum
+                                           else (values[j, rows[tail - 1]] >= x)):
+                        tail -= 1
+                    rows[tail] = t
+                    tail += 1
+                if t >= window and math.isfinite(values[j, t - window]):
+                    count -= 1
+                while tail > head and rows[head] <= t - window:
+                    head += 1
+                if count >= min_periods and count > 0:
+                    out[j, t] = values[j, rows[head]]
+        return out
+
+
+def _moments(values, window, min_periods, ddof, std):
+    values, shape = _as_2d(values)
+    windows, single = _windows(window)
+    if _use_jit:
+        series = np.ascontiguousarray(values.T)
+        results = [_jit_moments(series, w, w if min_periods is None else min_periods, ddof, std).T for w in windows]
+    else:
+        results = _numpy_moments(values, windows, min_periods, ddof, std)
+    return _stack(results, shape, single)
+
+
+def _extreme(values, window, min_periods, maximum):
+    values, shape = _as_2d(values)
+    windows, single = _windows(window)
+    if _use_jit:
+        series = np.ascontiguousarray(values.T)
+        results = [_jit_extreme(series, w, w if min_periods is None else min_periods, maximum).T for w in windows]
+    else:
+        results = _numpy_extreme(values, windows, min_periods, maximum)
+    return _stack(results, shape, single)
+
+
+def rolling_mean(values, window, min_periods=None):
+    """
+    :param values: a 1-D or 2-D array, rows are in date order
+    :param window: the number of rows in the window or a list of them
+    :param min_periods: the number of values needed in the window, defaults to the window
+    :return: an array the shape of values, or (len(window),) + values.shape for a list of windows
+    """
+    return _moments(values, window, min_periods, 0, False)
+
+
+def rolling_std(values, window, min_periods=None, ddof=1):
+    """
+    The rolling standard deviation, see rolling_mean
+    :param ddof: delta degrees of freedom, 1 (as in pandas) for the sample standard deviation
+    """
+    return _moments(values, window, min_periods, ddof, True)
+
+
+def rolling_min(values, window, min_periods=None):
+    """
+    The rolling minimum, see rolling_mean
+    """
+    return _extreme(values, window, min_periods, False)
+
+
+def rolling_max(values, window, min_periods=None):
+    """
+    The rolling maximum, see rolling_mean
+    """
+    return _extreme(values, window, min_periods, True)
+
+
+def rolling_zscore(values, window, min_periods=None, ddof=1):
+    """
+    The number of standard deviations each value is from the mean of its trailing window, see rolling_mean
+    """
+    values = np.asarray(values, dtype=float)
+    mean = rolling_mean(values, window, min_periods)
+    with np.errstate(all='ignore'):
+        return (values - mean) / rolling_std(values, window, min_periods, ddof)
+
+
+def ewm_mean(values, span=None, alpha=None, min_periods=0):
+    """
+    The exponentially weighted moving average, the same as pandas ewm(span=..., adjust=True).mean().  Each value
+    is the weighted average of the values so far with weights (1 - alpha)**age, missing values have no weight.
+    :param values: a 1-D or 2-D array, rows are in date order
+    :param span: the span (alpha = 2 / (span + 1)) or a list of them
+    :param alpha: the smoothing factor, if span isn't given
+    :param min_periods: the number of values needed before there is an average
+    :return: an array the shape of values, or (len(span),) + values.shape for a list of spans
+    """
+    values, shape = _as_2d(values)
+    if span is not None:
+        alphas, single = [2 / (s + 1) for s in np.atleast_1d(span)], np.ndim(span) == 0
+    else:
+        alphas, single = list(np.atleast_1d(alpha)), np.ndim(alpha) == 0
+    finite = np.isfinite(values)
+    weighted = np.where(finite, values, 0.)
+    counts = np.cumsum(finite, axis=0)
+    results = []
+    for a in alphas:
+        # y[t] = x[t] + (1 - a) * y[t-1] run over the rows in C, for the values and for their weights
+        total = lfilter([1.], [1., a - 1.], weighted, axis=0)
+        weight = lfilter([1.], [1., a - 1.], finite.astype(float), axis=0)
+        with np.errstate(all='ignore'):
+            result = total / weight
+        result[(counts < max(min_periods, 1))] = np.nan
+        results.append(result)
+    return _stack(results, shape, single)
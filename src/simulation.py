@@ -0,0 +1,359 @@
+import math
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+# The number of paths that are held in memory at one time
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def _as_returns(historical_returns):
+    """
+    Convert the historical returns into a flat float array dropping anything that isn't a number
+    (e.g. the NaN at the start of a pct_change series)
+    :param historical_returns: Series, list or array of returns
+    :return: a numpy array of returns
+    """
+    returns = np.asarray(historical_returns, dtype=float).ravel()
+    returns = returns[np.isfinite(returns)]
+    assert len(returns) > 0, 'Unable to find any historical returns to sample from'
+    return returns
+
+
+def _chunk_seeds(seed, n_chunks):
+    """
+    Create an independent random stream for each chunk of paths.  Since each chunk has its own stream,
+    the paths in a chunk don't depend on the order (or process) in which the chunks are simulated
+    :param seed: an int, a SeedSequence or None for fresh entropy
+    :param n_chunks: the number of streams to create
+    :return: a list of SeedSequences
+    """
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return root.spawn(n_chunks)
+
+
+def _chunk_bounds(n_paths, chunk_size):
+    """
+    Split the paths into chunks
+    :return: a list of (start, stop) tuples
+    """
+    n_chunks = max(1, math.ceil(n_paths / chunk_size))
+    return [(i * chunk_size, min((i + 1) * chunk_size, n_paths)) for i in range(n_chunks)]
+
+
+def _horizon_labels(horizons):
+    """
+    Horizons can either be a list of days or a dictionary of {label: days}
+    :return: a tuple of (labels, days)
+    """
+    if isinstance(horizons, dict):
+        return list(horizons.keys()), [int(d) for d in horizons.values()]
+    days = [int(d) for d in np.atleast_1d(horizons)]
+    return days, days
+
+
+def simulate_price_paths(starting_price, historical_returns, period, n_paths=1, seed=None):
+    """
+    Simulate price paths by bootstrapping (sampling with replacement) from the historical returns.
+    All of the paths x days are drawn in a single block and then compounded with cumprod.
+    NOTE: the historical returns need to be in the same units as period, so if the historical returns
+    are calculated daily then it is assumed that the period is in number of days
+    :param starting_price: the price on the first day of each path
+    :param historical_returns: Series of returns in the same frequency as <period>
+    :param period: the number of prices in each path (including the starting price)
+    :param n_paths: the number of paths to simulate
+    :param seed: anything accepted by numpy.random.default_rng
+    :return: an array of shape (n_paths, period)
+    """
+    rng = np.random.default_rng(seed)
+    returns = _as_returns(historical_returns)
+    paths = np.empty((n_paths, period))
+    paths[:, 0] = starting_price
+    if period > 1:
+        growth = 1 + returns[rng.integers(0, len(returns), size=(n_paths, period - 1))]
+        np.cumprod(growth, axis=1, out=paths[:, 1:])
+        paths[:, 1:] *= starting_price
+    return paths
+
+
+def _horizon_statistic(paths, days, statistic='mean'):
+    """
+    Calculate the path level statistic for each of the horizons
+    :param paths: an array of shape (n_paths, period)
+    :param days: the list of horizons, in days
+    :param statistic: 'mean' for the average price over the horizon (what getLikelyPrice reports)
+        or 'last' for the price at the end of the horizon
+    :return: an array of shape (n_paths, len(days))
+    """
+    idx = np.asarray(days) - 1
+    if statistic == 'mean':
+        return np.cumsum(paths, axis=1)[:, idx] / np.asarray(days)
+    elif statistic == 'last':
+        return paths[:, idx]
+    raise ValueError(f"Unknown statistic '{statistic}' expected one of 'mean' or 'last'")
+
+
+def _resolve_n_jobs(n_jobs):
+    """
+    Follow the joblib convention where -1 means use all of the cores
+    :return: the number of worker processes to use
+    """
+    cores = os.cpu_count() or 1
+    n_jobs = cores + 1 + n_jobs if n_jobs < 0 else n_jobs
+    return max(1, n_jobs)
+
+
+def _simulate_shared_chunk(task):
+    """
+    Worker process entry point.  The historical returns are read from, and the results are written to, shared
+    memory so that neither has to be pickled back and forth between the processes
+    :param task: a tuple describing the chunk to simulate
+    :return: None
+    """
+    (returns_name, n_returns, results_name, n_paths, start, stop, chunk_seed,
+     starting_price, days, statistic) = task
+    returns_shm = shared_memory.SharedMemory(name=returns_name)
+    results_shm = shared_memory.SharedMemory(name=results_name)
+    returns = results = None
+    try:
+        returns = np.ndarray((n_returns,), dtype=float, buffer=returns_shm.buf)
+        results = np.ndarray((n_paths, len(days)), dtype=float, buffer=results_shm.buf)
+        paths = simulate_price_paths(starting_price, returns, max(days), stop - start, seed=chunk_seed)
+        results[start:stop] = _horizon_statistic(paths, days, statistic)
+    except BaseException as error:
+        # the frames of the traceback still hold views of the shared memory, which would make close() raise a
+        # BufferError in place of the real error
+        traceback.clear_frames(error.__traceback__)
+        raise
+    finally:
+        # The views have to be released before the shared memory can be closed
+        del returns, results
+        returns_shm.close()
+        results_shm.close()
+
+
+def _simulate_parallel(starting_price, returns, days, n_paths, bounds, seeds, statistic, n_jobs):
+    """
+    Simulate the chunks across a pool of processes
+    :return: an array of shape (n_paths, len(days))
+    """
+    returns_shm = shared_memory.SharedMemory(create=True, size=returns.nbytes)
+    results_shm = shared_memory.SharedMemory(create=True, size=max(1, n_paths * len(days) * 8))
+    try:
+        np.ndarray(returns.shape, dtype=float, buffer=returns_shm.buf)[:] = returns
+        tasks = [(returns_shm.name, len(returns), results_shm.name, n_paths, start, stop, chunk_seed,
+                  starting_price, days, statistic)
+                 for (start, stop), chunk_seed in zip(bounds, seeds)]
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            # list() so that any exception raised in a worker is raised here
+            list(pool.map(_simulate_shared_chunk, tasks))
+        results = np.ndarray((n_paths, len(days)), dtype=float, buffer=results_shm.buf).copy()
+    finally:
+        returns_shm.close()
+        returns_shm.unlink()
+        results_shm.close()
+        results_shm.unlink()
+    return results
+
+
+def simulate_horizons(starting_price, historical_returns, horizons, n_paths=1000, seed=None, statistic='mean',
+                      chunk_size=DEFAULT_CHUNK_SIZE, n_jobs=1):
+    """
+    Run a single bootstrap simulation and report the path level statistic for several horizons.  Each path is
+    simulated out to the longest horizon and the shorter horizons are read from the same path.
+    The paths are processed in chunks of <chunk_size> so memory stays bounded by chunk_size x longest horizon.
+
+    Each chunk gets its own random stream (SeedSequence.spawn) and writes to its own rows of the result, so for
+    a given seed and chunk_size the result is bit-identical no matter how many processes were used.
+
+    Example:
+    df_returns = simulate_horizons(price, returns, {'30_days': 30, '90_days': 90, 'To_Expiration': 352}, seed=42)
+    :param starting_price: the price on the first day of each path
+    :param historical_returns: Series of returns in the same frequency as the horizons
+    :param horizons: a list of horizons in days or a dictionary of {column name: days}
+    :param n_paths: the number of paths to simulate
+    :param seed: an int or SeedSequence so that the simulation can be reproduced
+    :param statistic: 'mean' for the average price over the horizon or 'last' for the price at the horizon
+    :param chunk_size: the number of paths to hold in memory at one time (per process)
+    :param n_jobs: the number of processes to use, -1 to use all of the cores
+    :return: a dataframe with one row per path and one column per horizon
+    """
+    labels, days = _horizon_labels(horizons)
+    returns = _as_returns(historical_returns)
+    bounds = _chunk_bounds(n_paths, chunk_size)
+    seeds = _chunk_seeds(seed, len(bounds))
+    n_jobs = min(_resolve_n_jobs(n_jobs), len(bounds))
+    if n_jobs > 1:
+        results = _simulate_parallel(starting_price, returns, days, n_paths, bounds, seeds, statistic, n_jobs)
+    else:
+        results = np.empty((n_paths, len(days)))
+        for (start, stop), chunk_seed in zip(bounds, seeds):
+            paths = simulate_price_paths(starting_price, returns, max(days), stop - start, seed=chunk_seed)
+            results[start:stop] = _horizon_statistic(paths, days, statistic)
+    return pd.DataFrame(results, columns=labels)
+
+
+class QuantileSketch:
+    """
+    A bounded memory, mergeable sketch for estimating quantiles of a stream (a simplified KLL sketch).
+    Values are added to level 0.  When a level holds more than <capacity> values it is sorted and every
+    other value (starting at a random offset) is promoted to the next level where it counts double.
+    Memory is roughly capacity x log2(n / capacity) no matter how many values have been seen.
+    """
+
+    def __init__(self, capacity=256, seed=None):
+        self.capacity = capacity
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        self.levels[0] = np.concatenate([self.levels[0], np.asarray(values, dtype=float).ravel()])
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self.capacity:
+                compact = np.sort(self.levels[level])
+                even = len(compact) - len(compact) % 2
+                promoted = compact[self._rng.integers(2):even:2]
+                self.levels[level] = compact[even:]
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantile(self, q):
+        """
+        :param q: a quantile or array of quantiles between 0 and 1
+        :return: the estimated value(s) at the quantile(s)
+        """
+        values = np.concatenate(self.levels)
+        assert len(values) > 0, 'Unable to calculate a quantile before any values have been added'
+        weights = np.concatenate([np.full(len(v), 2.0 ** i) for i, v in enumerate(self.levels)])
+        order = np.argsort(values)
+        cum_weights = np.cumsum(weights[order])
+        idx = np.searchsorted(cum_weights, np.asarray(q) * cum_weights[-1])
+        return values[order][np.minimum(idx, len(values) - 1)]
+
+
+class StreamingStats:
+    """
+    Accumulate statistics about simulated prices a batch at a time without keeping the prices around.
+        - running mean and variance (Welford, with Chan's update to merge a whole batch at once)
+        - quantiles using a QuantileSketch
+        - the probability of being in the money, where in the money means the price is above
+          strike + premium (matching the ITM columns in the Assignment1 notebook)
+    """
+
+    def __init__(self, strike=None, premium=0., sketch_capacity=256, seed=None):
+        self.strike = strike
+        self.premium = premium
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+        self._itm_count = 0
+        self.sketch = QuantileSketch(sketch_capacity, seed=seed)
+
+    def update(self, values):
+        """
+        Add a batch of values to the running statistics
+        :param values: an array of simulated prices
+        :return: self
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        n = len(values)
+        if n == 0:
+            return self
+        batch_mean = values.mean()
+        batch_m2 = ((values - batch_mean) ** 2).sum()
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean += delta * n / total
+        self._m2 += batch_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        if self.strike is not None:
+            self._itm_count += int((values - self.premium - self.strike > 0).sum())
+        self.sketch.update(values)
+        return self
+
+    @property
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def standard_error(self):
+        return self.std / math.sqrt(self.count) if self.count > 1 else np.nan
+
+    @property
+    def itm_probability(self):
+        assert self.strike is not None, 'A strike price is required to calculate the probability in the money'
+        return self._itm_count / self.count if self.count > 0 else np.nan
+
+    @property
+    def itm_standard_error(self):
+        """
+        The Agresti-Coull standard error, which adds two successes and two failures so that the error isn't 0 when
+        none (or all) of the paths so far are in the money
+        """
+        assert self.strike is not None, 'A strike price is required to calculate the probability in the money'
+        if self.count == 0:
+            return np.nan
+        n = self.count + 4
+        p = (self._itm_count + 2) / n
+        return math.sqrt(p * (1 - p) / n)
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+    def summary(self):
+        """
+        :return: a dictionary of the current statistics
+        """
+        summary = {'count': self.count, 'mean': self.mean, 'std': self.std, 'standard_error': self.standard_error}
+        for q in (0.05, 0.25, 0.5, 0.75, 0.95):
+            summary[f'q{int(q * 100):02d}'] = float(self.quantile(q))
+        if self.strike is not None:
+            summary['itm_probability'] = self.itm_probability
+            summary['itm_standard_error'] = self.itm_standard_error
+        return summary
+
+
+def simulate_until_converged(starting_price, historical_returns, period, tol, target='mean', strike=None,
+                             premium=0., statistic='mean', batch_size=DEFAULT_CHUNK_SIZE, max_paths=1000000,
+                             min_paths=1000, seed=None):
+    """
+    Simulate batches of paths, feeding them into a StreamingStats, until the standard error of the target
+    estimate falls below <tol> (or max_paths is reached).  Only one batch of paths is in memory at a time.
+    :param starting_price: the price on the first day of each path
+    :param historical_returns: Series of returns in the same frequency as <period>
+    :param period: the horizon, in days
+    :param tol: stop once the standard error of the target is below this value
+    :param target: 'mean' to converge on the expected price or 'itm' for the probability in the money
+    :param strike: the strike price used to determine the probability in the money
+    :param premium: the price paid for the option, added to the strike to determine if the path is in the money
+    :param statistic: 'mean' for the average price over the horizon or 'last' for the price at the horizon
+    :param batch_size: the number of paths simulated between convergence checks
+    :param max_paths: the maximum number of paths to simulate
+    :param min_paths: the minimum number of paths before checking for convergence
+    :param seed: an int or SeedSequence so that the simulation can be reproduced
+    :return: the StreamingStats with the results of the simulation
+    """
+    if target not in ('mean', 'itm'):
+        raise ValueError(f"Unknown target '{target}' expected one of 'mean' or 'itm'")
+    assert target != 'itm' or strike is not None, 'A strike price is required to converge on the itm probability'
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    returns = _as_returns(historical_returns)
+    stats = StreamingStats(strike=strike, premium=premium, seed=root.spawn(1)[0])
+    while stats.count < max_paths:
+        n = min(batch_size, max_paths - stats.count)
+        paths = simulate_price_paths(starting_price, returns, period, n, seed=root.spawn(1)[0])
+        stats.update(_horizon_statistic(paths, [period], statistic))
+        error = stats.standard_error if target == 'mean' else stats.itm_standard_error
+        if stats.count >= min_paths and error < tol:
+            break
+    return stats
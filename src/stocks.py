@@ -1,30 +1,55 @@
 import string
-import os, sys
+import os
 from enum import Enum
-from typing import List, Union
 from dotenv import load_dotenv
 from src.utils import *
 from src.constants import *
+from src.simulation import simulate_price_paths
+from src.market_data import BarCache, AlphaVantageFetcher, FetchError, COMPACT_DAYS, ALPHA_VANTAGE_CALLS_PER_MINUTE
+from src.bar_store import BarStore
+from src.indicators import calculate_indicator
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import random
+import threading
+import time
 import math
-from dateutil.relativedelta import  relativedelta
+from collections import deque
 import numpy as np
 import pandas as pd
-from alpha_vantage.timeseries import TimeSeries
 
-ANN_TRADE_DAYS = 252
 load_dotenv()
-EX_API_KEY = os.getenv('IEX_TOKEN')
 ALPHA_API = os.getenv('ALPHA_VANTAGE_TOKEN')
+# The minimum number of bars StockChart.AppendBars buffers before concatenating them onto the data
+APPEND_BATCH = 256
 
-# Provides the ability to avoid having to create this everywhere
-_today = pd.Timestamp(TODAY)
+# The BarCache (and so the AlphaVantage rate limiter) shared by every load that isn't given its own cache
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def _today():
+    return pd.Timestamp.today()
+
+
+def _default_cache():
+    """
+    :return: the BarCache in DS_EXTERNAL that fetches from AlphaVantage, created the first time it is needed so that
+        every load shares one session and one rate limiter
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = BarCache(folder=DS_EXTERNAL, fetcher=AlphaVantageFetcher(ALPHA_API))
+        return _shared_cache
 
 class SortOrder(Enum):
     ASC = 'asc'
     DESC = 'desc'
 
     def previous_day(self):
-        return -1 if self == SortOrder.ASC else 1
+        # the number of rows to shift to get to the previous day
+        return 1 if self == SortOrder.ASC else -1
 
 def get_sp500():
     table = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')
@@ -39,63 +64,36 @@ def get_sp500_tickers():
 
 
 
-def getLikelyPrice(starting_price, historical_returns, period):
+def getLikelyPrice(starting_price, historical_returns, period, seed=None):
     """
     Using a monte-carlo like simulation to calculate the price of an asset using historical returns
     NOTE: the historical returns need to be in the same units as period, so if the historical returns
     are calculated daily then it is assumed tha the period is in number of days
+    To run many simulations over several horizons at once use src.simulation.simulate_horizons
     :param historical_returns: Series of returns in the same frequency as <period>
     :param period: the period over which to calculate the return
+    :param seed: anything accepted by numpy.random.default_rng so that the simulation can be reproduced
+    :return: the average price over the simulated period
     """
-    daily_prices = np.zeros(period)
-    daily_prices[0] = starting_price
-    for x in range(period-1):
-        sample_yield = historical_returns.sample(n=1)
-        daily_prices[x+1] = daily_prices[x]*(sample_yield +1)
-    m = daily_prices.mean()
-    if (np.isnan(m)):
-        print(f"Got nan:\n{daily_prices}")
-
+    daily_prices = simulate_price_paths(starting_price, historical_returns, period, seed=seed)[0]
     return daily_prices.mean()
 
-def _getHistoricalTicker(ticker, full=False):
-
-    # Using AlphaVantage https://alpha-vantage.readthedocs.io/en/latest/
-    # As of now, this just gets the last 100 days if I need more I'll have to do specify
-    #  outputsize = 'full' which would bring back everything.  In that case, I'd likely try to load it from
-    #  the CSV file instead and then merge together
-    ts = TimeSeries(ALPHA_API, output_format='pandas')
-    meta = None
+def _getHistoricalTicker(ticker, full=False, cache=None):
+    """
+    Get the daily bars for a ticker.
+    :param ticker: the ticker symbol
+    :param full: if True then get the whole history from the local BarCache (only the missing trailing days are
+        fetched from the source) else get the last 100 days straight from the source
+    :param cache: the BarCache to use, defaults to the shared cache in DS_EXTERNAL that fetches from AlphaVantage.
+        For the last 100 days its fetcher needs to take the number of bars as <last>, as AlphaVantageFetcher does
+    :return: a tuple of the dataframe and the metadata (which is always None)
+    """
+    cache = cache if cache is not None else _default_cache()
     if full:
-        historical = read_latest(ticker, folder=DS_EXTERNAL, errors='ignore')
-        if historical is None:
-            historical, meta = ts.get_daily_adjusted(symbol=ticker,outputsize='full')
-            historical.rename(columns={'1. open':OPEN_PRICE, '2. high':DAY_HIGH,
-                                       '3. low':DAY_LOW, '4. close':DAY_CLOSE,
-                                       '5. adjusted close':ADJ_CLOSE, '6. volume':DAY_VOLUME,
-                                       '7. dividend amount':DIVIDEND_AMT, '8. split coefficient':SPLIT_COEFFICIENT}
-                              ,inplace=True)
-            write_data(historical,ticker,folder=DS_EXTERNAL)
-            ret_val=historical
-        else:
-            # If we have old data, then we'll go back to the source and get new data
-
-            if relativedelta(pd.to_datetime(historical.index[-1]), TODAY).days > 0:
-                last_100, meta = ts.get_daily_adjusted(symbol=ticker,outputsize='compact')
-                last_100.rename(columns={'1. open': OPEN_PRICE, '2. high': DAY_HIGH,
-                                           '3. low': DAY_LOW, '4. close': DAY_CLOSE,
-                                           '5. adjusted close': ADJ_CLOSE, '6. volume': DAY_VOLUME,
-                                           '7. dividend amount': DIVIDEND_AMT, '8. split coefficient': SPLIT_COEFFICIENT}
-                                  , inplace=True)
-                ret_val = historical.append(last_100)
-                ret_val.drop_duplicates(inplace=True)
-                write_data(ret_val,ticker,folder=DS_EXTERNAL)
-            else:
-                ret_val = historical
+        ret_val = cache.get_bars(ticker)
     else:
-        last_100, meta = ts.get_daily_adjusted(symbol=ticker,outputsize='compact')
-        ret_val = last_100
-    return ret_val, meta
+        ret_val = cache.fetcher(ticker, last=COMPACT_DAYS)
+    return ret_val, None
 
 
 class ColumnNames(Enum):
@@ -119,6 +117,68 @@ class ColumnNames(Enum):
         return f'{period}{period_type} {self.value}'
 
 
+class _RollingWindow:
+    """
+    Running sums over the last <window> values.  The sums are taken relative to the first value seen so the
+    variance doesn't lose precision when the values are large compared to their spread.  As with pandas
+    rolling(window), the result is NaN until there are <window> values and while there is a NaN in the window.
+    The sums are recalculated from the window (and re-centred on it) once every <window> values so that rounding
+    errors from adding and removing values don't build up over a long stream
+    """
+
+    def __init__(self, window, values=()):
+        self.window = window
+        self.values = deque()
+        self.shift = None
+        self.sum = 0.
+        self.sumsq = 0.
+        self.nans = 0
+        self._since_refresh = 0
+        for x in values:
+            self.push(x)
+
+    def _add(self, x, sign):
+        if math.isfinite(x):
+            d = x - self.shift
+            self.sum += sign * d
+            self.sumsq += sign * d * d
+        else:
+            self.nans += sign
+
+    def push(self, x):
+        x = float(x)
+        if self.shift is None and math.isfinite(x):
+            self.shift = x
+        self._add(x, 1)
+        self.values.append(x)
+        if len(self.values) > self.window:
+            self._add(self.values.popleft(), -1)
+        self._since_refresh += 1
+        if self._since_refresh >= self.window:
+            self._refresh()
+
+    def _refresh(self):
+        # re-centre on the window too, the values may have moved a long way from the first one seen
+        finite = [x for x in self.values if math.isfinite(x)]
+        self.shift = finite[0] if finite else None
+        self.sum, self.sumsq, self.nans = 0., 0., 0
+        for x in self.values:
+            self._add(x, 1)
+        self._since_refresh = 0
+
+    def _full(self):
+        return len(self.values) == self.window and self.nans == 0
+
+    def mean(self):
+        return self.shift + self.sum / self.window if self._full() else np.nan
+
+    def std(self):
+        if not self._full() or self.window < 2:
+            return np.nan
+        variance = (self.sumsq - self.sum ** 2 / self.window) / (self.window - 1)
+        return math.sqrt(max(variance, 0.))
+
+
 class StockChart:
 
     # Should look a lot like a DataGrid indexed on Date
@@ -131,47 +191,127 @@ class StockChart:
     DESC = 1
 
     def __init__(self, ticker):
+        # The calculated indicators {(name, params, data version): series}, see Indicator
+        self._indicators = {}
+        self._data_version = 0
+        # Bars added by AppendBars that haven't been concatenated onto the data yet, see _compact
+        self._pending = []
+        self._pending_rows = 0
         self.data = None
         self.ticker = ticker
         self._sort_order = None
+        # The materialized rolling indicators {column: (kind, source column, window, scale)} and their running state
+        self._rolling = {}
+        self._rolling_state = None
+        self._forward_adjusted = False
+
+    @property
+    def data(self):
+        if self._pending:
+            self._compact()
+        return self._data
+
+    @data.setter
+    def data(self, df):
+        self._data = df
+        self._pending = []
+        self._pending_rows = 0
+        self.Invalidate()
+
+    def _compact(self):
+        """
+        Concatenate the bars waiting in the append buffer onto the data in one copy
+        """
+        self._data = pd.concat([self._data] + self._pending)
+        self._pending = []
+        self._pending_rows = 0
+
+    def Invalidate(self):
+        """
+        Mark the data as changed so that the indicators are calculated again the next time they are asked for.
+        This happens whenever the data is replaced, call it after changing the bars in place.
+        :return: None
+        """
+        self._data_version += 1
+        self._indicators.clear()
 
     @property
     def sort_order(self):
         if self._sort_order is None:
-            self._sort_order = SortOrder.ASC if df.index[1] < df.index[-1] else SortOrder.DESC
+            df = self.data
+            self._sort_order = SortOrder.ASC if df.index[0] < df.index[-1] else SortOrder.DESC
         return self._sort_order
 
     def sort(self, direction=SortOrder.DESC):
         self.data.sort_index(ascending=(direction == SortOrder.ASC),inplace=True)
+        self._sort_order = direction
+        self.Invalidate()
 
     def _column_exists(self,col_name):
-        return self.data.columns.contains(col_name)
+        return col_name in self._data.columns
+
+    def Indicator(self, name, **params):
+        """
+        Get an indicator from the registry in src.indicators.  The indicator (and each indicator it depends on) is
+        calculated the first time it is asked for and then cached by its name, parameters and the version of the
+        data, so asking for many indicators that share intermediates calculates each of them only once.
+
+        Example:
+        vol_90 = chart.Indicator('annualized_volatility', window=90)
+        :param name: the name the indicator was registered with
+        :param params: the parameters of the indicator, any that aren't given take their default values
+        :return: a series aligned with the data
+        """
+        return calculate_indicator(name, params, self.data.__getitem__, self._indicators, self._data_version,
+                                   self.sort_order.previous_day())
 
     @classmethod
-    def LoadFromTicker(cls, ticker: string):
+    def LoadFromTicker(cls, ticker: string, cache=None):
         """
         Given a particular ticker symbol, download historical data starting from today going backward
         :param ticker:
-        :param startDate:
-        :param endDate:
+        :param cache: the BarCache to load from, if None the shared AlphaVantage cache is used
         :return: A pandas dataframe with an index col of date
         """
         chart = cls(ticker)
-        chart.data, meta = _getHistoricalTicker(ticker, full=True)
+        chart.data, meta = _getHistoricalTicker(ticker, full=True, cache=cache)
         return chart
 
     @classmethod
     def LoadFromFile(cls, ticker, errors='raise', folder=DS_PROCESSED, sort_order=SortOrder.ASC, **kwargs):
         """
         :param folder:
-        :param kwargs:
+        :param kwargs: passed to read_latest, e.g. file_format='parquet'
         :return:
         """
         chart = cls(ticker)
-        chart.data = read_latest(ticker, folder=folder, errors=errors)
+        chart.data = read_latest(ticker, folder=folder, errors=errors, **kwargs)
         chart.sort(sort_order)
         return chart
 
+    @classmethod
+    def LoadFromBarStore(cls, ticker, store=None, columns=None):
+        """
+        Open the chart from a BarStore.  The columns are zero-copy views of memory mapped files so the load time
+        doesn't depend on the length of the history
+        :param ticker:
+        :param store: the BarStore to read from, if None the default store in DS_PROCESSED is used
+        :param columns: the columns to load, None for all of them
+        :return: the StockChart
+        """
+        store = store if store is not None else BarStore()
+        chart = cls(ticker)
+        chart.data = store.read(ticker, columns=columns)
+        return chart
+
+    def SaveToBarStore(self, store=None):
+        """
+        Write the bar columns out to a BarStore (the calculated columns aren't saved)
+        :return: None
+        """
+        store = store if store is not None else BarStore()
+        store.write(self.ticker, self.data)
+
     def Save(self, with_timestamp=True, folder=DS_PROCESSED, **kwargs):
         """
         Write the data we have out to disk
@@ -186,10 +326,11 @@ class StockChart:
         :param update: If True then update the dataframe with the data, else just return the value
         :return: a series with calculated moving average
         """
-        new_col = self.data[DAY_CLOSE].rolling(days).mean()
+        new_col = self.Indicator('moving_avg', days=days)
         if update:
             col_name = ColumnNames.MOVING_AVG.make_column_name(days)
             self.data[col_name] = new_col
+            self._rolling[col_name] = ('mean', DAY_CLOSE, days, 1.)
         return new_col
 
     def CalculateTotalReturnPrice(self, forward_adjusted=False):
@@ -210,14 +351,9 @@ class StockChart:
         :param forward_adjusted: If true, then the forward adjusted approach will be used
         :return: None.  The chart will be updated with a column that has the daily price data
         """
-        if not self._column_exists(ColumnNames.TOTAL_PRICE_RETURN):
-            prev_day = self.sort_order.previous_day()
-            if forward_adjusted:
-                self.data[ColumnNames.TOTAL_PRICE_RETURN] = \
-                    df[DAY_CLOSE]*df[SPLIT_COEFFICIENT]*(1+df[DIVIDEND_AMT]/df[DAY_CLOSE].shift(prev_day))
-            else:
-                self.data[ColumnNames.TOTAL_PRICE_RETURN] = \
-                    df[DAY_CLOSE] * df[SPLIT_COEFFICIENT] * (1 - df[DIVIDEND_AMT] / df[DAY_CLOSE].shift(prev_day))
+        self._forward_adjusted = forward_adjusted
+        self.data[ColumnNames.TOTAL_PRICE_RETURN] = self.Indicator('total_price_return',
+                                                                   forward_adjusted=forward_adjusted)
         return None
 
     def Calculate30DayAnnualizedVolatility(self):
@@ -226,22 +362,108 @@ class StockChart:
         :return:
         """
         #The standard deviation of of a rolling 30 day percent_change * sqrt (252)
-        if self._column_exists(ColumnNames.ANNUAL_VOL):
-            return
         self.CalculatePercentDailyChange()
-        df = self.data
-        # Square root of trading days
-        srt = math.sqrt(ANN_TRADE_DAYS)
-        df[ColumnNames.ANNUAL_VOL] =  df[ColumnNames.TOTAL_PRICE_RETURN].rolling(30).std(min_periods=30) * srt
+        self.data[ColumnNames.ANNUAL_VOL] = self.Indicator('annualized_volatility', window=30,
+                                                           forward_adjusted=self._forward_adjusted)
+        self._rolling[ColumnNames.ANNUAL_VOL] = ('std', ColumnNames.PCT_DAY_CHANGE, 30, math.sqrt(ANN_TRADE_DAYS))
 
     def CalculatePercentDailyChange(self):
-        # If the Total Price Return hasn't been calculated, do that first
+        # The Total Price Return column is kept alongside so that AppendBars can extend both
+        self.CalculateTotalReturnPrice(self._forward_adjusted)
+        self.data[ColumnNames.PCT_DAY_CHANGE] = self.Indicator('pct_daily_change',
+                                                               forward_adjusted=self._forward_adjusted)
+
+    @classmethod
+    def CalculateInChunks(cls, ticker, chunks, moving_avg_days=(), volatility=False):
+        """
+        Calculate indicators over a stream of chunks (e.g. from read_latest(..., chunksize=n)) with memory
+        proportional to the chunk size.  The last few rows of each chunk are carried over so the rolling windows
+        are the same as if the whole history had been loaded.  The chunks need to be in ascending date order.
+        :param ticker:
+        :param chunks: an iterable of dataframes
+        :param moving_avg_days: the moving averages to calculate, e.g. [30, 90]
+        :param volatility: if True calculate the 30 day annualized volatility (and the columns it depends on)
+        :return: a generator of the chunks with the indicator columns added
+        """
+        carry = max(list(moving_avg_days) + [31 if volatility else 0])
+        tail = None
+        for chunk in chunks:
+            columns = list(chunk.columns)
+            chart = cls(ticker)
+            chart.data = chunk if tail is None else pd.concat([tail, chunk])
+            chart._sort_order = SortOrder.ASC
+            for days in moving_avg_days:
+                chart.CalculateMovingAvg(days)
+            if volatility:
+                chart.Calculate30DayAnnualizedVolatility()
+            yield chart.data.iloc[len(chart.data) - len(chunk):]
+            tail = chart.data[columns].iloc[-carry:] if carry > 0 else None
+
+    def _rolling_windows(self):
+        """
+        The running window state for each materialized rolling indicator, built from the tail of the data the
+        first time it is needed (or if the data has been changed since)
+        """
+        state = self._rolling_state
+        if state is None or state[0] != self._data_version or set(state[1]) != set(self._rolling):
+            windows = {col: _RollingWindow(window, self.data[source].iloc[-window:])
+                       for col, (kind, source, window, scale) in self._rolling.items()}
+            state = (self._data_version, windows)
+        return state[1]
+
+    def AppendBars(self, bars):
+        """
+        Add new bars to the end of the chart and extend every indicator column that has been calculated.
+        The indicators are updated from running state (the last values and their sums in each rolling window)
+        so the cost depends only on the number of new bars, not on the length of the history.  The new bars are
+        buffered and only concatenated onto the data in batches (or when the data is next read), so a stream of
+        single bar appends doesn't copy the whole history each time.
+        The chart needs to be in ascending date order.
+        :param bars: a dataframe of new bars, columns of the data that the bars don't have (and that aren't
+            indicators AppendBars can extend) are NaN, a missing split coefficient is 1 and a missing dividend is 0.
+            Rows that aren't after the last date in the chart are ignored.  The dates of both the chart and the bars
+            are converted to a DatetimeIndex (e.g. the str dates of a chart read from a csv)
+        :return: the number of bars that were added
+        """
+        assert self.sort_order == SortOrder.ASC, 'Bars can only be appended to a chart in ascending date order'
+        if not isinstance(self._data.index, pd.DatetimeIndex):
+            self._data.index = pd.to_datetime(self._data.index)
+        last = self._pending[-1].iloc[-1] if self._pending else self._data.iloc[-1]
+        new = bars.copy()
+        new.index = pd.to_datetime(new.index)
+        new = new.sort_index()
+        new = new[new.index > last.name].reindex(columns=self._data.columns)
+        if len(new) == 0:
+            return 0
+        windows = self._rolling_windows()
+        tpr = ColumnNames.TOTAL_PRICE_RETURN
+        for col, default in ((SPLIT_COEFFICIENT, 1.), (DIVIDEND_AMT, 0.)):
+            if col in new.columns and col not in bars.columns:
+                new[col] = default
+        if self._column_exists(tpr):
+            split = new[SPLIT_COEFFICIENT] if SPLIT_COEFFICIENT in new.columns else 1.
+            dividend = new[DIVIDEND_AMT] if DIVIDEND_AMT in new.columns else 0.
+            prev_close = np.concatenate([[last[DAY_CLOSE]], new[DAY_CLOSE].values[:-1]])
+            sign = 1 if self._forward_adjusted else -1
+            new[tpr] = new[DAY_CLOSE] * split * (1 + sign * dividend / prev_close)
         if self._column_exists(ColumnNames.PCT_DAY_CHANGE):
-            return
-        self.CalculateTotalReturnPrice()
-        prev_day = self.sort_order.previous_day()
-        df = self.data
-        df[ColumnNames.PCT_DAY_CHANGE] = df[ColumnNames.TOTAL_PRICE_RETURN].pct_change(prev_day)
+            prev_tpr = np.concatenate([[last[tpr]], new[tpr].values[:-1]])
+            new[ColumnNames.PCT_DAY_CHANGE] = new[tpr] / prev_tpr - 1
+        for col, (kind, source, window, scale) in self._rolling.items():
+            rolling = windows[col]
+            values = []
+            for x in new[source].values:
+                rolling.push(x)
+                values.append((rolling.mean() if kind == 'mean' else rolling.std()) * scale)
+            new[col] = values
+        self._pending.append(new)
+        self._pending_rows += len(new)
+        # compacting once the buffer is as long as the history keeps the copying to a constant per bar
+        if self._pending_rows >= max(APPEND_BATCH, len(self._data)):
+            self._compact()
+        self.Invalidate()
+        self._rolling_state = (self._data_version, windows)
+        return len(new)
 
     def LastDays(self,days, trading_days=True):
         """
@@ -251,7 +473,7 @@ class StockChart:
         :return: a pandas dataframe with only the number of days specified going back from today
         """
         offset = pd.offsets.BDay(days) if trading_days else pd.Timedelta(day=-days)
-        return self.data[_today-offset:]
+        return self.data[_today()-offset:]
 
     def LastWeeks(self, weeks):
         """
@@ -259,7 +481,245 @@ class StockChart:
         :param weeks: the number of weeks to go back from today
         :return: a pandas dataframe with only the number of weeks specified, starting from today and going backward
         """
-        return self.data[_today-pd.DateOffset(weeks=weeks):]
+        return self.data[_today()-pd.DateOffset(weeks=weeks):]
+
+
+class StockPanel:
+    """
+    Many tickers held as aligned 2-D arrays (dates x tickers), one array per field, so that an indicator is
+    calculated for the whole universe in one vectorized operation rather than one StockChart at a time.
+    The dates are the union of the tickers' dates in ascending order and mask[i, j] is True when ticker j has a
+    bar on date i.  The indicators are calculated over each ticker's own bars (so a missing bar doesn't break a
+    rolling window and the day after a gap is compared to the last bar before it, just as in StockChart) and are
+    NaN wherever the ticker has no bar.
+    The calculated fields are named the same way as the StockChart columns, see ColumnNames.
+    """
+
+    def __init__(self, dates, tickers, fields, mask=None):
+        """
+        :param dates: the dates, in ascending order
+        :param tickers: the ticker symbols
+        :param fields: {field: array} where each array has a row for each date and a column for each ticker
+        :param mask: boolean array that is True where the ticker has a bar, defaults to where the close is known
+        """
+        self.dates = pd.DatetimeIndex(dates)
+        self.tickers = list(tickers)
+        self.fields = {name: np.asarray(values, dtype=float) for name, values in fields.items()}
+        if mask is None:
+            mask = np.isfinite(self.fields[DAY_CLOSE]) if DAY_CLOSE in self.fields else np.ones(self.shape, bool)
+        self.mask = np.asarray(mask, dtype=bool)
+        # The order that moves each ticker's bars to the top of its column, see _compact
+        self._order = np.argsort(~self.mask, axis=0, kind='stable')
+        self._gaps = not self.mask.all()
+        self._indicators = {}
+        self._version = 0
+
+    @property
+    def shape(self):
+        return len(self.dates), len(self.tickers)
+
+    @classmethod
+    def FromFrames(cls, frames, fields=None):
+        """
+        :param frames: {ticker: dataframe indexed on date}
+        :param fields: the columns to keep, defaults to the numeric columns that are in every frame
+        :return: a StockPanel
+        """
+        frames = {ticker: df[~df.index.duplicated(keep='last')] for ticker, df in frames.items()}
+        if not frames:
+            return cls([], [], {field: np.empty((0, 0)) for field in (fields or [])})
+        if fields is None:
+            fields = [c for c in next(iter(frames.values())).select_dtypes('number').columns
+                      if all(c in df.columns for df in frames.values())]
+        dates = pd.DatetimeIndex(np.unique(np.concatenate([pd.to_datetime(df.index).values
+                                                            for df in frames.values()])))
+        mask = np.zeros((len(dates), len(frames)), dtype=bool)
+        arrays = {field: np.full(mask.shape, np.nan) for field in fields}
+        for j, df in enumerate(frames.values()):
+            rows = dates.get_indexer(pd.to_datetime(df.index))
+            mask[rows, j] = True
+            for field in fields:
+                arrays[field][rows, j] = df[field].to_numpy(dtype=float)
+        return cls(dates, frames.keys(), arrays, mask)
+
+    @classmethod
+    def FromCharts(cls, charts, fields=None):
+        """
+        :param charts: {ticker: StockChart} (e.g. from load_tickers) or a list of StockCharts
+        """
+        if not isinstance(charts, dict):
+            charts = {chart.ticker: chart for chart in charts}
+        return cls.FromFrames({ticker: chart.data for ticker, chart in charts.items()}, fields)
+
+    @classmethod
+    def LoadFromBarStore(cls, tickers, store=None, columns=None):
+        """
+        :param tickers: the tickers to load, None for every ticker in the store
+        :param store: the BarStore to read from, if None the default store in DS_PROCESSED is used
+        :param columns: the columns to load, None for all of them
+        """
+        store = store if store is not None else BarStore()
+        tickers = store.tickers() if tickers is None else tickers
+        return cls.FromFrames({ticker: store.read(ticker, columns=columns) for ticker in tickers})
+
+    def __getitem__(self, field):
+        """
+        :return: a dataframe (dates x tickers) of the field
+        """
+        return pd.DataFrame(self.fields[field], index=self.dates, columns=self.tickers)
+
+    def Chart(self, ticker):
+        """
+        :return: a StockChart with the ticker's bars and every field in the panel
+        """
+        j = self.tickers.index(ticker)
+        rows = self.mask[:, j]
+        chart = StockChart(ticker)
+        chart.data = pd.DataFrame({field: values[rows, j] for field, values in self.fields.items()},
+                                  index=pd.DatetimeIndex(self.dates[rows], name='date'))
+        return chart
+
+    def Invalidate(self):
+        """
+        Call after changing the bars in self.fields in place so the indicators are calculated again
+        :return: None
+        """
+        self._version += 1
+        self._indicators.clear()
+
+    def _compact(self, values):
+        """
+        Move each ticker's bars to the top of its column so that row i is the ticker's i-th bar
+        """
+        if not self._gaps:
+            return values
+        compact = np.take_along_axis(values, self._order, axis=0)
+        compact[np.arange(len(self.dates))[:, None] >= self.mask.sum(axis=0)] = np.nan
+        return compact
+
+    def _expand(self, compact):
+        """
+        The reverse of _compact, each value goes back to the date of its bar
+        """
+        if not self._gaps:
+            return compact
+        values = np.full(self.shape, np.nan)
+        np.put_along_axis(values, self._order, compact, axis=0)
+        values[~self.mask] = np.nan
+        return values
+
+    def Indicator(self, name, **params):
+        """
+        Calculate an indicator from the registry in src.indicators for every ticker at once, see
+        StockChart.Indicator.  The indicators it depends on are cached so they are only calculated once.
+        :return: a dataframe (dates x tickers)
+        """
+        column = lambda field: pd.DataFrame(self._compact(self.fields[field]))
+        compact = calculate_indicator(name, params, column, self._indicators, self._version)
+        return pd.DataFrame(self._expand(np.asarray(compact, dtype=float)), index=self.dates, columns=self.tickers)
+
+    def _materialize(self, field, name, **params):
+        self.fields[field] = self.Indicator(name, **params).to_numpy()
+        return self.fields[field]
+
+    def CalculateMovingAvg(self, days):
+        """
+        :param days: the number of bars in the moving average of the close
+        :return: the array of moving averages, also kept in the field ColumnNames.MOVING_AVG.make_column_name(days)
+        """
+        return self._materialize(ColumnNames.MOVING_AVG.make_column_name(days), 'moving_avg', days=days)
+
+    def CalculateTotalReturnPrice(self, forward_adjusted=False):
+        """
+        See StockChart.CalculateTotalReturnPrice
+        :return: the array of total return prices, also kept in the field ColumnNames.TOTAL_PRICE_RETURN
+        """
+        return self._materialize(ColumnNames.TOTAL_PRICE_RETURN, 'total_price_return',
+                                 forward_adjusted=forward_adjusted)
+
+    def CalculatePercentDailyChange(self, forward_adjusted=False):
+        """
+        :return: the array of daily changes in the total return price, also kept in ColumnNames.PCT_DAY_CHANGE
+        """
+        self.CalculateTotalReturnPrice(forward_adjusted)
+        return self._materialize(ColumnNames.PCT_DAY_CHANGE, 'pct_daily_change', forward_adjusted=forward_adjusted)
+
+    def CalculateAnnualizedVolatility(self, window=30, forward_adjusted=False):
+        """
+        The standard deviation of the rolling <window> day percent change * sqrt(252)
+        :return: the array of volatilities, also kept in the field ColumnNames.ANNUAL_VOL (for the 30 day window,
+            as in StockChart) or ColumnNames.ANNUAL_VOL.make_column_name(window)
+        """
+        self.CalculatePercentDailyChange(forward_adjusted)
+        field = ColumnNames.ANNUAL_VOL if window == 30 else ColumnNames.ANNUAL_VOL.make_column_name(window)
+        return self._materialize(field, 'annualized_volatility', window=window, forward_adjusted=forward_adjusted)
+
+
+def _quota_wait(cache):
+    """
+    :return: the number of seconds for the fetcher's rate limiter to refill, when the vendor says the quota is used
+        up there is no point retrying any sooner
+    """
+    limiter = getattr(getattr(cache, 'fetcher', None), 'rate_limiter', None)
+    if limiter is None:
+        return 60 / ALPHA_VANTAGE_CALLS_PER_MINUTE
+    return limiter.capacity / limiter.rate
+
+
+def _load_with_retry(ticker, cache, retries, backoff):
+    """
+    Load a single chart, retrying with exponential backoff (and jitter) when the load fails.  When the source says
+    the quota is used up the retry waits at least until the rate limiter has refilled, any other error from the
+    source (e.g. an invalid symbol) isn't retried
+    """
+    attempt = 0
+    while True:
+        try:
+            return StockChart.LoadFromTicker(ticker, cache=cache)
+        except Exception as e:
+            attempt += 1
+            if attempt > retries or (isinstance(e, FetchError) and not e.rate_limited):
+                raise
+            delay = backoff * 2 ** (attempt - 1) * (1 + random.random())
+            if isinstance(e, FetchError):
+                delay = max(delay, _quota_wait(cache) * (1 + random.random() / 10))
+            logging.getLogger(__name__).debug(f'{ticker} failed ({e}), retrying in {delay:.1f}s')
+            time.sleep(delay)
+
+
+def load_tickers(tickers, cache=None, max_workers=8, retries=3, backoff=1., as_panel=False):
+    """
+    Load (or refresh) many tickers concurrently.  Loads go through the BarCache so only the missing days are
+    fetched and the fetcher's rate limiter keeps the requests within the vendor quota.  A ticker that still fails
+    after the retries doesn't stop the others from loading.
+
+    Example:
+    charts, failures = load_tickers(pd.read_csv(DS_EXTERNAL / 'SP500-Symbols.csv')['Symbol'])
+    :param tickers: list of ticker symbols
+    :param cache: the BarCache to load from, if None the shared AlphaVantage cache is used
+    :param max_workers: the number of tickers to load at the same time
+    :param retries: the number of times to retry a ticker that fails
+    :param backoff: the delay, in seconds, before the first retry, the delay doubles for each retry after that
+    :param as_panel: if True then return the charts that loaded as a StockPanel
+    :return: a tuple of ({ticker: StockChart}, {ticker: exception}) for the tickers that loaded and those that failed
+    """
+    logger = logging.getLogger(__name__)
+    if cache is None:
+        cache = _default_cache()
+    tickers = list(dict.fromkeys(tickers))
+    charts, failures = {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {ticker: pool.submit(_load_with_retry, ticker, cache, retries, backoff) for ticker in tickers}
+        for ticker, future in futures.items():
+            try:
+                charts[ticker] = future.result()
+            except Exception as e:
+                logger.warning(f'Unable to load {ticker}: {e}')
+                failures[ticker] = e
+    logger.info(f'loaded {len(charts)} of {len(tickers)} tickers')
+    if as_panel:
+        return StockPanel.FromCharts(charts), failures
+    return charts, failures
 
 
 if __name__ == "__main__":
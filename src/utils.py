@@ -1,4 +1,12 @@
+import hashlib
+import json
 import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 from IPython.core.display import display
 from joblib import dump, load
@@ -7,10 +15,26 @@ import datetime as dt
 
 from src.constants import *
 
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
 TODAY = dt.datetime.today()
 NOW = dt.datetime.now()
 _DEBUG = False
 
+# The formats supported by write_data/read_latest and their file extensions.
+# parquet and feather are typed, compressed and column oriented (they need pyarrow installed)
+STORAGE_FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
+# Each data/model folder has a manifest of the datasets written to it, see update_manifest
+MANIFEST_FILE = '_manifest.json'
+_manifest_cache = {}
+_manifest_lock = threading.Lock()
+
 
 def start_logging(debug_to_console=False, log_filename=DEFAULT_LOGFILE):
     logging.basicConfig(level=logging.DEBUG,
@@ -53,6 +77,7 @@ def write_excel(data, filename, data_path=DATA_PATH, data_version=False, folder=
             if type(df) is not pd.DataFrame:
                 continue
             df.to_excel(writer, sheet_name=f'{datasource}{data_version}', **kwargs)
+    update_manifest(fn, filename)
     logger.info(f"finished writing df to file... {filename}")
     return filename
 
@@ -78,7 +103,7 @@ def make_ts_filename(dir_name, src_name, suffix, with_ts=True):
 # TODO: Work out Enums for datasource and data state
 #  So an example would be a file that is cleaned and combines two sources would have an output name
 #   of source1_source2_clean or src1_src2_features
-def write_data(df, datasource_name, data_path=DATA_PATH, folder=DS_INTERIM, with_ts=True, **kwargs):
+def write_data(df, datasource_name, data_path=DATA_PATH, folder=DS_INTERIM, with_ts=True, file_format='csv', **kwargs):
     """
     Export the dataset to a file
     :param data_path: if desired the root path for the data folder, if not specified this comes from constants.py
@@ -87,17 +112,30 @@ def write_data(df, datasource_name, data_path=DATA_PATH, folder=DS_INTERIM, with
     :param folder: the data sub-path (one of 'interim', 'processed', 'external'
     :param with_ts: if True, then append the year, month, day and hour to the filename to be written
                     else append the suffix 'latest' to the basename
+    :param file_format: one of 'csv', 'parquet' or 'feather'.  The binary formats keep the dtypes (including a
+                    date index) and full precision and are compressed with zstd unless a compression is passed
     :param idx: the name of the index or the column number
     :return: the name of the file written
     """
     NOW = dt.datetime.now()
     logger = logging.getLogger(__name__)
     logger.info(f"writing df to file... {datasource_name} {folder}")
-    fn = make_ts_filename(data_path / folder, src_name=datasource_name, suffix='.csv', with_ts=with_ts)
-
-    if 'float_format' not in kwargs.keys():
-        kwargs['float_format'] = '%.3f'
-    df.to_csv(fn, **kwargs)
+    assert file_format in STORAGE_FORMATS, f"Invalid file format '{file_format}'"
+    fn = make_ts_filename(data_path / folder, src_name=datasource_name, suffix=STORAGE_FORMATS[file_format],
+                          with_ts=with_ts)
+
+    if file_format == 'csv':
+        if 'float_format' not in kwargs.keys():
+            kwargs['float_format'] = '%.3f'
+        df.to_csv(fn, **kwargs)
+    elif file_format == 'parquet':
+        kwargs.setdefault('compression', 'zstd')
+        df.to_parquet(fn, **kwargs)
+    else:
+        # feather can't store an index so it is written as the first column
+        kwargs.setdefault('compression', 'zstd')
+        df.reset_index().to_feather(fn, **kwargs)
+    update_manifest(fn, datasource_name)
     logger.info(f"finished writing df to file... {fn}")
     return fn
 
@@ -125,40 +163,70 @@ def write_model(mdl, model_type, model_path=MODEL_PATH, with_ts=True, **kwargs):
     filename = (path_to_write / fn).with_suffix('.mdl')
     # TODO: determine which kwargs to support for calling this function of numpy_pickle
     dump(mdl, filename)
+    update_manifest(filename, model_type)
     logger.info(f"finished writing model to file... {filename}")
     return filename
 
 
-def read_latest_model(model_type, model_path=MODEL_PATH):
+def read_latest_model(model_type, model_path=MODEL_PATH, exact=False):
     """
     Find the most recently pickled model, unpickle it and return the result
     :param model_type: this is the filename prefix used when the model was saved
     :param model_path: if specified, the root of the MODEL directory else MODEL_PATH
+    :param exact: if True then only match the model_type exactly rather than as a prefix
     :return: an unpickled machine learning model
     """
     read_path = model_path
     logger = logging.getLogger(__name__)
     logger.info(f"reading model from file... {model_type} ")
-    fname = get_latest_file(file_path=read_path, filename_like=model_type, file_ext='.mdl')
+    fname = get_latest_file(file_path=read_path, filename_like=model_type, file_ext='.mdl', exact=exact)
     logging.debug(f"read from {fname}")
     return load(read_path / fname)
 
 
-def read_latest(datasource_name, data_path=DATA_PATH, folder=DS_INTERIM, errors='raise', **kwargs):
+def read_latest(datasource_name, data_path=DATA_PATH, folder=DS_INTERIM, errors='raise', file_format='csv',
+                columns=None, exact=False, chunksize=None, start=None, end=None, **kwargs):
     """
     Get the most recent version of the cleaned dataset
     :param data_path:
     :param datasource_name: name of the file to get the data from
     :param folder: the subpath to the data, likely interim or processed
     :param errors: if 'raise' then
+    :param file_format: one of 'csv', 'parquet' or 'feather'
+    :param columns: if specified only read these columns (the index is always read)
+    :param exact: if True then only match the datasource_name exactly rather than as a prefix
+    :param chunksize: if specified, return a generator of dataframes with at most this many rows (see iter_latest)
+    :param start: if specified, only return rows with a date index on or after start
+    :param end: if specified, only return rows with a date index on or before end
     :return:
     """
+    if chunksize is not None:
+        return iter_latest(datasource_name, data_path=data_path, folder=folder, chunksize=chunksize, columns=columns,
+                           start=start, end=end, file_format=file_format, exact=exact, **kwargs)
     read_path = data_path / folder
     try:
-        fname = get_latest_data_filename(datasource_name, folder)
+        assert file_format in STORAGE_FORMATS, f"Invalid file format '{file_format}'"
+        fname = get_latest_data_filename(datasource_name, folder, data_path=data_path,
+                                         file_ext=STORAGE_FORMATS[file_format], exact=exact)
         logging.info(f"read from {fname}")
-        ret_df = pd.read_csv(read_path / fname, index_col=0, infer_datetime_format=True, true_values=TRUE_VALUES,
-                       false_values=FALSE_VALUES, **kwargs)
+        if file_format == 'csv':
+            if columns is not None:
+                index_col = pd.read_csv(read_path / fname, nrows=0).columns[0]
+                keep = set(get_list(columns)) | {index_col}
+                kwargs['usecols'] = lambda c: c in keep
+            ret_df = pd.read_csv(read_path / fname, index_col=0, true_values=TRUE_VALUES,
+                                 false_values=FALSE_VALUES, **kwargs)
+        elif file_format == 'parquet':
+            ret_df = pd.read_parquet(read_path / fname, columns=get_list(columns), **kwargs)
+        else:
+            if columns is not None:
+                # the index is the first column, read it from the schema so the data isn't loaded
+                from pyarrow import ipc, memory_map
+                index_col = ipc.open_file(memory_map(str(read_path / fname))).schema.names[0]
+                columns = [index_col] + get_list(columns)
+            ret_df = pd.read_feather(read_path / fname, columns=columns, **kwargs)
+            ret_df = _feather_index(ret_df)
+        ret_df = _filter_dates(ret_df, start, end)
     except AssertionError:
         ret_df = None
         if errors != 'ignore':
@@ -167,6 +235,126 @@ def read_latest(datasource_name, data_path=DATA_PATH, folder=DS_INTERIM, errors=
         return ret_df
 
 
+def _feather_index(df):
+    """
+    Feather files are written with the index as the first column, put it back
+    """
+    df = df.set_index(df.columns[0])
+    if df.index.name == 'index':
+        df.index.name = None
+    return df
+
+
+def _filter_dates(df, start=None, end=None):
+    """
+    Keep the rows with a date index between start and end (inclusive), the index is converted to dates
+    """
+    if start is None and end is None:
+        return df
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.index))
+    keep = np.ones(len(df), dtype=bool)
+    if start is not None:
+        keep &= df.index >= pd.Timestamp(start)
+    if end is not None:
+        keep &= df.index <= pd.Timestamp(end)
+    return df[keep]
+
+
+def _iter_csv(path, chunksize, columns, start, end, **kwargs):
+    if columns is not None:
+        index_col = pd.read_csv(path, nrows=0).columns[0]
+        keep = set(get_list(columns)) | {index_col}
+        kwargs['usecols'] = lambda c: c in keep
+    ascending, last = True, None
+    with pd.read_csv(path, index_col=0, true_values=TRUE_VALUES, false_values=FALSE_VALUES,
+                     chunksize=chunksize, **kwargs) as reader:
+        for chunk in reader:
+            if start is not None or end is not None:
+                chunk.index = pd.DatetimeIndex(pd.to_datetime(chunk.index))
+                # once an ascending file is past the end date there is nothing more to read
+                ascending = ascending and chunk.index.is_monotonic_increasing and \
+                    (last is None or len(chunk) == 0 or chunk.index[0] >= last)
+                if ascending and end is not None and len(chunk) > 0 and chunk.index[0] > pd.Timestamp(end):
+                    return
+                last = chunk.index[-1] if len(chunk) > 0 else last
+            yield _filter_dates(chunk, start, end)
+
+
+def _iter_parquet(path, chunksize, columns, start, end):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    pf = pq.ParquetFile(path)
+    index_columns = [c for c in (pf.schema_arrow.pandas_metadata or {}).get('index_columns', []) if isinstance(c, str)]
+    row_groups = list(range(pf.num_row_groups))
+    if (start is not None or end is not None) and len(index_columns) == 1:
+        # skip the row groups whose date statistics are outside of the range
+        position = pf.schema_arrow.get_field_index(index_columns[0])
+        selected = []
+        for i in row_groups:
+            stats = pf.metadata.row_group(i).column(position).statistics
+            if stats is not None and stats.has_min_max and \
+                    ((start is not None and pd.Timestamp(stats.max) < pd.Timestamp(start)) or
+                     (end is not None and pd.Timestamp(stats.min) > pd.Timestamp(end))):
+                continue
+            selected.append(i)
+        row_groups = selected
+    if len(row_groups) == 0:
+        return
+    read_columns = None if columns is None else get_list(columns) + index_columns
+    for batch in pf.iter_batches(batch_size=chunksize, row_groups=row_groups, columns=read_columns):
+        chunk = pa.Table.from_batches([batch], schema=batch.schema.with_metadata(pf.schema_arrow.metadata))
+        yield _filter_dates(chunk.to_pandas(), start, end)
+
+
+def _iter_feather(path, chunksize, columns, start, end):
+    from pyarrow import feather, ipc, memory_map
+    if columns is not None:
+        columns = [ipc.open_file(memory_map(str(path))).schema.names[0]] + get_list(columns)
+    # the table is memory mapped so only the chunk being converted is held in memory
+    table = feather.read_table(str(path), columns=columns, memory_map=True)
+    for offset in range(0, table.num_rows, chunksize):
+        yield _filter_dates(_feather_index(table.slice(offset, chunksize).to_pandas()), start, end)
+
+
+def iter_latest(datasource_name, data_path=DATA_PATH, folder=DS_INTERIM, chunksize=100000, columns=None, start=None,
+                end=None, file_format='csv', exact=False, **kwargs):
+    """
+    Stream the most recent version of a dataset as a generator of dataframes, so a file that is larger than memory
+    can be processed with peak memory proportional to the chunksize.  Only the requested columns are parsed, and
+    rows outside of [start, end] are dropped as they are read: an ascending csv stops being read once it is past the
+    end date and parquet row groups that are entirely outside of the range are never read.
+    CSV values are parsed with the same TRUE_VALUES/FALSE_VALUES as read_latest.
+
+    Example:
+    for chunk in iter_latest('msft_intraday', folder=DS_RAW, columns=[DAY_CLOSE], start='2020-01-01'):
+        ...
+    :param datasource_name: name of the file to get the data from
+    :param data_path: the root path for the data folder
+    :param folder: the subpath to the data, likely interim or processed
+    :param chunksize: the maximum number of rows in each chunk
+    :param columns: if specified only read these columns (the index is always read)
+    :param start: if specified, only return rows with a date index on or after start
+    :param end: if specified, only return rows with a date index on or before end
+    :param file_format: one of 'csv', 'parquet' or 'feather'
+    :param exact: if True then only match the datasource_name exactly rather than as a prefix
+    :param kwargs: passed on to pandas.read_csv
+    :return: a generator of dataframes, chunks with no rows in the date range are skipped
+    """
+    assert file_format in STORAGE_FORMATS, f"Invalid file format '{file_format}'"
+    fname = get_latest_data_filename(datasource_name, folder, data_path=data_path,
+                                     file_ext=STORAGE_FORMATS[file_format], exact=exact)
+    path = data_path / folder / fname
+    logging.info(f"streaming from {fname}")
+    if file_format == 'csv':
+        chunks = _iter_csv(path, chunksize, columns, start, end, **kwargs)
+    elif file_format == 'parquet':
+        chunks = _iter_parquet(path, chunksize, columns, start, end)
+    else:
+        chunks = _iter_feather(path, chunksize, columns, start, end)
+    for chunk in chunks:
+        if len(chunk) > 0:
+            yield chunk
+
 
 def read_latest_from_worksheet(filename, data_path=DATA_PATH, datasource_name='all', folder=DS_INTERIM, **kwargs):
     """
@@ -193,7 +381,7 @@ def read_latest_from_worksheet(filename, data_path=DATA_PATH, datasource_name='a
     return ret_val
 
 
-def get_latest_data_filename(datasource_name, folder, data_path=DATA_PATH, file_ext='.csv'):
+def get_latest_data_filename(datasource_name, folder, data_path=DATA_PATH, file_ext='.csv', exact=False):
     """
     Determine the filename of the latest version of this file source
     :param data_path: if desired the root path for the data folder, if not specified this comes from constants.py
@@ -201,22 +389,111 @@ def get_latest_data_filename(datasource_name, folder, data_path=DATA_PATH, file_
     :param folder: the folder to look for the file represented by the `datasource_name`
     :param datasource_name: the basename of the datafile.  For instance if the datasource_name is foo then the filename
           representing the latest modified file with a name like 'foo*' will be returned
+    :param exact: if True then only match the datasource_name exactly rather than as a prefix
     :return: a string representing the file path
     """
-    return get_latest_file(data_path / folder, datasource_name, file_ext)
+    return get_latest_file(data_path / folder, datasource_name, file_ext, exact=exact)
+
+
+def _read_manifest(folder, use_cache=True):
+    """
+    Read the manifest for a folder, the parsed manifest is kept until the file changes
+    :param use_cache: False to always read the file
+    :return: a dictionary of {dataset name: {file extension: {'latest': filename, 'written': time, 'versions': []}}}
+    """
+    fn = folder / MANIFEST_FILE
+    try:
+        mtime = fn.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    cached = _manifest_cache.get(fn)
+    if use_cache and cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(fn) as f:
+        manifest = json.load(f)
+    _manifest_cache[fn] = (mtime, manifest)
+    return manifest
+
+
+@contextmanager
+def _file_lock(path):
+    """
+    Hold an exclusive OS level lock on <path> (created if needed) so that other processes wait for it too
+    """
+    with open(path, 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def update_manifest(filename, dataset_name):
+    """
+    Record that a new version of a dataset was written to the manifest in the file's folder.  The manifest is
+    written to a temporary file and then swapped in, so readers never see a partial manifest, and the update holds
+    a lock file so that writers in other threads and processes don't lose each other's entries
+    :param filename: the path to the file that was written
+    :param dataset_name: the name of the dataset (the filename without the timestamp/'latest' suffix)
+    :return: None
+    """
+    folder = filename.parent
+    with _manifest_lock, _file_lock(folder / f'{MANIFEST_FILE}.lock'):
+        manifest = json.loads(json.dumps(_read_manifest(folder, use_cache=False)))
+        entry = manifest.setdefault(dataset_name, {}).setdefault(filename.suffix, {'versions': []})
+        if filename.name in entry['versions']:
+            entry['versions'].remove(filename.name)
+        entry['versions'].append(filename.name)
+        entry['latest'] = filename.name
+        entry['written'] = time.time()
+        tmp_file = folder / f'{MANIFEST_FILE}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_file, folder / MANIFEST_FILE)
+        _manifest_cache[folder / MANIFEST_FILE] = ((folder / MANIFEST_FILE).stat().st_mtime_ns, manifest)
+
+
+def _is_version_of(stem, dataset_name):
+    """
+    :return: True if the filename stem is <dataset_name>_<timestamp> or <dataset_name>_latest
+    """
+    return re.fullmatch(rf'{re.escape(dataset_name)}_(latest|[\d_]+)', stem) is not None
 
 
-def get_latest_file(file_path, filename_like, file_ext):
+def get_latest_file(file_path, filename_like, file_ext, exact=False):
     """
-    Find absolute path to the file with the latest timestamp given the datasource name and file extension in the path
+    Find absolute path to the file with the latest timestamp given the datasource name and file extension in the path.
+    Datasets written with write_data/write_model/write_excel are looked up in the folder's manifest, anything else
+    falls back to scanning the folder.
     :param file_path: where to look for the file
     :param filename_like: the basename of the datafile.  For instance if the datasource_name is foo then the filename
           representing the latest modified file with a name like 'foo*' will be returned
     :param file_ext: the filename extension
+    :param exact: if True then only match a dataset called filename_like (so 'msft' won't match 'msft_options')
     :return: the absolute path to the file
     """
     file_ext = file_ext if '.' in file_ext else f'.{file_ext}'
-    all_files = [f for f in file_path.glob(f'{filename_like}*{file_ext}', )]
+    manifest = _read_manifest(file_path)
+    if exact:
+        entries = [manifest.get(filename_like, {}).get(file_ext)]
+    else:
+        entries = [versions.get(file_ext) for name, versions in manifest.items() if name.startswith(filename_like)]
+    entries = [e for e in entries if e is not None]
+    if len(entries) > 0:
+        fname = max(entries, key=lambda e: e['written'])['latest']
+        if (file_path / fname).exists():
+            return fname
+
+    all_files = [f for f in file_path.glob(f'{filename_like}*{file_ext}', )
+                 if not exact or _is_version_of(f.stem, filename_like)]
     assert len(all_files) > 0, f'Unable to find any files like {file_path / filename_like}{file_ext}'
     fname = max(all_files, key=lambda x: x.stat().st_mtime).name
     return fname
@@ -284,6 +561,18 @@ def _get_column_list(df, columns=None):
     return list(df.columns) if cols is None else list(set(df.columns).intersection(cols))
 
 
+def fingerprint(*values):
+    """
+    A hash of some values (arrays, numbers, strings, ...), e.g. to tell whether a cached result was calculated
+    from the same inputs.  Arrays are hashed by their bytes and anything else by its repr
+    :return: a hex digest
+    """
+    digest = hashlib.sha1()
+    for value in values:
+        digest.update(np.ascontiguousarray(value).tobytes() if isinstance(value, np.ndarray) else repr(value).encode())
+    return digest.hexdigest()
+
+
 if __name__ == "__main__":
     df = read_latest('msft',folder=DS_RAW)
     print(df.head())
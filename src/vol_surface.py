@@ -0,0 +1,219 @@
+import numpy as np
+from scipy.interpolate import CubicSpline
+from scipy.optimize import least_squares
+
+from src.constants import *
+from src.pricing_model import BlackSholesArray, ImpliedVolatility, _term_in_years
+from src.utils import write_model, read_latest_model, fingerprint
+
+# SVI needs at least as many quotes as it has parameters, expiries with fewer are fit with a spline
+SVI_PARAMETERS = 5
+SURFACE_METHODS = ['svi', 'spline']
+# The surfaces already fitted or loaded in this session {name: VolSurface}, see get_surface
+_surface_cache = {}
+
+
+def _svi(params, k):
+    """
+    The raw SVI total variance (Gatheral 2004): w(k) = a + b * (rho * (k - m) + sqrt((k - m)^2 + sigma^2))
+    """
+    a, b, rho, m, sigma = params
+    return a + b * (rho * (k - m) + np.sqrt((k - m) ** 2 + sigma ** 2))
+
+
+def _fit_svi(k, w):
+    """
+    :param k: the log moneyness of the quotes
+    :param w: the total implied variance (vol^2 * years) of the quotes
+    :return: the SVI parameters (a, b, rho, m, sigma)
+    """
+    guess = [max(w.min() * 0.9, 1e-8), 0.1, -0.3, k[np.argmin(w)], 0.1]
+    lower = [-w.max(), 0., -0.999, k.min() - 1, 1e-4]
+    upper = [w.max(), 10., 0.999, k.max() + 1, 5.]
+    result = least_squares(lambda p: _svi(p, k) - w, guess, bounds=(lower, upper), x_scale='jac')
+    return result.x
+
+
+class _Slice:
+    """
+    The smile for one expiry as total variance against log moneyness (log(strike / forward))
+    """
+
+    def __init__(self, k, w, method):
+        order = np.argsort(k)
+        k, w = k[order], w[order]
+        # average any duplicate strikes
+        k, index = np.unique(k, return_inverse=True)
+        w = np.bincount(index, weights=w) / np.bincount(index)
+        self.k_range = (k[0], k[-1])
+        self.method = method if len(k) >= SVI_PARAMETERS or method != 'svi' else 'spline'
+        if self.method == 'svi':
+            self.params = _fit_svi(k, w)
+        elif len(k) > 1:
+            self.spline = CubicSpline(k, w, bc_type='natural')
+        else:
+            self.flat = w[0]
+
+    def __call__(self, k):
+        if self.method == 'svi':
+            w = _svi(self.params, k)
+        elif hasattr(self, 'spline'):
+            # flat beyond the quoted strikes rather than following the end of the cubic
+            w = self.spline(np.clip(k, *self.k_range))
+        else:
+            w = np.full(np.shape(k), self.flat)
+        return np.maximum(w, 1e-12)
+
+
+class VolSurface:
+    """
+    An implied volatility surface.  Each expiry's smile is fit with SVI (or a natural cubic spline) in total
+    variance against log moneyness and the surface is interpolated linearly in total variance between expiries,
+    with the vol held flat before the first expiry and after the last.  Lookups are vectorized so the vols for
+    millions of (strike, term) pairs come back in one call and can be passed straight to BlackSholesArray.
+
+    Example:
+    surface = VolSurface.fit(chain['strike'], chain['days'], chain['iv'], spot=170., rate=0.017)
+    calls, puts = surface.price(strikes, terms)
+    """
+
+    def __init__(self, spot, rate, terms, slices, method, fingerprint=None):
+        self.spot = spot
+        self.rate = rate
+        # the expiries in years
+        self.terms = np.asarray(terms, dtype=float)
+        self.slices = slices
+        self.method = method
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def fit(cls, strikes, terms, volatilities, spot, rate=0., method='svi', termUnits='days'):
+        """
+        :param strikes: the strike of each quote
+        :param terms: the time to expiration of each quote
+        :param volatilities: the implied volatility of each quote, quotes that are NaN are ignored
+        :param spot: the price of the underlying
+        :param rate: the risk-free rate (0.017 == 1.7%)
+        :param method: one of SURFACE_METHODS
+        :param termUnits: 'days' if the terms are in calendar days, otherwise the terms are in years
+        :return: a VolSurface
+        """
+        if method not in SURFACE_METHODS:
+            raise ValueError(f"Unknown method '{method}' expected one of {SURFACE_METHODS}")
+        strikes, T, vols = np.broadcast_arrays(np.asarray(strikes, dtype=float), _term_in_years(terms, termUnits),
+                                               np.asarray(volatilities, dtype=float))
+        keep = np.isfinite(vols) & (vols > 0) & (T > 0)
+        strikes, T, vols = strikes[keep], T[keep], vols[keep]
+        fingerprint = _quotes_fingerprint(strikes, T, vols, spot, rate, method)
+        expiries = np.unique(T)
+        slices = []
+        for t in expiries:
+            quotes = T == t
+            k = np.log(strikes[quotes] / (spot * np.exp(rate * t)))
+            slices.append(_Slice(k, vols[quotes] ** 2 * t, method))
+        return cls(spot, rate, expiries, slices, method, fingerprint)
+
+    @classmethod
+    def from_prices(cls, optionPrices, strikes, terms, spot, rate=0., optionType='call', method='svi',
+                    termUnits='days'):
+        """
+        Fit the surface to option prices, backing out the implied volatilities with ImpliedVolatility.  Prices
+        that don't have an implied volatility (e.g. below intrinsic) are left out of the fit.
+        """
+        vols, converged = ImpliedVolatility(optionPrices, spot, strikes, rate, terms, termUnits=termUnits,
+                                            optionType=optionType)
+        return cls.fit(strikes, terms, np.where(converged, vols, np.nan), spot, rate, method, termUnits)
+
+    def total_variance(self, strike, term, termUnits='days'):
+        """
+        :return: the total implied variance (vol^2 * years) with the broadcast shape of strike and term
+        """
+        strike, T = np.broadcast_arrays(np.asarray(strike, dtype=float), _term_in_years(term, termUnits))
+        k = np.log(strike / (self.spot * np.exp(self.rate * T)))
+        terms = self.terms
+        # the expiries either side of each query, clamped to the ends of the surface
+        upper = np.clip(np.searchsorted(terms, T), 0, len(terms) - 1)
+        lower = np.clip(upper - 1, 0, len(terms) - 1)
+        lower = np.where(T >= terms[upper], upper, lower)
+        w_lower, w_upper = np.empty(T.shape), np.empty(T.shape)
+        for i, smile in enumerate(self.slices):
+            at_lower, at_upper = lower == i, upper == i
+            if at_lower.any():
+                w_lower[at_lower] = smile(k[at_lower])
+            if at_upper.any():
+                w_upper[at_upper] = smile(k[at_upper])
+        t_lower, t_upper = terms[lower], terms[upper]
+        with np.errstate(all='ignore'):
+            weight = np.where(t_upper > t_lower, (T - t_lower) / (t_upper - t_lower), 0.)
+        w = w_lower + weight * (w_upper - w_lower)
+        # hold the vol (not the variance) flat outside the quoted expiries
+        outside = (T < terms[0]) | (T > terms[-1])
+        w = np.where(outside, np.where(T < terms[0], w_upper / terms[0], w_lower / terms[-1]) * T, w)
+        return w
+
+    def __call__(self, strike, term, termUnits='days'):
+        """
+        :param strike: the strikes to look up
+        :param term: the times to expiration to look up
+        :return: an array of implied volatilities with the broadcast shape of strike and term
+        """
+        T = _term_in_years(term, termUnits)
+        with np.errstate(all='ignore'):
+            return np.sqrt(self.total_variance(strike, T, termUnits='years') / T)
+
+    def price(self, strike, term, currentPrice=None, termUnits='days'):
+        """
+        Price calls and puts with the volatility from the surface
+        :param currentPrice: the price of the underlying, defaults to the spot the surface was fit with
+        :return: a tuple of (callPrice, putPrice) arrays, see BlackSholesArray
+        """
+        spot = self.spot if currentPrice is None else currentPrice
+        return BlackSholesArray(spot, strike, self(strike, term, termUnits), self.rate, term, termUnits)
+
+    def save(self, name, model_path=MODEL_PATH):
+        """
+        Write the fitted surface with write_model so it can be reloaded without fitting it again
+        :return: the filename
+        """
+        _surface_cache[name] = self
+        return write_model(self, name, model_path=model_path)
+
+
+def _quotes_fingerprint(strikes, T, vols, spot, rate, method):
+    """
+    A hash of the quotes a surface is fit to, the numbers are coerced to floats first so that e.g. a numpy float64
+    spot hashes the same as a python float
+    """
+    return fingerprint(np.asarray(strikes, dtype=float), np.asarray(T, dtype=float), np.asarray(vols, dtype=float),
+                       float(spot), float(rate), method)
+
+
+def get_surface(name, strikes=None, terms=None, volatilities=None, spot=None, rate=0., method='svi',
+                termUnits='days', model_path=MODEL_PATH):
+    """
+    Get a fitted surface from this session, or from the latest saved model, fitting (and saving) it only if
+    there isn't one or the quotes have changed.
+    :param name: the name of the surface, e.g. 'msft_vol_surface'
+    :param strikes: the quotes to fit, see VolSurface.fit, if None then the saved surface is returned as is
+    :return: a VolSurface
+    """
+    fingerprint = None
+    if strikes is not None:
+        strikes, T, vols = np.broadcast_arrays(np.asarray(strikes, dtype=float), _term_in_years(terms, termUnits),
+                                               np.asarray(volatilities, dtype=float))
+        keep = np.isfinite(vols) & (vols > 0) & (T > 0)
+        fingerprint = _quotes_fingerprint(strikes[keep], T[keep], vols[keep], spot, rate, method)
+    surface = _surface_cache.get(name)
+    if surface is None:
+        try:
+            surface = read_latest_model(name, model_path=model_path, exact=True)
+            _surface_cache[name] = surface
+        except (FileNotFoundError, IndexError, AssertionError):
+            surface = None
+    if surface is not None and (fingerprint is None or surface.fingerprint == fingerprint):
+        return surface
+    if strikes is None:
+        raise FileNotFoundError(f'There is no saved surface {name} in {model_path}')
+    surface = VolSurface.fit(strikes, T, vols, spot, rate, method, termUnits='years')
+    surface.save(name, model_path=model_path)
+    return surface
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src import rolling
+from src.backtest import total_returns, run_backtest, crossover_signals, sweep_crossovers, total_return_index
+from src.constants import DAY_CLOSE, DIVIDEND_AMT, SPLIT_COEFFICIENT
+from src.stocks import StockChart, StockPanel
+
+
+def _bars(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.cumprod(1 + rng.normal(0.0005, 0.015, n))
+    return pd.DataFrame({DAY_CLOSE: close, DIVIDEND_AMT: 0., SPLIT_COEFFICIENT: 1.},
+                        index=pd.bdate_range('2019-01-01', periods=n))
+
+
+class TestBacktest:
+
+    def test_total_returns_adjust_for_splits_and_dividends(self):
+        close = np.array([[100.], [50.], [51.]])
+        returns = total_returns(close, dividends=[[0.], [0.], [1.]], splits=[[1.], [2.], [1.]])
+        assert np.allclose(returns[:, 0], [0., 0., 0.04])
+
+    def test_matches_a_loop(self):
+        bars = _bars()
+        chart = StockChart('MSFT')
+        chart.data = bars
+        signal = (chart.CalculateMovingAvg(10, update=False) > chart.CalculateMovingAvg(30, update=False)) * 1.
+        result = run_backtest(chart, signal, cost=0.001, slippage=0.0005)
+        close = bars[DAY_CLOSE].values
+        held, expected = 0., []
+        for t in range(len(bars)):
+            target = signal.iloc[t - 1] if t > 0 else 0.
+            r = close[t] / close[t - 1] - 1 if t > 0 else 0.
+            expected.append(target * r - abs(target - held) * 0.0015)
+            held = target
+        assert np.allclose(result.returns[:, 0], expected)
+        stats = result.statistics()
+        assert stats.index.tolist() == ['MSFT']
+        assert np.isclose(stats['total_return'].iloc[0], np.prod(1 + np.array(expected)) - 1)
+
+    def test_parameter_grid(self):
+        panel = StockPanel.FromFrames({'A': _bars(seed=1), 'B': _bars(seed=2)})
+        signals = crossover_signals(total_return_index(panel), [5, 10, 20], [50, 50, 60])
+        assert signals.shape == (3, 300, 2)
+        stats = run_backtest(panel, signals, cost=0.0005).statistics()
+        assert stats['sharpe'].shape == (3, 2)
+        free = run_backtest(panel, signals).statistics()
+        assert (free['total_return'] >= stats['total_return']).all()
+
+    @pytest.mark.parametrize('gaps', [False, True])
+    @pytest.mark.parametrize('jit', [False, True] if rolling.HAVE_NUMBA else [False])
+    def test_sweep_matches_single_backtests(self, jit, gaps):
+        frames = {'A': _bars(seed=1), 'B': _bars(seed=2), 'C': _bars(seed=3)}
+        if gaps:
+            # B is missing a handful of bars and C starts later
+            frames['B'] = frames['B'].drop(index=frames['B'].index[[40, 41, 90, 150, 151, 152, 220]])
+            frames['C'] = frames['C'].iloc[25:]
+        rolling.use_jit(jit)
+        try:
+            panel = StockPanel.FromFrames(frames)
+            fast, slow = [5, 5, 10, 20], [30, 60, 60, 90]
+            stats = sweep_crossovers(panel, fast, slow, cost=0.0005, short=True, memory=2 ** 16)
+        finally:
+            rolling.use_jit(rolling.HAVE_NUMBA)
+        prices = total_return_index(panel)
+        for f, s in zip(fast, slow):
+            single = run_backtest(panel, crossover_signals(prices, f, s, short=True), cost=0.0005).statistics()
+            for name in single.columns:
+                assert np.allclose(stats[name].loc[(f, s)], single[name], equal_nan=True)
+
+    def test_sweep_fallback_with_per_ticker_costs(self):
+        rolling.use_jit(False)
+        try:
+            panel = StockPanel.FromFrames({t: _bars(seed=i) for i, t in enumerate('ABCD')})
+            cost, slippage = np.array([0., 0.0005, 0.001, 0.002]), np.array([0.0001, 0., 0.0002, 0.])
+            fast, slow = [5, 10, 20], [30, 60, 90]
+            # a small budget so the tickers are swept in several blocks
+            stats = sweep_crossovers(panel, fast, slow, cost=cost, slippage=slippage, memory=2 ** 15)
+        finally:
+            rolling.use_jit(rolling.HAVE_NUMBA)
+        prices = total_return_index(panel)
+        for f, s in zip(fast, slow):
+            single = run_backtest(panel, crossover_signals(prices, f, s), cost=cost, slippage=slippage).statistics()
+            for name in single.columns:
+                assert np.allclose(stats[name].loc[(f, s)], single[name], equal_nan=True)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from src.bar_store import BarStore
+from src.constants import DAY_CLOSE, DAY_VOLUME, ADJ_CLOSE
+from src.stocks import StockChart
+
+
+class TestBarStore:
+
+    def _bars(self, n=300):
+        dates = pd.bdate_range('2015-01-29', periods=n)
+        rng = np.random.default_rng(0)
+        return pd.DataFrame({DAY_CLOSE: rng.uniform(40, 170, n), ADJ_CLOSE: rng.uniform(40, 170, n),
+                             DAY_VOLUME: rng.integers(10**6, 10**8, n), 'ignored': np.zeros(n)},
+                            index=dates[::-1])
+
+    def test_round_trip_is_memory_mapped(self, tmp_path):
+        store = BarStore(tmp_path)
+        bars = self._bars()
+        store.write('MSFT', bars)
+        dates, arrays = store.open('MSFT')
+        assert isinstance(arrays[DAY_CLOSE], np.memmap)
+        assert arrays[DAY_VOLUME].dtype == np.float64
+        df = store.read('MSFT')
+        assert list(df.columns) == [DAY_CLOSE, ADJ_CLOSE, DAY_VOLUME]
+        assert df.index.is_monotonic_increasing
+        pd.testing.assert_series_equal(df[DAY_CLOSE], bars[DAY_CLOSE].sort_index(), check_names=False,
+                                       check_index_type=False, check_freq=False)
+        assert store.tickers() == ['MSFT']
+
+    def test_missing_bar_round_trips(self, tmp_path):
+        store = BarStore(tmp_path)
+        bars = self._bars(10).sort_index().astype(float)
+        bars.iloc[4, :3] = np.nan
+        store.write('MSFT', bars)
+        df = store.read('MSFT')
+        assert df.iloc[4].isna().all()
+        pd.testing.assert_frame_equal(df, bars[[DAY_CLOSE, ADJ_CLOSE, DAY_VOLUME]], check_names=False,
+                                      check_index_type=False, check_freq=False)
+
+    def test_stock_chart_views_and_rewrite(self, tmp_path):
+        store = BarStore(tmp_path)
+        store.write('AMZN', self._bars(10))
+        chart = StockChart.LoadFromBarStore('AMZN', store=store, columns=[DAY_CLOSE])
+        assert list(chart.data.columns) == [DAY_CLOSE]
+        chart.CalculateMovingAvg(3)
+        store.write('AMZN', self._bars(20))
+        assert len(store.read('AMZN')) == 20
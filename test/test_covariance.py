@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from src.covariance import RollingCovariance, iter_covariances, ledoit_wolf
+
+
+class TestRollingCovariance:
+
+    rng = np.random.default_rng(0)
+    values = rng.multivariate_normal(np.zeros(5), np.eye(5) * 1e-4 + 5e-5, 300)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    returns = pd.DataFrame(values, index=pd.bdate_range('2019-01-01', periods=300), columns=list('ABCDE'))
+
+    def test_window_matches_pandas(self):
+        daily = RollingCovariance(self.returns.columns, window=60)
+        for _, row in self.returns.iterrows():
+            daily.update(row)
+        blocked = RollingCovariance(self.returns.columns, window=60)
+        blocked.update(self.values[:170]).update(self.values[170:])
+        last = self.returns.iloc[-60:]
+        for engine in (daily, blocked):
+            assert np.allclose(engine.covariance(), last.cov(), rtol=1e-9, atol=1e-15)
+            assert np.allclose(engine.correlation(), last.corr(), rtol=1e-9)
+
+    def test_exponential_weights_match_pandas(self):
+        engine = RollingCovariance(self.returns.columns, halflife=20).update(self.values)
+        expected = self.returns.ewm(halflife=20).cov().loc[self.returns.index[-1]]
+        assert np.allclose(engine.covariance(), expected, rtol=1e-9, atol=1e-15)
+
+    def test_iter_covariances_upper_triangle(self):
+        emitted = list(iter_covariances(self.returns, window=60, every=20, upper=True))
+        assert [date for date, _ in emitted[:2]] == [self.returns.index[59], self.returns.index[79]]
+        date, upper = emitted[-1]
+        expected = self.returns.loc[:date].iloc[-60:].cov().to_numpy()[np.triu_indices(5)]
+        assert upper.shape == (15,)
+        assert np.allclose(upper, expected, rtol=1e-9, atol=1e-15)
+        assert len(RollingCovariance(self.returns.columns, window=60).upper_index()) == 15
+
+
+class TestLedoitWolf:
+
+    def test_shrunk_covariance_is_well_conditioned(self):
+        # more assets than days, so the sample covariance is singular
+        returns = np.random.default_rng(1).normal(0, 0.01, (40, 100))
+        shrunk, intensity = ledoit_wolf(returns)
+        assert 0 < intensity <= 1
+        assert np.linalg.eigvalsh(shrunk).min() > 0
+        engine = RollingCovariance(range(100), window=40).update(returns)
+        assert np.linalg.eigvalsh(engine.covariance(shrink=True)).min() > 0
@@ -0,0 +1,78 @@
+import math
+from pathlib import Path
+
+import numpy as np
+import pytest
+from scipy.special import ndtr
+
+from src.hedging import load_closes, historical_paths, delta_hedge_pnl, pnl_distribution, simulate_hedge
+from src.pricing_model import BlackSholesArray, _d1d2
+
+RAW = Path(__file__).resolve().parents[1] / 'data' / 'raw'
+
+
+def gbm_paths(n_paths, days, sigma, rate, seed=0):
+    z = np.random.default_rng(seed).standard_normal((n_paths, days))
+    steps = (rate - sigma ** 2 / 2) / 252 + sigma * math.sqrt(1 / 252) * z
+    return 100 * np.exp(np.concatenate([np.zeros((n_paths, 1)), np.cumsum(steps, axis=1)], axis=1))
+
+
+class TestDeltaHedge:
+
+    def test_one_day_by_hand(self):
+        dt = 1 / 252
+        d1 = _d1d2(100., 100., 0.2, 0.05, dt, termUnits='years')[7]
+        call, _ = BlackSholesArray(100., 100., 0.2, 0.05, dt, termUnits='years')
+        delta = ndtr(d1)
+        expected = delta * (101 - 100 * math.exp(0.05 * dt)) - (1. - call * math.exp(0.05 * dt))
+        pnl = delta_hedge_pnl([[100., 101.]], 100., 0.2, 0.05)
+        assert pnl[0] == pytest.approx(expected)
+        # long the option the other way round
+        assert delta_hedge_pnl([[100., 101.]], 100., 0.2, 0.05, quantity=1)[0] == pytest.approx(-expected)
+
+    def test_error_shrinks_with_rebalancing(self):
+        paths = gbm_paths(4000, 252, 0.2, 0.02)
+        spread = {}
+        for rebalance in (1, 5, 21):
+            pnl = delta_hedge_pnl(paths, 100., 0.2, 0.02, rebalance=rebalance)
+            assert abs(pnl.mean()) < 0.1
+            spread[rebalance] = pnl.std()
+        assert spread[1] < spread[5] < spread[21]
+        # the hedging error grows with the square root of the time between trades
+        assert spread[5] / spread[1] == pytest.approx(math.sqrt(5), rel=0.15)
+        puts = delta_hedge_pnl(paths, 100., 0.2, 0.02, option_type='put')
+        assert abs(puts.mean()) < 0.1 and puts.std() == pytest.approx(spread[1], rel=0.1)
+
+    def test_costs(self):
+        paths = gbm_paths(500, 63, 0.2, 0.)
+        free = delta_hedge_pnl(paths, 100., 0.2, rebalance=1)
+        charged = delta_hedge_pnl(paths, 100., 0.2, rebalance=1, cost=0.001)
+        assert (charged < free).all()
+        with pytest.raises(ValueError):
+            delta_hedge_pnl(paths, 100., 0.2, option_type='straddle')
+
+    def test_distribution(self):
+        summary = pnl_distribution(np.arange(1., 101.))
+        assert summary['paths'] == 100 and summary['mean'] == 50.5
+        assert summary['q50'] == 50.5 and summary['es_95'] == -3.
+
+
+class TestHistorical:
+
+    def test_paths(self):
+        paths = historical_paths(np.arange(1., 11.), 3, step=2, starting_price=100.)
+        assert paths.shape == (4, 4)
+        assert (paths[:, 0] == 100.).all()
+        assert paths[1, -1] == pytest.approx(100. * 6 / 3)
+
+    def test_realized_and_bootstrap(self):
+        closes = load_closes('MSFT', folder=RAW)
+        assert closes.index.is_monotonic_increasing and len(closes) > 1000
+        historical = simulate_hedge(closes, 165., 0.25, 0.017, days=63, source='historical', step=5)
+        assert len(historical) == len(range(0, len(closes) - 63, 5))
+        bootstrap = simulate_hedge(closes, 165., rate=0.017, days=63, n_paths=2000, rebalance=5, seed=1)
+        assert len(bootstrap) == 2000 and np.isfinite(bootstrap).all()
+        assert np.array_equal(bootstrap, simulate_hedge(closes, 165., rate=0.017, days=63, n_paths=2000,
+                                                        rebalance=5, seed=1))
+        with pytest.raises(ValueError):
+            simulate_hedge(closes, 165., source='garch')
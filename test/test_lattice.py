@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+from src.constants import DIVIDEND_AMT
+from src.lattice import lattice_price, project_dividends
+from src.pricing_model import BlackSholesArray
+
+
+class TestLattice:
+
+    strikes = np.array([90., 100., 110.])
+
+    def test_european_converges_to_black_sholes(self):
+        calls, puts = BlackSholesArray(100., self.strikes, 0.25, 0.03, 0.5, termUnits='years')
+        for method in ('binomial', 'trinomial'):
+            lattice = lattice_price(100., self.strikes, 0.25, 0.03, 0.5, termUnits='years', optionType='put',
+                                    american=False, steps=500, method=method)
+            assert np.allclose(lattice, puts, atol=0.02)
+
+    def test_american_put_has_early_exercise_premium(self):
+        types = np.array(['call', 'put', 'put'])
+        american = lattice_price(100., self.strikes, 0.25, 0.05, 1., termUnits='years', optionType=types)
+        european = lattice_price(100., self.strikes, 0.25, 0.05, 1., termUnits='years', optionType=types,
+                                 american=False)
+        # without dividends an american call is never exercised early
+        assert np.isclose(american[0], european[0])
+        assert (american[1:] > european[1:]).all()
+
+    def test_dividends_lower_calls(self):
+        history = pd.DataFrame({DIVIDEND_AMT: [0., 0.51, 0., 0.51]},
+                               index=pd.to_datetime(['2019-05-01', '2019-05-15', '2019-08-01', '2019-08-14']))
+        dividends = project_dividends(history, '2019-12-31', 365)
+        assert [amount for _, amount in dividends] == [0.51, 0.51]
+        with_div = lattice_price(100., 100., 0.2, 0.02, 365, dividends=dividends)
+        without = lattice_price(100., 100., 0.2, 0.02, 365)
+        assert with_div < without
@@ -0,0 +1,107 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+from src.constants import DAY_CLOSE, DIVIDEND_AMT, SPLIT_COEFFICIENT
+from src import stocks
+from src.market_data import AlphaVantageFetcher, BarCache, TokenBucket, FetchError
+from src.stocks import load_tickers
+
+CSV = 'timestamp,open,high,low,close,adjusted_close,volume,dividend_amount,split_coefficient\n' + \
+      ''.join(f'{d:%Y-%m-%d},1.0,1.0,1.0,{i}.5,1.0,100,0.0,1.0\n'
+              for i, d in enumerate(pd.bdate_range(end='2020-01-31', periods=250)[::-1]))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serves the same csv for every symbol, except BAD which always errors and FLAKY which gets the rate limit note
+    once.  It keeps count of the calls for each symbol and of the most requests that were in flight at once
+    """
+    calls = {}
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        symbol = parse_qs(urlparse(self.path).query)['symbol'][0]
+        with StubHandler.lock:
+            StubHandler.calls[symbol] = StubHandler.calls.get(symbol, 0) + 1
+            StubHandler.in_flight += 1
+            StubHandler.max_in_flight = max(StubHandler.max_in_flight, StubHandler.in_flight)
+        body = CSV
+        if symbol == 'BAD':
+            body = '{"Error Message": "Invalid API call."}'
+        elif symbol == 'FLAKY' and StubHandler.calls[symbol] == 1:
+            body = '{"Note": "Thank you for using Alpha Vantage!"}'
+        # a slow response (without time.sleep, which the test replaces) so that the requests overlap
+        threading.Event().wait(0.05)
+        with StubHandler.lock:
+            StubHandler.in_flight -= 1
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class QuotaFetcher:
+    """
+    Returns the rate limit note for the first <notes> calls and then the bars
+    """
+
+    def __init__(self, notes):
+        self.rate_limiter = TokenBucket(rate=5 / 60, capacity=5)
+        self.notes = notes
+        self.calls = 0
+
+    def __call__(self, ticker, start=None, end=None):
+        self.calls += 1
+        if self.calls <= self.notes:
+            raise FetchError(f'{ticker}: {{"Note": "Thank you for using Alpha Vantage!"}}', rate_limited=True)
+        dates = pd.bdate_range(end='2020-01-31', periods=10)
+        return pd.DataFrame({DAY_CLOSE: 1.5, DIVIDEND_AMT: 0., SPLIT_COEFFICIENT: 1.}, index=dates)
+
+
+class TestLoadTickers:
+
+    def test_quota_note_waits_for_the_rate_limiter(self, tmp_path, monkeypatch):
+        delays = []
+        monkeypatch.setattr(stocks.time, 'sleep', delays.append)
+        fetcher = QuotaFetcher(notes=2)
+        charts, failures = load_tickers(['MSFT'], cache=BarCache(tmp_path, fetcher), max_workers=1, retries=2,
+                                        backoff=1.)
+        assert failures == {} and fetcher.calls == 3
+        assert charts['MSFT'].data[DAY_CLOSE].iloc[-1] == 1.5
+        # the per-minute quota has to refill before a retry can succeed
+        assert len(delays) == 2 and all(d >= 60 for d in delays)
+
+    def test_concurrent_load_isolates_failures(self, tmp_path, monkeypatch):
+        delays = []
+        monkeypatch.setattr(stocks.time, 'sleep', delays.append)
+        StubHandler.calls, StubHandler.max_in_flight = {}, 0
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            fetcher = AlphaVantageFetcher('demo', base_url=f'http://127.0.0.1:{server.server_port}/query',
+                                          rate_limiter=TokenBucket(1000, capacity=50))
+            tickers = [f'T{i}' for i in range(40)] + ['BAD', 'FLAKY']
+            charts, failures = load_tickers(tickers, cache=BarCache(tmp_path, fetcher), max_workers=16,
+                                            retries=3, backoff=0.01)
+        finally:
+            server.shutdown()
+        assert set(failures) == {'BAD'}
+        assert len(charts) == 41
+        assert charts['T3'].data[DAY_CLOSE].iloc[-1] == 0.5
+        # the invalid symbol fails straight away, the rate limited one waits for the bucket to refill and retries
+        assert StubHandler.calls['BAD'] == 1 and StubHandler.calls['FLAKY'] == 2
+        assert len(delays) == 1 and delays[0] >= 50 / 1000
+        assert StubHandler.max_in_flight > 1
+
+    def test_token_bucket_limits_rate(self):
+        bucket = TokenBucket(rate=50, capacity=1)
+        start = time.time()
+        for _ in range(11):
+            bucket.acquire()
+        assert time.time() - start >= 0.19
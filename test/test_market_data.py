@@ -0,0 +1,102 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from src import stocks
+from src.constants import DAY_CLOSE
+from src.market_data import BarCache, AlphaVantageFetcher, COMPACT_DAYS
+from src.stocks import StockChart, _getHistoricalTicker
+
+
+class FakeSource:
+    """
+    A local stand in for AlphaVantage that records each request
+    """
+
+    def __init__(self, last_day):
+        dates = pd.bdate_range('2019-01-01', '2020-06-30')
+        self.bars = pd.DataFrame({DAY_CLOSE: np.arange(len(dates), dtype=float) + 0.123456}, index=dates)
+        self.last_day = pd.Timestamp(last_day)
+        self.calls = []
+
+    def __call__(self, ticker, start=None, end=None, last=None):
+        self.calls.append((ticker, start, end))
+        if last is not None:
+            return self.bars.loc[:self.last_day].iloc[-last:]
+        return self.bars.loc[start:min(pd.Timestamp(end), self.last_day)]
+
+
+class FakeSession:
+    """
+    Stands in for the requests session of AlphaVantageFetcher, answering with a year of daily bars up to today
+    """
+
+    def __init__(self):
+        self.params = []
+        dates = pd.bdate_range(end=dt.date.today(), periods=260)
+        self.text = 'timestamp,close\n' + ''.join(f'{d:%Y-%m-%d},{i}.0\n' for i, d in enumerate(dates[::-1]))
+
+    def get(self, url, timeout=None, params=None):
+        self.params.append(params)
+        return self
+
+    def raise_for_status(self):
+        pass
+
+
+class TestBarCache:
+
+    def test_fetches_only_missing_days(self, tmp_path):
+        source = FakeSource('2020-01-31')
+        cache = BarCache(folder=tmp_path, fetcher=source)
+        bars = cache.get_bars('MSFT', today='2020-01-31')
+        assert bars.index[-1] == pd.Timestamp('2020-01-31')
+        assert len(source.calls) == 1
+
+        # a repeat load on the same day doesn't go to the source
+        cache.get_bars('MSFT', today='2020-01-31')
+        assert len(source.calls) == 1
+
+        source.last_day = pd.Timestamp('2020-02-07')
+        bars = cache.get_bars('MSFT', today='2020-02-07')
+        assert len(source.calls) == 2
+        assert source.calls[-1][1] == pd.Timestamp('2020-02-01')
+        assert bars.index.is_unique
+        assert bars.index[-1] == pd.Timestamp('2020-02-07')
+        # nothing is lost to rounding
+        assert bars[DAY_CLOSE].iloc[-1] == source.bars.loc['2020-02-07', DAY_CLOSE]
+
+    def test_date_range_inside_cache_needs_no_fetch(self, tmp_path):
+        source = FakeSource('2020-01-31')
+        cache = BarCache(folder=tmp_path, fetcher=source)
+        cache.refresh('AMZN', today='2020-01-31')
+        bars = cache.get_bars('AMZN', start='2019-06-01', end='2019-06-30', today='2020-03-01')
+        assert len(source.calls) == 1
+        assert bars.index[0] >= pd.Timestamp('2019-06-01') and bars.index[-1] <= pd.Timestamp('2019-06-30')
+
+    def test_stock_chart_loads_through_cache(self, tmp_path):
+        cache = BarCache(folder=tmp_path, fetcher=FakeSource('2020-01-31'))
+        chart = StockChart.LoadFromTicker('SPY', cache=cache)
+        assert len(chart.data) > 0
+
+
+class TestAlphaVantageFetcher:
+
+    def test_compact_output_for_the_last_100_days(self):
+        fetcher = AlphaVantageFetcher('demo')
+        fetcher.session = FakeSession()
+        bars = fetcher('MSFT', last=COMPACT_DAYS)
+        assert len(bars) == COMPACT_DAYS and bars[DAY_CLOSE].iloc[-1] == 0.
+        today = pd.Timestamp(dt.date.today())
+        fetcher('MSFT', start=today - pd.Timedelta(days=COMPACT_DAYS))
+        fetcher('MSFT', start=today - pd.Timedelta(days=COMPACT_DAYS + 1))
+        assert [p['outputsize'] for p in fetcher.session.params] == ['compact', 'compact', 'full']
+
+    def test_loads_share_one_cache(self, tmp_path, monkeypatch):
+        source = FakeSource('2020-01-31')
+        monkeypatch.setattr(stocks, '_shared_cache', BarCache(folder=tmp_path, fetcher=source))
+        bars, _ = _getHistoricalTicker('MSFT')
+        _getHistoricalTicker('AMZN')
+        assert len(bars) == COMPACT_DAYS and bars.index[-1] == pd.Timestamp('2020-01-31')
+        assert [call[0] for call in source.calls] == ['MSFT', 'AMZN']
+        assert stocks._default_cache() is stocks._default_cache()
@@ -0,0 +1,35 @@
+import numpy as np
+from src.mc_pricing import price_by_simulation, european_call, asian_call, barrier_option, lookback_put, \
+    ANN_TRADE_DAYS
+from src.pricing_model import _BlackSholes
+
+
+class TestPriceBySimulation:
+
+    returns = np.random.default_rng(0).normal(0.0004, 0.015, 1250)
+
+    def _bs_call(self, strike, period):
+        sigma = np.log1p(self.returns).std(ddof=1)*np.sqrt(ANN_TRADE_DAYS)
+        return _BlackSholes(100., strike, sigma, 0.02, period/ANN_TRADE_DAYS, termUnits='years')[0]
+
+    def test_gbm_european_matches_black_sholes(self):
+        result = price_by_simulation(european_call(105), 100., self.returns, 60, 0.02, n_paths=20000,
+                                     model='gbm', seed=1)
+        assert abs(result['price'] - self._bs_call(105, 60)) < 4*result['standard_error']
+
+    def test_control_variate_reduces_error(self):
+        plain = price_by_simulation(asian_call(100), 100., self.returns, 60, 0.02, n_paths=8000,
+                                    antithetic=False, seed=2)
+        reduced = price_by_simulation(asian_call(100), 100., self.returns, 60, 0.02, n_paths=8000,
+                                      antithetic=True, control_strike=100, seed=2)
+        assert reduced['standard_error'] < plain['standard_error']/1.5
+        assert abs(reduced['price'] - plain['price']) < 4*plain['standard_error']
+
+    def test_sobol_and_path_dependent_payoffs(self):
+        result = price_by_simulation(lookback_put(), 100., self.returns, 20, 0.02, n_paths=3000, sobol=True,
+                                     seed=3)
+        assert result['n_paths'] == 4096
+        assert result['price'] > 0
+        knock_out = price_by_simulation(barrier_option(100, 110), 100., self.returns, 20, 0.02, seed=3)
+        vanilla = price_by_simulation(european_call(100), 100., self.returns, 20, 0.02, seed=3)
+        assert knock_out['price'] < vanilla['price']
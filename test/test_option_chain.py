@@ -0,0 +1,63 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from src import option_chain
+from src.option_chain import option_chain_grid, clear_grid_cache, grid_cache_info, expiration_terms
+from src.pricing_model import _BlackSholes
+
+AS_OF = date(2020, 1, 29)
+
+
+class TestOptionChainGrid:
+
+    def setup_method(self):
+        clear_grid_cache()
+
+    def test_matches_scalar_pricing(self):
+        vols = np.arange(.15, .25, .01)
+        grid = option_chain_grid(166.36, [170, 175], ['1/15/2021', '6/18/2021'], vols, 0.017, as_of=AS_OF)
+        assert grid.shape == (2 * 2 * len(vols), 3)
+        assert list(grid.index.names) == ['expiration', 'strike', 'volatility']
+        row = grid.loc[('2021-01-15', 175., vols[3])]
+        call, put = _BlackSholes(166.36, 175., vols[3], 0.017, 352)
+        assert row['term'] == 352
+        assert row['call'] == pytest.approx(call)
+        assert row['put'] == pytest.approx(put)
+        assert grid['call'].unstack('volatility').shape == (4, len(vols))
+
+    def test_expiries_parsed_once(self):
+        dates, terms = expiration_terms(['1/15/2021', date(2020, 2, 29), '1/29/2020'], as_of='1/29/2020')
+        assert dates[0] == date(2021, 1, 15)
+        assert list(terms) == [352, 31, 0]
+
+    def test_expired_and_expiring(self):
+        grid = option_chain_grid(100., [90, 110], ['1/29/2020', '1/1/2020'], [.2], 0.01, as_of=AS_OF)
+        today = grid.loc['2020-01-29']
+        assert list(today['call']) == [10., 0.]
+        assert list(today['put']) == [0., 10.]
+        assert grid.loc['2020-01-01'][['call', 'put']].isna().all(axis=None)
+
+    def test_cache(self, monkeypatch):
+        monkeypatch.setattr(option_chain, 'GRID_CACHE_SIZE', 2)
+        first = option_chain_grid(100., [100], ['1/15/2021'], [.2, .3], 0.01, as_of=AS_OF)
+        again = option_chain_grid(100., np.array([100.]), ['1/15/2021'], [.2, .3], 0.01, as_of=AS_OF)
+        assert grid_cache_info()['hits'] == 1 and grid_cache_info()['misses'] == 1
+        assert again.equals(first)
+        # changing a returned grid doesn't change the cached one
+        again['call'] = 0.
+        assert option_chain_grid(100., [100], ['1/15/2021'], [.2, .3], 0.01, as_of=AS_OF).equals(first)
+        again.loc[again.index[0], 'put'] = -1.
+        assert option_chain_grid(100., [100], ['1/15/2021'], [.2, .3], 0.01, as_of=AS_OF).equals(first)
+        # the same expiration given as a datetime64 is the same grid
+        option_chain_grid(np.float64(100.), [100], np.array(['2021-01-15'], dtype='datetime64[ns]'), [.2, .3], 0.01,
+                          as_of=np.datetime64('2020-01-29'))
+        assert grid_cache_info()['hits'] == 4 and grid_cache_info()['misses'] == 1
+        option_chain_grid(101., [100], ['1/15/2021'], [.2, .3], 0.01, as_of=AS_OF)
+        option_chain_grid(102., [100], ['1/15/2021'], [.2, .3], 0.01, as_of=AS_OF)
+        info = grid_cache_info()
+        assert info['size'] == 2 and info['misses'] == 3
+        # the least recently used grid was dropped
+        option_chain_grid(100., [100], ['1/15/2021'], [.2, .3], 0.01, as_of=AS_OF)
+        assert grid_cache_info()['misses'] == 4
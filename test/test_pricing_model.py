@@ -0,0 +1,90 @@
+import numpy as np
+from scipy.special import ndtr
+from src.pricing_model import _BlackSholes, BlackSholesArray, BlackSholesGreeks, ImpliedVolatility, NormCdfTable
+
+
+class TestBlackSholes:
+
+    def test_scalar_matches_known_value(self):
+        # Hull, Options Futures and Other Derivatives example 15.6
+        call, put = _BlackSholes(42, 40, 0.2, 0.1, 0.5, termUnits='years')
+        assert abs(call - 4.76) < 0.01
+        assert abs(put - 0.81) < 0.01
+
+    def test_array_broadcasts_and_matches_scalar(self):
+        strikes = np.array([150., 175., 200.])[:, None]
+        vols = np.arange(.15, .25, .01)[None, :]
+        calls, puts = BlackSholesArray(166.36, strikes, vols, 0.017, 350)
+        assert calls.shape == (3, len(vols[0]))
+        call, put = _BlackSholes(166.36, 175., vols[0, 3], 0.017, 350)
+        assert np.isclose(calls[1, 3], call)
+        assert np.isclose(puts[1, 3], put)
+
+    def test_put_call_parity(self):
+        rng = np.random.default_rng(0)
+        S = rng.uniform(50, 150, 1000)
+        K = rng.uniform(50, 150, 1000)
+        calls, puts = BlackSholesArray(S, K, 0.3, 0.02, 1.0, termUnits='years')
+        assert np.allclose(calls - puts, S - K*np.exp(-0.02))
+
+
+class TestBlackSholesGreeks:
+
+    def test_greeks_match_finite_differences(self):
+        S, K, sigma, r, T = 100., 105., 0.25, 0.03, 0.75
+        g = BlackSholesGreeks(S, K, sigma, r, T, termUnits='years')
+        h = 1e-4
+
+        def call(S=S, sigma=sigma, r=r, T=T):
+            return BlackSholesArray(S, K, sigma, r, T, termUnits='years')[0]
+
+        assert np.isclose(g['call'], call())
+        assert np.isclose(g['call_delta'], (call(S=S + h) - call(S=S - h))/(2*h))
+        assert np.isclose(g['gamma'], (call(S=S + h) - 2*call() + call(S=S - h))/h**2, rtol=1e-3)
+        assert np.isclose(g['vega'], (call(sigma=sigma + h) - call(sigma=sigma - h))/(2*h))
+        assert np.isclose(g['call_rho'], (call(r=r + h) - call(r=r - h))/(2*h))
+        assert np.isclose(g['call_theta'], -(call(T=T + h) - call(T=T - h))/(2*h))
+
+    def test_greeks_are_vectorized(self):
+        strikes = np.linspace(80, 120, 41)
+        g = BlackSholesGreeks(100., strikes, 0.2, 0.01, 90)
+        assert g['gamma'].shape == strikes.shape
+        assert np.allclose(g['call_delta'] - g['put_delta'], 1)
+
+
+class TestImpliedVolatility:
+
+    def test_round_trip(self):
+        rng = np.random.default_rng(1)
+        S = 100.
+        K = rng.uniform(60, 140, 2000)
+        T = rng.uniform(7, 720, 2000)
+        vol = rng.uniform(0.05, 1.0, 2000)
+        calls, puts = BlackSholesArray(S, K, vol, 0.02, T)
+        types = np.where(K > S, 'call', 'put')
+        prices = np.where(types == 'call', calls, puts)
+        iv, converged = ImpliedVolatility(prices, S, K, 0.02, T, optionType=types)
+        # deep in/out of the money contracts have almost no vega so only check those that have some
+        vega = BlackSholesGreeks(S, K, vol, 0.02, T)['vega']
+        check = vega > 1e-2
+        assert converged[check].all()
+        assert np.allclose(iv[check], vol[check], atol=1e-6)
+
+    def test_reports_arbitrage_violations(self):
+        iv, converged = ImpliedVolatility([0.5, 200.], 100., 50., 0.01, 1., termUnits='years')
+        assert np.isnan(iv).all()
+        assert not converged.any()
+
+
+class TestNormCdf:
+
+    def test_scalar_path_matches_array_path(self):
+        scalar = _BlackSholes(166.36, 175., 0.2, 0.017, 350)
+        array = BlackSholesArray(166.36, 175., 0.2, 0.017, 350)
+        assert np.allclose(scalar, array, rtol=1e-12)
+
+    def test_table_is_within_bound(self):
+        table = NormCdfTable()
+        x = np.linspace(-9, 9, 10001)
+        assert np.abs(table(x) - ndtr(x)).max() <= table.max_error
+        assert abs(table(0.1234) - ndtr(0.1234)) <= table.max_error
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+from scipy.special import ndtri
+from src.risk import RiskEngine
+
+
+class TestRiskEngine:
+
+    rng = np.random.default_rng(0)
+    returns = pd.DataFrame(rng.multivariate_normal([0, 0], [[4e-4, 2e-4], [2e-4, 3e-4]], 750), columns=['MSFT', 'SPY'])
+    spot = {'MSFT': 170., 'SPY': 330.}
+    stocks = pd.DataFrame([{'ticker': 'MSFT', 'quantity': 100, 'instrument': 'stock'},
+                           {'ticker': 'SPY', 'quantity': -40, 'instrument': 'stock'}])
+
+    def test_stock_book(self):
+        engine = RiskEngine(self.stocks, self.spot, self.returns)
+        losses = -(self.returns.to_numpy() @ np.array([170. * 100, -330. * 40]))
+        historical = engine.var(0.99)
+        assert np.isclose(historical['var'], np.quantile(losses, 0.99))
+        assert historical['es'] >= historical['var']
+        exposure = np.array([17000., -13200.])
+        sigma = np.sqrt(exposure @ self.returns.cov().to_numpy() @ exposure)
+        assert np.isclose(engine.var(0.99, method='parametric')['var'], ndtri(0.99) * sigma)
+
+    def test_components_add_up(self):
+        engine = RiskEngine(self.stocks, self.spot, self.returns)
+        parametric = engine.component_var(0.99, method='parametric')
+        assert np.isclose(parametric['var'].sum(), engine.var(0.99, method='parametric')['var'])
+        simulated = engine.component_var(0.99, method='monte_carlo', seed=1)
+        total = engine.var(0.99, method='monte_carlo', seed=1)
+        assert np.isclose(simulated['es'].sum(), total['es'])
+        assert abs(simulated['var'].sum() / total['var'] - 1) < 0.1
+        # doubling a linear book doubles the risk
+        assert np.isclose(engine.incremental_var(self.stocks)['var'], engine.var(0.99)['var'])
+
+    def test_options_are_revalued(self):
+        call = pd.DataFrame([{'ticker': 'MSFT', 'quantity': 1, 'instrument': 'call', 'strike': 175., 'term': 5,
+                              'volatility': 0.3}])
+        engine = RiskEngine(call, self.spot, self.returns, rate=0.02, horizon=10)
+        pnl = engine.revalue(engine.scenarios('monte_carlo', 5000, seed=2))[:, 0]
+        premium = engine._option_values(np.array([170.]), engine.positions)[0] * 100
+        # the option expires within the horizon, so the most a long call can lose is its premium
+        assert np.isclose(pnl.min(), -premium)
+        assert engine.var(0.99, method='monte_carlo', n_scenarios=5000, seed=2)['var'] <= premium + 1e-9
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src import rolling
+from src.rolling import rolling_mean, rolling_std, rolling_min, rolling_max, rolling_zscore, ewm_mean
+
+BACKENDS = [False, True] if rolling.HAVE_NUMBA else [False]
+
+
+@pytest.fixture(params=BACKENDS, ids=lambda jit: 'numba' if jit else 'numpy')
+def backend(request):
+    rolling.use_jit(request.param)
+    yield request.param
+    rolling.use_jit(rolling.HAVE_NUMBA)
+
+
+class TestRollingKernels:
+
+    rng = np.random.default_rng(0)
+    values = 100 + np.cumsum(rng.normal(0, 1, (300, 12)), axis=0)
+    values[rng.random(values.shape) < 0.05] = np.nan
+
+    @pytest.mark.parametrize('name', ['mean', 'std', 'min', 'max'])
+    def test_matches_pandas(self, backend, name):
+        kernel = {'mean': rolling_mean, 'std': rolling_std, 'min': rolling_min, 'max': rolling_max}[name]
+        df = pd.DataFrame(self.values)
+        windows = [1, 5, 30]
+        stacked = kernel(self.values, windows)
+        assert stacked.shape == (3, 300, 12)
+        for window, result in zip(windows, stacked):
+            expected = getattr(df.rolling(window), name)()
+            assert np.allclose(result, expected, equal_nan=True, rtol=1e-9, atol=1e-12)
+        partial = kernel(self.values[:, 0], 30, min_periods=10)
+        assert np.allclose(partial, getattr(df[0].rolling(30, min_periods=10), name)(), equal_nan=True)
+
+    def test_zscore_and_ewm(self, backend):
+        series = pd.Series(self.values[:, 3])
+        expected = (series - series.rolling(20).mean()) / series.rolling(20).std()
+        assert np.allclose(rolling_zscore(series, 20), expected, equal_nan=True)
+        spans = ewm_mean(self.values, span=[10, 60])
+        for span, result in zip([10, 60], spans):
+            assert np.allclose(result, pd.DataFrame(self.values).ewm(span=span).mean(), equal_nan=True)
+
+    def test_precision_with_large_values(self, backend):
+        values = 1e6 + self.rng.normal(0, 1e-3, 5000)
+        assert np.allclose(rolling_std(values, 50)[49:], pd.Series(values).rolling(50).std()[49:], rtol=1e-6)
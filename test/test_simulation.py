@@ -0,0 +1,88 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+from src.simulation import (simulate_price_paths, simulate_horizons, StreamingStats, simulate_until_converged,
+                            _simulate_shared_chunk)
+from src.stocks import getLikelyPrice
+
+
+class TestSimulation:
+
+    returns = np.random.default_rng(0).normal(0.0005, 0.01, 1000)
+
+    def test_paths_compound_returns(self):
+        paths = simulate_price_paths(100., [0.01], 5, n_paths=3, seed=1)
+        assert paths.shape == (3, 5)
+        assert np.allclose(paths[0], 100*1.01**np.arange(5))
+
+    def test_horizons_are_reproducible_and_chunked(self):
+        horizons = {'30_days': 30, '90_days': 90}
+        df = simulate_horizons(100., self.returns, horizons, n_paths=2500, seed=7, chunk_size=1000)
+        again = simulate_horizons(100., self.returns, horizons, n_paths=2500, seed=7, chunk_size=1000)
+        assert list(df.columns) == ['30_days', '90_days']
+        assert len(df) == 2500
+        assert df.equals(again)
+
+    def test_shorter_horizon_is_prefix_of_longer(self):
+        last = simulate_horizons(100., self.returns, [10, 20], n_paths=50, seed=3, statistic='last')
+        paths = simulate_price_paths(100., self.returns, 20, n_paths=50,
+                                     seed=np.random.SeedSequence(3).spawn(1)[0])
+        assert np.allclose(last[10], paths[:, 9])
+        assert np.allclose(last[20], paths[:, 19])
+
+    def test_get_likely_price_is_seeded(self):
+        assert getLikelyPrice(100., self.returns, 30, seed=5) == getLikelyPrice(100., self.returns, 30, seed=5)
+
+    def test_parallel_is_bit_identical(self):
+        serial = simulate_horizons(100., self.returns, [30, 90], n_paths=4000, seed=11, chunk_size=500)
+        parallel = simulate_horizons(100., self.returns, [30, 90], n_paths=4000, seed=11, chunk_size=500, n_jobs=2)
+        assert np.array_equal(serial.values, parallel.values)
+
+
+    def test_worker_error_comes_through(self):
+        returns_shm = shared_memory.SharedMemory(create=True, size=80)
+        results_shm = shared_memory.SharedMemory(create=True, size=80)
+        try:
+            np.ndarray((10,), dtype=float, buffer=returns_shm.buf)[:] = np.nan
+            task = (returns_shm.name, 10, results_shm.name, 10, 0, 10, 1, 100., [5], 'mean')
+            with pytest.raises(AssertionError, match='Unable to find any historical returns'):
+                _simulate_shared_chunk(task)
+            np.ndarray((10,), dtype=float, buffer=returns_shm.buf)[:] = 0.01
+            task = task[:-1] + ('median',)
+            with pytest.raises(ValueError, match="Unknown statistic 'median'"):
+                _simulate_shared_chunk(task)
+        finally:
+            for shm in (returns_shm, results_shm):
+                shm.close()
+                shm.unlink()
+
+
+class TestStreamingStats:
+
+    def test_matches_batch_statistics(self):
+        values = np.random.default_rng(2).lognormal(0, 0.5, 50000)
+        stats = StreamingStats(strike=1.0, premium=0.1, seed=0)
+        for batch in np.array_split(values, 37):
+            stats.update(batch)
+        assert stats.count == len(values)
+        assert np.isclose(stats.mean, values.mean())
+        assert np.isclose(stats.variance, values.var(ddof=1))
+        assert np.isclose(stats.itm_probability, (values > 1.1).mean())
+        assert len(np.concatenate(stats.sketch.levels)) < 5000
+        assert np.allclose(stats.quantile([0.1, 0.5, 0.9]), np.quantile(values, [0.1, 0.5, 0.9]), rtol=0.05)
+
+    def test_stops_once_converged(self):
+        returns = np.random.default_rng(0).normal(0.0005, 0.01, 1000)
+        stats = simulate_until_converged(100., returns, 30, tol=0.1, batch_size=500, seed=1)
+        assert stats.standard_error < 0.1
+        assert stats.count < 1000000
+
+    def test_deep_otm_itm_error_is_not_zero(self):
+        returns = np.random.default_rng(0).normal(0.0005, 0.01, 1000)
+        stats = simulate_until_converged(100., returns, 30, tol=1e-3, target='itm', strike=1000., batch_size=500,
+                                         max_paths=20000, seed=1)
+        assert stats.itm_probability == 0
+        assert stats.itm_standard_error > 0
+        assert stats.count > 1000
+        assert stats.itm_standard_error < 1e-3
@@ -1,6 +1,11 @@
 from unittest import TestCase
-from src.stocks import get_sp500, StockChart
+import numpy as np
+import pandas as pd
+from src.constants import DAY_CLOSE, DIVIDEND_AMT, SPLIT_COEFFICIENT
+from src.stocks import get_sp500, StockChart, StockPanel, ColumnNames, _RollingWindow
+from src.indicators import INDICATORS
 import time
+import pytest
 
 
 def TestGetCompanyInfo(TestCase):
@@ -16,3 +21,160 @@ class TestStockChart:
     def test_load_from_ticker(self):
         ticker = StockChart.LoadFromTicker('MSFT')
         assert ticker is not None
+
+
+class TestAppendBars:
+
+    def _bars(self, n):
+        dates = pd.bdate_range('2019-01-01', periods=n)
+        rng = np.random.default_rng(0)
+        close = 100 * np.cumprod(1 + rng.normal(0, 0.01, n))
+        dividends = np.where(np.arange(n) % 63 == 62, 0.5, 0.)
+        return pd.DataFrame({DAY_CLOSE: close, DIVIDEND_AMT: dividends, SPLIT_COEFFICIENT: 1.}, index=dates)
+
+    def test_append_matches_full_recalculation(self):
+        bars = self._bars(300)
+        chart = StockChart('MSFT')
+        chart.data = bars.iloc[:250].copy()
+        chart.CalculateMovingAvg(30)
+        chart.Calculate30DayAnnualizedVolatility()
+        assert chart.AppendBars(bars.iloc[240:260]) == 10
+        assert chart.AppendBars(bars.iloc[260:]) == 40
+
+        full = StockChart('MSFT')
+        full.data = bars.copy()
+        full.CalculateMovingAvg(30)
+        full.Calculate30DayAnnualizedVolatility()
+        pd.testing.assert_frame_equal(chart.data, full.data, check_freq=False, rtol=1e-9)
+
+    def test_append_to_str_dates(self):
+        bars = self._bars(300)
+        chart = StockChart('MSFT')
+        # as read from a csv without parse_dates
+        chart.data = bars.iloc[:250].set_axis(bars.index[:250].strftime('%Y-%m-%d'))
+        chart.CalculateMovingAvg(30)
+        assert chart.AppendBars(bars.iloc[250:]) == 50
+        assert isinstance(chart.data.index, pd.DatetimeIndex) and chart.data.index.is_monotonic_increasing
+        full = StockChart('MSFT')
+        full.data = bars.copy()
+        full.CalculateMovingAvg(30)
+        pd.testing.assert_frame_equal(chart.data, full.data, check_freq=False, rtol=1e-9)
+
+    def test_rolling_sums_are_refreshed(self):
+        rng = np.random.default_rng(2)
+        # a random walk that wanders a long way from the first value and then settles down
+        values = np.concatenate([np.cumsum(rng.normal(0, 1e7, 20000)), 5e8 + rng.normal(0, 1., 100)])
+        window = _RollingWindow(20, values[:20])
+        for x in values[20:]:
+            window.push(x)
+        tail = values[-20:]
+        assert window.mean() == pytest.approx(tail.mean(), rel=1e-12)
+        assert window.std() == pytest.approx(tail.std(ddof=1), rel=1e-9)
+
+    def test_single_bar_appends_are_buffered(self):
+        bars = self._bars(300)
+        chart = StockChart('MSFT')
+        chart.data = bars.iloc[:200].copy()
+        chart.CalculateMovingAvg(30)
+        history = chart.data
+        for i in range(200, 300):
+            assert chart.AppendBars(bars.iloc[i:i + 1]) == 1
+        # the history wasn't copied on every append
+        assert chart._data is history and chart._pending_rows == 100
+        full = StockChart('MSFT')
+        full.data = bars.copy()
+        full.CalculateMovingAvg(30)
+        pd.testing.assert_frame_equal(chart.data, full.data, check_freq=False, rtol=1e-9)
+        assert chart._pending_rows == 0
+
+    def test_append_without_optional_columns(self):
+        bars = self._bars(300)
+        chart = StockChart('MSFT')
+        chart.data = bars.iloc[:250].copy()
+        chart.CalculateMovingAvg(30)
+        chart.Calculate30DayAnnualizedVolatility()
+        chart.data['signal'] = 1.
+        assert chart.AppendBars(bars.iloc[250:][[DAY_CLOSE]]) == 50
+        appended = chart.data.iloc[250:]
+        assert appended['signal'].isna().all()
+        assert (appended[DIVIDEND_AMT] == 0.).all() and (appended[SPLIT_COEFFICIENT] == 1.).all()
+        full = StockChart('MSFT')
+        full.data = bars.assign(**{DIVIDEND_AMT: np.where(np.arange(300) < 250, bars[DIVIDEND_AMT], 0.)})
+        full.CalculateMovingAvg(30)
+        full.Calculate30DayAnnualizedVolatility()
+        pd.testing.assert_frame_equal(chart.data.drop(columns='signal'), full.data, check_freq=False, rtol=1e-9)
+
+
+class TestIndicators:
+
+    def _chart(self, n=120):
+        chart = StockChart('MSFT')
+        chart.data = TestAppendBars()._bars(n)
+        return chart
+
+    def test_shared_inputs_calculated_once(self, monkeypatch):
+        calls = []
+        for name in ('total_price_return', 'pct_daily_change'):
+            indicator = INDICATORS[name]
+            func = indicator.func
+            monkeypatch.setattr(indicator, 'func', lambda *args, _f=func, _n=name, **kwargs:
+                                calls.append(_n) or _f(*args, **kwargs))
+        chart = self._chart()
+        for window in (10, 20, 30, 60):
+            chart.Indicator('annualized_volatility', window=window)
+        assert calls == ['total_price_return', 'pct_daily_change']
+        # the indicators are calculated again once the data changes
+        chart.data = chart.data.iloc[1:]
+        chart.Indicator('annualized_volatility')
+        assert calls == ['total_price_return', 'pct_daily_change'] * 2
+
+    def test_volatility_is_from_pct_change(self):
+        chart = self._chart()
+        chart.Calculate30DayAnnualizedVolatility()
+        expected = chart.data[ColumnNames.PCT_DAY_CHANGE].rolling(30).std() * np.sqrt(252)
+        assert np.allclose(chart.data[ColumnNames.ANNUAL_VOL], expected, equal_nan=True)
+        assert chart.data[ColumnNames.ANNUAL_VOL].notna().sum() == len(chart.data) - 31
+
+    def test_unknown_indicator_or_parameter(self):
+        chart = self._chart()
+        with pytest.raises(ValueError):
+            chart.Indicator('moving_average')
+        with pytest.raises(ValueError):
+            chart.Indicator('moving_avg', window=30)
+
+
+class TestStockPanel:
+
+    def _frames(self):
+        bars = TestAppendBars()._bars(200)
+        rng = np.random.default_rng(1)
+        frames = {'MSFT': bars, 'AMZN': bars * [1.5, 0, 1] + [0, 0.25, 0]}
+        # SPY is missing a handful of bars and starts later
+        frames['SPY'] = bars.iloc[20:].drop(index=bars.index[rng.choice(np.arange(40, 200), 8, replace=False)])
+        return frames
+
+    def test_matches_stock_chart(self):
+        frames = self._frames()
+        panel = StockPanel.FromFrames(frames)
+        assert panel.shape == (200, 3)
+        assert panel.mask.sum(axis=0).tolist() == [200, 200, 172]
+        panel.CalculateMovingAvg(30)
+        panel.CalculateAnnualizedVolatility()
+        for ticker, df in frames.items():
+            chart = StockChart(ticker)
+            chart.data = df.copy()
+            chart.CalculateMovingAvg(30)
+            chart.Calculate30DayAnnualizedVolatility()
+            from_panel = panel.Chart(ticker).data
+            pd.testing.assert_frame_equal(from_panel[chart.data.columns], chart.data, check_freq=False,
+                                          check_names=False)
+        vol = panel[ColumnNames.ANNUAL_VOL]
+        assert vol.columns.tolist() == ['MSFT', 'AMZN', 'SPY']
+        assert vol['SPY'][~panel.mask[:, 2]].isna().all()
+
+    def test_intermediates_are_shared(self):
+        panel = StockPanel.FromFrames(self._frames())
+        panel.CalculateAnnualizedVolatility(window=30)
+        panel.CalculateAnnualizedVolatility(window=60)
+        assert ColumnNames.ANNUAL_VOL.make_column_name(60) in panel.fields
+        assert len(panel._indicators) == 4
@@ -0,0 +1,113 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+from src.cleaning import apply_to_chunks, remove_columns
+from src.constants import DAY_VOLUME, DIVIDEND_AMT, SPLIT_COEFFICIENT
+from src.stocks import StockChart
+from src.utils import write_data, read_latest, write_model, read_latest_model, get_latest_file, \
+    get_latest_data_filename, update_manifest, MANIFEST_FILE
+
+
+def _record_datasets(folder, names):
+    for name in names:
+        update_manifest(folder / f'{name}_latest.csv', name)
+
+
+@pytest.fixture
+def bars():
+    dates = pd.bdate_range('2000-01-03', periods=500, name='date')
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'close': rng.uniform(10, 20, 500), 'volume': rng.integers(0, 10**6, 500),
+                         'dividend amt': np.zeros(500)}, index=dates)
+
+
+class TestStorageFormats:
+
+    @pytest.mark.parametrize('file_format', ['parquet', 'feather'])
+    def test_binary_round_trip(self, tmp_path, bars, file_format):
+        (tmp_path / 'interim').mkdir()
+        write_data(bars, 'msft', data_path=tmp_path, folder='interim', file_format=file_format, with_ts=False)
+        df = read_latest('msft', data_path=tmp_path, folder='interim', file_format=file_format)
+        pd.testing.assert_frame_equal(df, bars, check_freq=False)
+
+        projected = read_latest('msft', data_path=tmp_path, folder='interim', file_format=file_format,
+                                columns=['close'])
+        assert list(projected.columns) == ['close']
+        assert isinstance(projected.index, pd.DatetimeIndex)
+
+    def test_csv_column_projection(self, tmp_path, bars):
+        (tmp_path / 'interim').mkdir()
+        write_data(bars, 'msft', data_path=tmp_path, folder='interim')
+        df = read_latest('msft', data_path=tmp_path, folder='interim', columns='volume')
+        assert list(df.columns) == ['volume']
+        assert len(df) == 500
+
+
+class TestManifest:
+
+    def test_latest_version_from_manifest(self, tmp_path, bars, monkeypatch):
+        (tmp_path / 'interim').mkdir()
+        write_data(bars, 'msft', data_path=tmp_path, folder='interim', with_ts=False)
+        write_data(bars.iloc[:10], 'msft_options', data_path=tmp_path, folder='interim', with_ts=False)
+        manifest = json.loads((tmp_path / 'interim' / MANIFEST_FILE).read_text())
+        assert set(manifest) == {'msft', 'msft_options'}
+
+        # the manifest lookup doesn't need to scan the folder
+        monkeypatch.setattr(type(tmp_path), 'glob', lambda *args: pytest.fail('scanned the folder'))
+        assert get_latest_data_filename('msft', 'interim', data_path=tmp_path) == 'msft_options_latest.csv'
+        assert get_latest_data_filename('msft', 'interim', data_path=tmp_path, exact=True) == 'msft_latest.csv'
+        assert len(read_latest('msft', data_path=tmp_path, folder='interim', exact=True)) == len(bars)
+
+    def test_exact_match_without_manifest(self, tmp_path, bars):
+        bars.to_csv(tmp_path / 'msft_012920.csv')
+        bars.iloc[:5].to_csv(tmp_path / 'msft_options_012920.csv')
+        assert get_latest_file(tmp_path, 'msft', '.csv', exact=True) == 'msft_012920.csv'
+
+    def test_models_are_in_manifest(self, tmp_path):
+        write_model({'a': 1}, 'lgbm', model_path=tmp_path)
+        write_model({'a': 2}, 'lgbm_tuned', model_path=tmp_path)
+        assert read_latest_model('lgbm', model_path=tmp_path, exact=True) == {'a': 1}
+        assert read_latest_model('lgbm', model_path=tmp_path) == {'a': 2}
+
+
+    def test_concurrent_processes_keep_every_entry(self, tmp_path):
+        names = [[f'ds{worker}_{i}' for i in range(25)] for worker in range(4)]
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            list(pool.map(_record_datasets, [tmp_path] * 4, names))
+        manifest = json.loads((tmp_path / MANIFEST_FILE).read_text())
+        assert set(manifest) == {name for chunk in names for name in chunk}
+
+
+class TestStreaming:
+
+    @pytest.mark.parametrize('file_format', ['csv', 'parquet', 'feather'])
+    def test_chunks_with_pushdown(self, tmp_path, bars, file_format):
+        (tmp_path / 'raw').mkdir()
+        kwargs = {'row_group_size': 50} if file_format == 'parquet' else {}
+        write_data(bars, 'msft', data_path=tmp_path, folder='raw', file_format=file_format, **kwargs)
+        chunks = list(read_latest('msft', data_path=tmp_path, folder='raw', file_format=file_format, chunksize=64,
+                                  columns=['close'], start='2000-06-01', end='2000-09-30'))
+        df = pd.concat(chunks)
+        assert all(len(c) <= 64 for c in chunks)
+        assert list(df.columns) == ['close']
+        assert df.index.min() >= pd.Timestamp('2000-06-01') and df.index.max() <= pd.Timestamp('2000-09-30')
+        assert len(df) == len(bars.loc['2000-06-01':'2000-09-30'])
+
+    def test_cleaning_and_indicators_consume_chunks(self, tmp_path, bars):
+        (tmp_path / 'raw').mkdir()
+        bars[SPLIT_COEFFICIENT] = 1.
+        bars.loc[bars.index[100], DIVIDEND_AMT] = 0.5
+        write_data(bars, 'msft', data_path=tmp_path, folder='raw', float_format=None)
+        chunks = read_latest('msft', data_path=tmp_path, folder='raw', chunksize=70, start='2000-01-01')
+        chunks = apply_to_chunks(chunks, lambda df: remove_columns(df, DAY_VOLUME))
+        streamed = pd.concat(StockChart.CalculateInChunks('MSFT', chunks, moving_avg_days=[30], volatility=True))
+
+        chart = StockChart('MSFT')
+        chart.data = read_latest('msft', data_path=tmp_path, folder='raw', start='2000-01-01').drop(
+            columns=DAY_VOLUME)
+        chart.CalculateMovingAvg(30)
+        chart.Calculate30DayAnnualizedVolatility()
+        assert DAY_VOLUME not in streamed.columns
+        pd.testing.assert_frame_equal(streamed, chart.data)
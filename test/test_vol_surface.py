@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from src import vol_surface
+from src.pricing_model import BlackSholesArray
+from src.vol_surface import VolSurface, get_surface, _svi
+
+
+class TestVolSurface:
+
+    spot, rate = 170., 0.017
+    strikes, days = np.meshgrid(np.linspace(120, 220, 21), [30, 60, 120, 250])
+
+    def _vols(self, strikes, days):
+        T = days / 365
+        k = np.log(strikes / (self.spot * np.exp(self.rate * T)))
+        return np.sqrt(_svi((0.02 * T / 0.25, 0.1 * np.sqrt(T), -0.5, 0., 0.2), k) / T)
+
+    @pytest.mark.parametrize('method', ['svi', 'spline'])
+    def test_fit_reproduces_quotes(self, method):
+        vols = self._vols(self.strikes, self.days)
+        surface = VolSurface.fit(self.strikes, self.days, vols, self.spot, self.rate, method=method)
+        assert np.allclose(surface(self.strikes, self.days), vols, atol=1e-5)
+        # between expiries the total variance is interpolated, outside them the vol is flat
+        assert min(surface(170., 60), surface(170., 120)) < surface(170., 90) < max(surface(170., 60),
+                                                                                  surface(170., 120))
+        forward = lambda days: self.spot * np.exp(self.rate * days / 365)
+        assert np.isclose(surface(forward(400), 400), surface(forward(250), 250))
+
+    def test_vectorized_lookup_and_pricing(self):
+        vols = self._vols(self.strikes, self.days)
+        calls, _ = BlackSholesArray(self.spot, self.strikes, vols, self.rate, self.days)
+        surface = VolSurface.from_prices(calls, self.strikes, self.days, self.spot, self.rate)
+        rng = np.random.default_rng(0)
+        strikes, days = rng.uniform(130, 210, 10000), rng.uniform(10, 300, 10000)
+        calls, puts = surface.price(strikes, days)
+        assert calls.shape == (10000,) and np.isfinite(calls).all() and (puts > 0).all()
+        assert np.allclose(surface(self.strikes, self.days), vols, atol=1e-5)
+
+    def test_saved_surface_is_reused(self, tmp_path):
+        vols = self._vols(self.strikes, self.days)
+        fitted = get_surface('msft_vol', self.strikes, self.days, vols, self.spot, self.rate, model_path=tmp_path)
+        vol_surface._surface_cache.clear()
+        reloaded = get_surface('msft_vol', self.strikes, self.days, vols, self.spot, self.rate, model_path=tmp_path)
+        assert reloaded.fingerprint == fitted.fingerprint
+        # the same quotes as numpy scalars and integer strikes are still the same surface
+        same = get_surface('msft_vol', self.strikes.astype(int), self.days, vols, np.float64(self.spot),
+                           np.float64(self.rate), model_path=tmp_path)
+        assert same is reloaded
+        assert np.allclose(reloaded(self.strikes, self.days), fitted(self.strikes, self.days))
+        refit = get_surface('msft_vol', self.strikes, self.days, vols * 1.1, self.spot, self.rate,
+                            model_path=tmp_path)
+        assert refit.fingerprint != fitted.fingerprint